@@ -14,18 +14,125 @@ backup_original_jar() {
     log "Backed up $jar_file -> $BACKUP_DIR/$base_name"
 }
 
+# ----------------------------------------------
+# Decompile cache
+# ----------------------------------------------
+# Pristine apktool output, keyed by the SHA-256 of the JAR and of apktool.jar, so a JAR that was
+# decompiled before (same ROM) skips apktool d. A hit is restored as a copy-on-write (reflink)
+# copy where the filesystem supports it, otherwise as a farm of hard links: the patch tools
+# replace the files they change instead of writing into them, so only those get a copy of
+# their own. Least recently used entries are evicted above DECOMPILE_CACHE_MAX_MB.
+# DECOMPILE_CACHE=0 turns the cache off.
+
+DECOMPILE_CACHE="${DECOMPILE_CACHE:-1}"
+DECOMPILE_CACHE_DIR="${DECOMPILE_CACHE_DIR:-${XDG_CACHE_HOME:-$HOME/.cache}/framework-patcher/decompile}"
+DECOMPILE_CACHE_MAX_MB="${DECOMPILE_CACHE_MAX_MB:-4096}"
+
+# decompile_cache_key <jar_file>
+decompile_cache_key() {
+    local jar_hash apktool_hash
+    jar_hash=$(sha256sum "$1" | cut -d' ' -f1) || return 1
+    apktool_hash=$(sha256sum "${TOOLS_DIR}/apktool.jar" | cut -d' ' -f1) || return 1
+    echo "${jar_hash}-apktool-${apktool_hash:0:16}"
+}
+
+# copy_tree <src> <dst>: reflink copy, else hard links, else a plain copy
+copy_tree() {
+    cp -a --reflink=always "$1" "$2" 2>/dev/null && return 0
+    rm -rf "$2"
+    cp -al "$1" "$2" 2>/dev/null && return 0
+    rm -rf "$2"
+    cp -a "$1" "$2"
+}
+
+# decompile_cache_restore <key> <output_dir>
+decompile_cache_restore() {
+    local entry="${DECOMPILE_CACHE_DIR}/$1"
+    local output_dir="$2"
+
+    [ -f "$entry/.complete" ] || return 1
+
+    # A file written through one of its hard links would have changed the entry as well
+    if [ -n "$(find "$entry/tree" -type f -newer "$entry/.complete" -print -quit 2>/dev/null)" ]; then
+        warn "Decompile cache entry $1 was modified after it was stored, dropping it"
+        rm -rf "$entry"
+        return 1
+    fi
+
+    rm -rf "$output_dir"
+    copy_tree "$entry/tree" "$output_dir" || {
+        rm -rf "$output_dir"
+        return 1
+    }
+    touch "$entry/.last_used"
+    log "Decompile cache hit: restored $output_dir without apktool"
+}
+
+# decompile_cache_store <key> <output_dir>
+decompile_cache_store() {
+    local key="$1"
+    local output_dir="$2"
+    local entry="${DECOMPILE_CACHE_DIR}/$key"
+    local tmp="${DECOMPILE_CACHE_DIR}/.tmp.${key}.$$"
+
+    [ -f "$entry/.complete" ] && return 0
+    mkdir -p "$tmp" || return 1
+    copy_tree "$output_dir" "$tmp/tree" || {
+        warn "Could not store $output_dir in the decompile cache"
+        rm -rf "$tmp"
+        return 1
+    }
+    du -sk "$tmp/tree" | cut -f1 >"$tmp/.size"
+    touch "$tmp/.complete" "$tmp/.last_used"
+
+    # Another run may have stored the same JAR meanwhile
+    mv -T "$tmp" "$entry" 2>/dev/null || rm -rf "$tmp"
+    log "Stored $(basename "$output_dir") in the decompile cache"
+    decompile_cache_evict "$key"
+}
+
+# decompile_cache_evict [key_to_keep]: drop least recently used entries above the size cap
+decompile_cache_evict() {
+    local keep="${1:-}"
+    local max_kb=$((DECOMPILE_CACHE_MAX_MB * 1024))
+    local total_kb=0
+    local marker entry size_kb
+
+    # Most recently used first
+    while IFS= read -r marker; do
+        entry=$(dirname "$marker")
+        size_kb=$(cat "$entry/.size" 2>/dev/null || echo 0)
+        if [ $((total_kb + size_kb)) -gt "$max_kb" ] && [ "$(basename "$entry")" != "$keep" ]; then
+            log "Evicting $(basename "$entry") from the decompile cache"
+            rm -rf "$entry"
+            continue
+        fi
+        total_kb=$((total_kb + size_kb))
+    done < <(ls -1t "$DECOMPILE_CACHE_DIR"/*/.last_used 2>/dev/null)
+}
+
 decompile_jar() {
     local jar_file="$1"
     local base_name
     base_name=$(basename "$jar_file" .jar)
     local output_dir="${WORK_DIR}/${base_name}_decompile"
 
-    log "Decompiling $jar_file -> $output_dir (apktool)"
     rm -rf "$output_dir" "$base_name" >/dev/null 2>&1 || true
-    mkdir -p "$output_dir"
 
     backup_original_jar "$jar_file"
 
+    local cache_key=""
+    if [ "$DECOMPILE_CACHE" = "1" ]; then
+        cache_key=$(decompile_cache_key "$jar_file") || cache_key=""
+        if [ -n "$cache_key" ] && decompile_cache_restore "$cache_key" "$output_dir"; then
+            echo "$output_dir"
+            return 0
+        fi
+    fi
+
+    log "Decompiling $jar_file -> $output_dir (apktool)"
+    mkdir -p "$output_dir"
+
     java -jar "${TOOLS_DIR}/apktool.jar" d -q -f "$jar_file" -o "$output_dir" || {
         err "apktool failed to decompile $jar_file"
         return 1
@@ -49,6 +156,8 @@ decompile_jar() {
         fi
     done
 
+    [ -n "$cache_key" ] && { decompile_cache_store "$cache_key" "$output_dir" || true; }
+
     echo "$output_dir"
 }
 
@@ -183,3 +292,21 @@ d8_optimize_jar() {
     rm "${jar_file}.bak"
     rm -rf "$work_dir"
 }
+
+# run_jar_pipeline <api_level> <device_name> <version_name> <kaorios 0|1> [--jar <name>[=<decompile_dir>]]...
+# Decompiles, patches (PATCH_SPEC, selected features) and rebuilds the given JARs in parallel
+# with core/jar_pipeline.py, then creates the module once all of them are done.
+run_jar_pipeline() {
+    local api_level="$1"
+    local device_name="$2"
+    local version_name="$3"
+    local kaorios_enabled="$4"
+    shift 4
+
+    local args=(--spec "$PATCH_SPEC" --features "$(selected_patch_features)")
+    [ "$kaorios_enabled" -eq 1 ] && args+=(--kaorios)
+
+    WORK_DIR="$WORK_DIR" TOOLS_DIR="$TOOLS_DIR" BACKUP_DIR="$BACKUP_DIR" \
+        python3 "${SCRIPT_DIR}/core/jar_pipeline.py" "${args[@]}" "$@" \
+        --module "$api_level" "$device_name" "$version_name"
+}
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Map the targets of a patch plan to the DEX files of a JAR.
+
+An operation names its target either as a class or as text the target file contains
+(see core/smali_patcher.py). A DEX file holds a class when the class is among its class
+definitions. It can only hold a text when every class descriptor and member name in that
+text is in its string data, since smali code refers to classes, methods and fields by those
+strings. The DEX files found this way are the only ones that need baksmali and smali; the
+others can be left as they are. A plan with a text target that names nothing (no descriptor,
+member or method name) cannot be narrowed down and needs every DEX file.
+
+Usage: dex_targets.py <jar> --spec <spec.json> --jar <name> [--features <a,b,...>]
+"""
+
+import argparse
+import os
+import re
+import struct
+import sys
+import zipfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from smali_patcher import METHOD_OPERATIONS, class_key, compile_spec, load_spec, search_needle  # noqa: E402
+
+_DEX_NAME = re.compile(r"classes(\d*)\.dex$")
+_DESCRIPTOR = re.compile(r"L[^;\s(){}\[,]+;")
+_MEMBER = re.compile(r"->([^(:\s]+)")
+
+
+def dex_entries(jar):
+    """The classes*.dex entries of an open JAR, in DEX order."""
+    names = [info.filename for info in jar.infolist() if _DEX_NAME.fullmatch(info.filename)]
+    return sorted(names, key=lambda name: int(_DEX_NAME.fullmatch(name).group(1) or 1))
+
+
+def _uleb128(data, offset):
+    value = shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+
+
+def defined_classes(data):
+    """Class keys ('android/os/Foo') of the classes a DEX file defines."""
+    if data[:4] != b"dex\n":
+        raise ValueError("not a DEX file")
+    string_ids_off, = struct.unpack_from("<I", data, 0x3C)
+    type_ids_off, = struct.unpack_from("<I", data, 0x44)
+    class_defs_size, class_defs_off = struct.unpack_from("<II", data, 0x60)
+    classes = set()
+    for i in range(class_defs_size):
+        type_idx, = struct.unpack_from("<I", data, class_defs_off + 32 * i)
+        string_idx, = struct.unpack_from("<I", data, type_ids_off + 4 * type_idx)
+        string_off, = struct.unpack_from("<I", data, string_ids_off + 4 * string_idx)
+        _, start = _uleb128(data, string_off)
+        descriptor = data[start:data.index(b"\0", start)].decode("utf-8", "replace")
+        classes.add(class_key(descriptor))
+    return classes
+
+
+def text_names(op):
+    """Strings a DEX file must contain to hold the text target of op, or None if it names none."""
+    needle = search_needle(op)
+    if op["op"] in METHOD_OPERATIONS:
+        names = {needle.split("(", 1)[0].strip()}
+    else:
+        names = set(_DESCRIPTOR.findall(needle)) | set(_MEMBER.findall(needle))
+    names.discard("")
+    return {name.encode("utf-8") for name in names} or None
+
+
+def _holds_class(classes, name):
+    key = class_key(name)
+    if "/" in key:
+        return key in classes
+    return any(cls == key or cls.endswith(f"/{key}") for cls in classes)
+
+
+def select_dex(jar_path, plan):
+    """Names of the DEX entries that can hold a target of the plan, in DEX order.
+
+    Returns None when some target cannot be narrowed down to DEX files.
+    """
+    class_targets = [op["class"] for op in plan if op.get("class")]
+    text_targets = [text_names(op) for op in plan if not op.get("class")]
+    if None in text_targets:
+        return None
+
+    selected = []
+    with zipfile.ZipFile(jar_path) as jar:
+        for name in dex_entries(jar):
+            data = jar.read(name)
+            # Raw byte search is enough: a name in the string data is in the file
+            if any(all(raw in data for raw in names) for names in text_targets):
+                selected.append(name)
+                continue
+            if class_targets:
+                classes = defined_classes(data)
+                if any(_holds_class(classes, target) for target in class_targets):
+                    selected.append(name)
+    return selected
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog=os.path.basename(argv[0]),
+                                     description="List the DEX files a patch spec touches in a JAR.")
+    parser.add_argument("jar_path", help="JAR to inspect")
+    parser.add_argument("--spec", required=True, help="patch spec of the Android version")
+    parser.add_argument("--jar", required=True, help="JAR name in the spec")
+    parser.add_argument("--features", default="", help="comma-separated spec features")
+    args = parser.parse_args(argv[1:])
+
+    features = [feature for feature in args.features.split(",") if feature]
+    plan = compile_spec(load_spec(args.spec), args.jar, features)
+    selected = select_dex(args.jar_path, plan)
+    if selected is None:
+        print("all")
+    else:
+        print("\n".join(selected))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,370 @@
+#!/usr/bin/env python3
+"""
+Parallel multi-JAR patch pipeline.
+
+Every JAR goes through its stages in its own worker process: decompile (apktool d),
+patch (the version's patch spec, then Kaorios Toolbox for framework.jar), recompile
+(apktool b) and optimize (d8). The stages themselves are the shell helpers of
+helper.sh and core/smali_patcher.py, run as subprocesses.
+
+Where core/dex_targets.py can tell which DEX files hold the patch targets, a JAR takes
+the targeted route instead: only those DEX files are disassembled (baksmali), patched
+and assembled again (smali), and put back into a copy of the JAR, whose other entries
+stay byte for byte as they were. There is no apktool round trip and no d8 pass over
+the whole JAR then. DEX_TARGETED=0 turns this off; Kaorios Toolbox, which adds classes
+to framework.jar, always takes the full route.
+
+The JVM stages (apktool, baksmali/smali and d8) of all workers share one memory budget: each run
+reserves a heap sized from its JAR, is started with that heap as its -Xmx, and waits
+while the budget is used up. The budget is MemAvailable (less some headroom) unless
+PIPELINE_MEMORY_MB says otherwise, so a small machine runs the JARs one after another
+and a large one runs them side by side. The module is created once every JAR is done.
+Wall-clock time of every stage, and the wait for memory, is reported at the end.
+
+Usage: jar_pipeline.py --spec <spec.json> [--features <a,b,...>] [--kaorios]
+                       --jar <name>[=<decompile_dir>] ... [--module <api> <device> <version>]
+
+A JAR given with a decompile directory is patched in place, without decompile or rebuild.
+WORK_DIR, TOOLS_DIR and BACKUP_DIR are taken from the environment, as init_env does; the
+patched JARs and the module are written to the current directory, as by the patchers.
+"""
+
+import argparse
+import multiprocessing
+import os
+import shutil
+import subprocess
+import sys
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager, nullcontext
+
+from dex_targets import dex_entries, select_dex
+from smali_patcher import compile_spec, load_spec
+
+SCRIPT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HELPER = os.path.join(SCRIPT_DIR, "helper.sh")
+SMALI_PATCHER = os.path.join(SCRIPT_DIR, "core", "smali_patcher.py")
+KAORIOS_PATCHES = os.path.join(SCRIPT_DIR, "core", "kaorios_patches.sh")
+
+JARS = ("framework", "services", "miui-services")
+
+# JVM heap for one apktool/d8 run: a base plus a share of the JAR size, within bounds
+HEAP_BASE_MB = 512
+HEAP_PER_JAR_MB = 48
+HEAP_MIN_MB = 768
+HEAP_MAX_MB = 4096
+# Part of MemAvailable left to the runner itself and to the page cache
+MEMORY_HEADROOM = 0.2
+
+_budget = None
+
+
+def log(message):
+    # One write per line, so lines of concurrent workers do not interleave
+    sys.stderr.write(f"[INFO] {message}\n")
+    sys.stderr.flush()
+
+
+def warn(message):
+    sys.stderr.write(f"[WARN] {message}\n")
+    sys.stderr.flush()
+
+
+def err(message):
+    sys.stderr.write(f"[ERROR] {message}\n")
+    sys.stderr.flush()
+
+
+class StageError(Exception):
+    pass
+
+
+class MemoryBudget:
+    """Megabytes of RAM shared by the JVM stages of all workers."""
+
+    def __init__(self, total_mb, context):
+        self.total_mb = total_mb
+        self.free_mb = context.Value("i", total_mb, lock=False)
+        self.condition = context.Condition()
+
+    @contextmanager
+    def reserve(self, mb):
+        # A run larger than the whole budget still gets to go, alone
+        mb = min(mb, self.total_mb)
+        with self.condition:
+            while self.free_mb.value < mb:
+                self.condition.wait()
+            self.free_mb.value -= mb
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.free_mb.value += mb
+                self.condition.notify_all()
+
+
+def available_memory_mb():
+    """MemAvailable from /proc/meminfo, or the physical memory where that is missing."""
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) // 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // (1024 * 1024)
+    except (ValueError, OSError):
+        return HEAP_MAX_MB
+
+
+def heap_for(size):
+    size_mb = size / (1024 * 1024)
+    return int(min(HEAP_MAX_MB, max(HEAP_MIN_MB, HEAP_BASE_MB + HEAP_PER_JAR_MB * size_mb)))
+
+
+def _init_worker(budget):
+    global _budget
+    _budget = budget
+
+
+def _bash(function, *args, source=None):
+    """(argv, env) running a helper.sh function, after init_env, in a fresh bash."""
+    script = 'source "$0" || exit 1; if [ -n "$PIPELINE_SOURCE" ]; then source "$PIPELINE_SOURCE" || exit 1; fi; ' \
+             'init_env; "$@"'
+    return ["bash", "-c", script, HELPER, function, *args], {"PIPELINE_SOURCE": source or ""}
+
+
+def _smali_tool(tool, *args):
+    """argv running baksmali or smali: tools/<tool>.jar, or else the copy bundled in apktool.jar."""
+    tools_dir = os.environ.get("TOOLS_DIR") or os.path.join(os.getcwd(), "tools")
+    tool_jar = os.path.join(tools_dir, f"{tool}.jar")
+    if os.path.isfile(tool_jar):
+        return ["java", "-jar", tool_jar, *args]
+    return ["java", "-cp", os.path.join(tools_dir, "apktool.jar"), f"com.android.tools.smali.{tool}.Main", *args]
+
+
+def _smali_dir(dex_name):
+    """classes.dex -> smali, classesN.dex -> smali_classesN, as apktool lays them out."""
+    return "smali" if dex_name == "classes.dex" else f"smali_{dex_name[:-len('.dex')]}"
+
+
+def _command_name(argv):
+    """What a failed stage command is called in errors: helper function, script or tool."""
+    if argv[:2] == ["bash", "-c"]:
+        return argv[4]
+    if argv[0] == sys.executable:
+        return os.path.basename(argv[1])
+    if argv[0] == "java":
+        # -jar <tool>.jar, or -cp apktool.jar com.android.tools.smali.<tool>.Main
+        return os.path.basename(argv[2]) if argv[1] == "-jar" else argv[3].split(".")[-2]
+    return argv[0]
+
+
+def _run(label, argv, extra_env=None, heap_mb=None, cwd=None):
+    """Run a stage command, prefixing its output with the JAR name."""
+    env = dict(os.environ, **(extra_env or {}))
+    if heap_mb:
+        env["JAVA_TOOL_OPTIONS"] = f"{env.get('JAVA_TOOL_OPTIONS', '')} -Xmx{heap_mb}m".strip()
+    process = subprocess.Popen(argv, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, env=env, cwd=cwd)
+    for raw in process.stdout:
+        sys.stderr.write(f"[{label}] {raw.decode('utf-8', 'replace').rstrip()}\n")
+        sys.stderr.flush()
+    status = process.wait()
+    if status:
+        raise StageError(f"{_command_name(argv)} exited with status {status}")
+
+
+class JarJob:
+    """One JAR's stages, run in a worker process; records the timing of each."""
+
+    def __init__(self, jar, decompile_dir, spec, features, kaorios):
+        self.jar = jar
+        self.work_dir = os.environ.get("WORK_DIR") or os.getcwd()
+        self.jar_path = os.path.join(self.work_dir, f"{jar}.jar")
+        self.external = decompile_dir is not None
+        self.decompile_dir = decompile_dir or os.path.join(self.work_dir, f"{jar}_decompile")
+        self.spec = spec
+        self.features = features
+        self.kaorios = kaorios
+        self.timings = []
+
+    @contextmanager
+    def stage(self, name, heap_mb=None):
+        started = time.monotonic()
+        with _budget.reserve(heap_mb) if heap_mb else nullcontext():
+            waited = time.monotonic() - started
+            log(f"[{self.jar}] {name} started" + (f" ({heap_mb} MB heap)" if heap_mb else ""))
+            try:
+                yield
+            finally:
+                self.timings.append((name, time.monotonic() - started, waited))
+        log(f"[{self.jar}] {name} finished in {self.timings[-1][1]:.1f}s")
+
+    def _apply_spec(self, tree):
+        _run(self.jar, [sys.executable, SMALI_PATCHER, tree, "--spec", self.spec,
+                        "--jar", self.jar, "--features", ",".join(self.features)])
+
+    def run(self):
+        if (not self.external and os.environ.get("DEX_TARGETED", "1") == "1"
+                and not (self.kaorios and self.jar == "framework") and self.run_targeted()):
+            return
+
+        heap_mb = heap_for(os.path.getsize(self.jar_path)) if os.path.isfile(self.jar_path) else HEAP_MIN_MB
+        if not self.external:
+            with self.stage("decompile", heap_mb):
+                _run(self.jar, *_bash("decompile_jar", self.jar_path), heap_mb=heap_mb)
+
+        with self.stage("patch"):
+            self._apply_spec(self.decompile_dir)
+            if self.kaorios and self.jar == "framework":
+                _run(self.jar, *_bash("apply_kaorios_toolbox_patches", self.decompile_dir, source=KAORIOS_PATCHES))
+
+        if self.external:
+            log(f"[{self.jar}] Patched existing decompile dir {self.decompile_dir} (no rebuild)")
+            return
+
+        patched_jar = f"{self.jar}_patched.jar"
+        with self.stage("recompile", heap_mb):
+            _run(self.jar, *_bash("recompile_jar", self.jar_path), heap_mb=heap_mb)
+        with self.stage("optimize", heap_mb):
+            _run(self.jar, *_bash("d8_optimize_jar", patched_jar), heap_mb=heap_mb)
+
+        shutil.rmtree(self.decompile_dir, ignore_errors=True)
+        shutil.rmtree(os.path.join(self.work_dir, self.jar), ignore_errors=True)
+        if not os.path.isfile(patched_jar):
+            raise StageError(f"{patched_jar} was not created")
+
+    def run_targeted(self):
+        """Patch only the DEX files holding a target; False where the full route is needed."""
+        work = os.path.join(self.work_dir, f"{self.jar}_dex_work")
+        patched_jar = f"{self.jar}_patched.jar"
+        shutil.rmtree(work, ignore_errors=True)
+        try:
+            spec = load_spec(self.spec)
+            selected = select_dex(self.jar_path, compile_spec(spec, self.jar, self.features))
+            if selected is None:
+                log(f"[{self.jar}] Some patch targets cannot be traced to a DEX file, patching all of them")
+                return False
+            api_level = str(spec.get("api_level", 30))
+
+            with zipfile.ZipFile(self.jar_path) as jar:
+                total = len(dex_entries(jar))
+                for name in selected:
+                    jar.extract(name, os.path.join(work, "in"))
+                stored = {name for name in selected if jar.getinfo(name).compress_type == zipfile.ZIP_STORED}
+            log(f"[{self.jar}] Targeted mode: {len(selected)} of {total} DEX file(s) hold patch targets"
+                + (f" ({', '.join(selected)})" if selected else ""))
+
+            tree = os.path.join(work, "tree")
+            out = os.path.join(work, "out")
+            os.makedirs(out)
+            heap_mb = heap_for(sum(os.path.getsize(os.path.join(work, "in", name)) for name in selected))
+            if selected:
+                with self.stage("disassemble", heap_mb):
+                    for name in selected:
+                        _run(self.jar, _smali_tool("baksmali", "d", os.path.join(work, "in", name),
+                                                   "-o", os.path.join(tree, _smali_dir(name)), "-a", api_level),
+                             heap_mb=heap_mb)
+                with self.stage("patch"):
+                    self._apply_spec(tree)
+
+            with self.stage("assemble", heap_mb if selected else None):
+                for name in selected:
+                    _run(self.jar, _smali_tool("smali", "a", os.path.join(tree, _smali_dir(name)),
+                                               "-o", os.path.join(out, name), "-a", api_level), heap_mb=heap_mb)
+                # The other entries are copied over as they are; zip only replaces the assembled ones
+                shutil.copyfile(self.jar_path, patched_jar)
+                for names, level in ((sorted(stored), ["-0"]), (sorted(set(selected) - stored), [])):
+                    if names:
+                        _run(self.jar, ["zip", "-q", "-X", *level, os.path.abspath(patched_jar), *names], cwd=out)
+        except (StageError, OSError, ValueError, zipfile.BadZipFile) as e:
+            warn(f"[{self.jar}] Targeted mode failed ({e}), patching every DEX file")
+            if os.path.isfile(patched_jar):
+                os.remove(patched_jar)
+            return False
+        finally:
+            shutil.rmtree(work, ignore_errors=True)
+        return True
+
+
+def run_job(jar, decompile_dir, spec, features, kaorios):
+    """Worker entry point: (jar, stage timings, error or None)."""
+    job = JarJob(jar, decompile_dir, spec, features, kaorios)
+    try:
+        job.run()
+        return jar, job.timings, None
+    except (StageError, OSError) as e:
+        return jar, job.timings, str(e)
+
+
+def _format_timings(timings):
+    parts = []
+    for name, elapsed, waited in timings:
+        parts.append(f"{name} {elapsed:.1f}s" + (f" (waited {waited:.1f}s for memory)" if waited >= 0.1 else ""))
+    return " | ".join(parts) or "no stages"
+
+
+def parse_jar(value):
+    jar, _, decompile_dir = value.partition("=")
+    if jar not in JARS:
+        raise argparse.ArgumentTypeError(f"unknown JAR {jar!r} (expected one of {', '.join(JARS)})")
+    return jar, decompile_dir or None
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog=os.path.basename(argv[0]),
+                                     description="Decompile, patch and rebuild JARs in parallel.")
+    parser.add_argument("--spec", required=True, help="patch spec of the Android version")
+    parser.add_argument("--features", default="", help="comma-separated spec features to apply")
+    parser.add_argument("--kaorios", action="store_true", help="also apply Kaorios Toolbox to framework.jar")
+    parser.add_argument("--jar", dest="jars", action="append", type=parse_jar, default=[],
+                        help="JAR to patch, optionally =<existing decompile dir>")
+    parser.add_argument("--module", nargs=3, metavar=("API", "DEVICE", "VERSION"),
+                        help="create the module once every JAR is done")
+    args = parser.parse_args(argv[1:])
+
+    features = [feature for feature in args.features.split(",") if feature]
+    started = time.monotonic()
+    results = []
+    if args.jars:
+        context = multiprocessing.get_context()
+        total_mb = int(os.environ.get("PIPELINE_MEMORY_MB") or available_memory_mb() * (1 - MEMORY_HEADROOM))
+        budget = MemoryBudget(max(total_mb, HEAP_MIN_MB), context)
+        log(f"Patching {', '.join(jar for jar, _ in args.jars)} in parallel "
+            f"({budget.total_mb} MB memory budget for apktool/d8)")
+        with ProcessPoolExecutor(max_workers=len(args.jars), mp_context=context,
+                                 initializer=_init_worker, initargs=(budget,)) as pool:
+            futures = [pool.submit(run_job, jar, decompile_dir, args.spec, features, args.kaorios)
+                       for jar, decompile_dir in args.jars]
+            results = [future.result() for future in futures]
+
+    failed = [(jar, error) for jar, _, error in results if error]
+    module_time = None
+    if not failed and args.module:
+        module_started = time.monotonic()
+        api_level, device_name, version_name = args.module
+        try:
+            _run("module", *_bash("create_module", api_level, device_name, version_name,
+                                  "1" if args.kaorios else "0"))
+        except StageError as e:
+            failed.append(("module", str(e)))
+        module_time = time.monotonic() - module_started
+
+    log("Stage timings (wall clock):")
+    for jar, timings, error in results:
+        log(f"  {jar:<14} {_format_timings(timings)}" + (" | FAILED" if error else ""))
+    if module_time is not None:
+        log(f"  {'module':<14} create {module_time:.1f}s")
+    stage_total = sum(elapsed for _, timings, _ in results for _, elapsed, _ in timings)
+    log(f"Pipeline finished in {time.monotonic() - started:.1f}s ({stage_total:.1f}s of JAR stages)")
+
+    for name, error in failed:
+        err(f"{name}: {error}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -170,7 +170,10 @@ else:
     print("hasSystemFeature(String, int) method not found")
 
 if modified:
-    target_file.write_text('\n'.join(lines) + '\n')
+    # Replace the file rather than write into it (it may be a hard link into the decompile cache)
+    tmp_file = target_file.with_name(target_file.name + '.tmp')
+    tmp_file.write_text('\n'.join(lines) + '\n')
+    tmp_file.replace(target_file)
     print("✓ Successfully patched ApplicationPackageManager.smali with V1.0.7 approach")
 else:
     print("No changes needed or already patched")
@@ -262,7 +265,9 @@ while i < len(lines):
     i += 1
 
 if modified:
-    target_file.write_text('\n'.join(lines) + '\n')
+    tmp_file = target_file.with_name(target_file.name + '.tmp')
+    tmp_file.write_text('\n'.join(lines) + '\n')
+    tmp_file.replace(target_file)
     print("✓ Patched Instrumentation.newApplication methods")
 else:
     print("No changes needed or patch already applied")
@@ -350,7 +355,9 @@ while i < len(lines):
     i += 1
 
 if modified:
-    target_file.write_text('\n'.join(lines) + '\n')
+    tmp_file = target_file.with_name(target_file.name + '.tmp')
+    tmp_file.write_text('\n'.join(lines) + '\n')
+    tmp_file.replace(target_file)
     print("✓ Patched KeyStore2.getKeyEntry")
 else:
     print("No changes needed or patch already applied")
@@ -478,7 +485,9 @@ while i < len(lines):
     i += 1
 
 if modified:
-    target_file.write_text('\n'.join(lines) + '\n')
+    tmp_file = target_file.with_name(target_file.name + '.tmp')
+    tmp_file.write_text('\n'.join(lines) + '\n')
+    tmp_file.replace(target_file)
     print("✓ Patched AndroidKeyStoreSpi.engineGetCertificateChain")
 else:
     print("No changes needed or patch already applied")
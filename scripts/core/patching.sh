@@ -2,122 +2,143 @@
 # scripts/core/patching.sh
 # Smali patching functions
 
-find_smali_method_file() {
-    local decompile_dir="$1"
-    local method="$2"
-    # returns first match (stdout)
-    find "$decompile_dir" -type f -name "*.smali" -print0 |
-        xargs -0 grep -s -l -- ".method" 2>/dev/null |
-        xargs -r -I{} sh -c "grep -s -q \"[[:space:]]*\\.method.*${method}\" \"{}\" && printf '%s\n' \"{}\"" |
-        head -n1
+# ----------------------------------------------
+# Patch plans
+# ----------------------------------------------
+# Patch functions queue operations for core/smali_patcher.py instead of editing files one by
+# one. begin_patch_plan opens a plan; apply_patch_plan then applies all of it in one pass over
+# the decompiled tree, writing each touched file once. Outside a plan, each operation is
+# applied on its own right away.
+
+PATCH_PLAN=""
+
+json_string() {
+    local s="$1"
+    s=${s//\\/\\\\}
+    s=${s//\"/\\\"}
+    s=${s//$'\n'/\\n}
+    s=${s//$'\t'/\\t}
+    printf '"%s"' "$s"
 }
 
-add_static_return_patch() {
-    local method="$1"
-    local ret_val="$2" # expect hex nibble w/o 0x OR decimal (we assume hex nibble for const/4 usage)
-    local decompile_dir="$3"
-    local file
+begin_patch_plan() {
+    PATCH_PLAN=$(mktemp "${TMPDIR:-/tmp}/patch_plan.XXXXXX")
+}
 
-    [ -z "$method" ] || true
-    [ -z "$decompile_dir" ] && {
-        err "add_static_return_patch: missing decompile_dir"
-        return 1m
-    }
+# plan_op <decompile_dir> <op> [field value]... ("all" takes 0 or 1)
+plan_op() {
+    local decompile_dir="$1"
+    local op="$2"
+    shift 2
+
+    local json="{\"op\":$(json_string "$op")"
+    while [ $# -ge 2 ]; do
+        if [ "$1" = "all" ]; then
+            [ "$2" = "1" ] && json+=",\"all\":true"
+        else
+            json+=",$(json_string "$1"):$(json_string "$2")"
+        fi
+        shift 2
+    done
+    json+="}"
 
-    file=$(find_smali_method_file "$decompile_dir" "$method")
-    [ -z "$file" ] && {
-        warn "Method $method not found in $decompile_dir"
+    if [ -n "$PATCH_PLAN" ]; then
+        printf '%s\n' "$json" >>"$PATCH_PLAN"
         return 0
-    }
+    fi
 
-    local start
-    start=$(grep -n "^[[:space:]]*\.method.* ${method}" "$file" | cut -d: -f1 | head -n1)
-    [ -z "$start" ] && {
-        warn "Method $method start not found"
-        return 0
-    }
+    # No plan open: apply this operation alone
+    begin_patch_plan
+    printf '%s\n' "$json" >>"$PATCH_PLAN"
+    apply_patch_plan "$decompile_dir"
+}
 
-    local total_lines end=0 i="$start" line
-    total_lines=$(wc -l <"$file")
-    while [ "$i" -le "$total_lines" ]; do
-        line=$(sed -n "${i}p" "$file")
-        [[ "$line" == *".end method"* ]] && {
-            end="$i"
-            break
-        }
-        i=$((i + 1))
-    done
+apply_patch_plan() {
+    local decompile_dir="$1"
+    local plan="$PATCH_PLAN"
+    PATCH_PLAN=""
 
-    [ "$end" -eq 0 ] && {
-        warn "End not found for $method in $file"
-        return 0
+    [ -z "$plan" ] && {
+        err "apply_patch_plan: no patch plan open"
+        return 1
+    }
+    [ -z "$decompile_dir" ] && {
+        err "apply_patch_plan: missing decompile_dir"
+        rm -f "$plan"
+        return 1
     }
 
-    local method_head
-    method_head=$(sed -n "${start}p" "$file")
-    method_head_escaped=$(printf "%s\n" "$method_head" | sed 's/\\/\\\\/g')
-
-    # Replace method body with a simple const/return
-    sed -i "${start},${end}c\\
-$method_head_escaped\\
-    .registers 8\\
-    const/4 v0, 0x${ret_val}\\
-    return v0\\
-.end method" "$file"
+    local status=0
+    python3 "${SCRIPT_DIR}/core/smali_patcher.py" "$decompile_dir" "$plan" || status=$?
+    rm -f "$plan"
+    [ "$status" -ne 0 ] && err "Patch plan failed for $decompile_dir"
+    return "$status"
+}
 
-    log "Patched $method in $file to return 0x${ret_val}"
+# ----------------------------------------------
+# Patch specs
+# ----------------------------------------------
+# The patches of each Android version are data: scripts/patches/android<N>.json lists the
+# operations for every JAR and feature. apply_patch_spec compiles the selected features of
+# one JAR into a single plan and applies it. Patchers point PATCH_SPEC at their spec file.
+
+PATCH_SPEC="${PATCH_SPEC:-}"
+
+# Comma-separated spec features for the FEATURE_* flags that are set
+selected_patch_features() {
+    local features=()
+    [ "${FEATURE_DISABLE_SIGNATURE_VERIFICATION:-0}" -eq 1 ] && features+=("disable-signature-verification")
+    [ "${FEATURE_CN_NOTIFICATION_FIX:-0}" -eq 1 ] && features+=("cn-notification-fix")
+    [ "${FEATURE_DISABLE_SECURE_FLAG:-0}" -eq 1 ] && features+=("disable-secure-flag")
+    local IFS=,
+    echo "${features[*]}"
 }
 
-patch_return_void_method() {
-    local method="$1"
-    local decompile_dir="$2"
-    local file
+# apply_patch_spec <decompile_dir> <framework|services|miui-services> [spec]
+apply_patch_spec() {
+    local decompile_dir="$1"
+    local jar="$2"
+    local spec="${3:-$PATCH_SPEC}"
 
     [ -z "$decompile_dir" ] && {
-        err "patch_return_void_method: missing decompile_dir"
+        err "apply_patch_spec: missing decompile_dir"
         return 1
     }
-
-    file=$(find_smali_method_file "$decompile_dir" "$method")
-    [ -z "$file" ] && {
-        warn "Method $method not found in $decompile_dir"
-        return 0
+    [ ! -f "$spec" ] && {
+        err "apply_patch_spec: patch spec not found: ${spec:-<unset>}"
+        return 1
     }
 
-    local start
-    start=$(grep -n "^[[:space:]]*\.method.* ${method}" "$file" | cut -d: -f1 | head -n1)
-    [ -z "$start" ] && {
-        warn "Method $method start not found"
-        return 0
+    python3 "${SCRIPT_DIR}/core/smali_patcher.py" "$decompile_dir" --spec "$spec" --jar "$jar" \
+        --features "$(selected_patch_features)" || {
+        err "Patch spec failed for $jar.jar"
+        return 1
     }
+}
 
-    local total_lines end=0 i="$start" line
-    total_lines=$(wc -l <"$file")
-    while [ "$i" -le "$total_lines" ]; do
-        line=$(sed -n "${i}p" "$file")
-        [[ "$line" == *".end method"* ]] && {
-            end="$i"
-            break
-        }
-        i=$((i + 1))
-    done
+add_static_return_patch() {
+    local method="$1"
+    local ret_val="$2" # hex nibble w/o 0x, used as const/4 v0, 0x<ret_val>
+    local decompile_dir="$3"
 
-    [ "$end" -eq 0 ] && {
-        warn "Method $method end not found"
-        return 0
+    [ -z "$decompile_dir" ] && {
+        err "add_static_return_patch: missing decompile_dir"
+        return 1
     }
 
-    local method_head
-    method_head=$(sed -n "${start}p" "$file")
-    method_head_escaped=$(printf "%s\n" "$method_head" | sed 's/\\/\\\\/g')
+    plan_op "$decompile_dir" return_const method "$method" value "$ret_val"
+}
 
-    sed -i "${start},${end}c\\
-$method_head_escaped\\
-    .registers 8\\
-    return-void\\
-.end method" "$file"
+patch_return_void_method() {
+    local method="$1"
+    local decompile_dir="$2"
+
+    [ -z "$decompile_dir" ] && {
+        err "patch_return_void_method: missing decompile_dir"
+        return 1
+    }
 
-    log "Patched $method in $file to return-void"
+    plan_op "$decompile_dir" return_void method "$method"
 }
 
 modify_invoke_custom_methods() {
@@ -186,54 +207,6 @@ patch_return_void_methods_all() {
         return 1
     }
 
-    # Find all files containing the method
-    local files
-    files=$(find "$decompile_dir" -type f -name "*.smali" -exec grep -s -l "^[[:space:]]*\\.method.*${method_name}" {} + 2>/dev/null || true)
-
-    [ -z "$files" ] && {
-        warn "No occurrences of ${method_name} found in $decompile_dir"
-        return 0
-    }
-
-    local file
-    for file in $files; do
-        # Patch each occurrence within the file
-        # We iterate from bottom to top to keep line numbers stable
-        local starts
-        starts=$(grep -n "^[[:space:]]*\\.method.*${method_name}" "$file" | cut -d: -f1 | sort -nr)
-        [ -z "$starts" ] && continue
-
-        local start end total_lines i line method_head method_head_escaped
-        total_lines=$(wc -l <"$file")
-
-        for start in $starts; do
-            end=0
-            i="$start"
-            while [ "$i" -le "$total_lines" ]; do
-                line=$(sed -n "${i}p" "$file")
-                [[ "$line" == *".end method"* ]] && {
-                    end="$i"
-                    break
-                }
-                i=$((i + 1))
-            done
-            [ "$end" -eq 0 ] && {
-                warn "End not found for ${method_name} in $file (start $start)"
-                continue
-            }
-
-            method_head=$(sed -n "${start}p" "$file")
-            method_head_escaped=$(printf "%s\n" "$method_head" | sed 's/\\/\\\\/g')
-
-            sed -i "${start},${end}c\\
-${method_head_escaped}\\
-    .registers 8\\
-    return-void\\
-.end method" "$file"
-        done
-
-        log "Patched all ${method_name} overloads in $(basename "$file") to return-void"
-    done
-
-    return 0
+    # Every overload, in every class that defines it
+    plan_op "$decompile_dir" return_void method "$method_name" all 1
 }
@@ -0,0 +1,599 @@
+#!/usr/bin/env python3
+"""
+Single-pass smali patch engine.
+
+Applies a patch plan (a list of operations) to an apktool decompile directory:
+the smali tree is walked once to index class files, files needed by operations
+without a target class are found in one scan, every operation runs on the file
+contents in memory, and each touched file is written back once.
+
+Usage: smali_patcher.py <decompile_dir> <plan.json|plan.jsonl>
+       smali_patcher.py <decompile_dir> --spec <spec.json> --jar <jar> [--features <a,b,...>]
+
+A plan is a JSON list of operations, or one JSON operation per line. Every
+operation has an "op" and most have a "class" (e.g. "android/util/apk/ApkSignatureVerifier"
+or just "StrictJarFile"); without a class, the first file that contains the
+method or line is used, or every such file with "all": true.
+
+A patch spec (scripts/patches/android<N>.json) holds the operations of one Android
+version, grouped by JAR and feature:
+
+  {"android": 16,
+   "jars": {"framework": {"disable-signature-verification": [<operation>, ...]},
+            "services": {...}, "miui-services": {...}}}
+
+--spec compiles the operations of the selected features for one JAR into a single
+plan, in spec order. Operations may carry a "note" for readers; the engine ignores it.
+
+Operations:
+  return_const    method, value             method body -> const/4 v0, 0x<value>; return v0
+  return_void     method                    method body -> return-void
+  replace_method  method, body              method body -> body (string or list of lines)
+  insert_before   match, line               insert line above every line containing match
+  insert_after    after, line [anchor, window, method]
+                                            insert line below every line equal to after
+                                            (within window lines below anchor, or in method)
+  replace_move_result  invoke, with, window replace the move-result after an invoke
+  const_before_condition  anchor, condition, register, value, lookback
+                                            insert const/4 above the condition before anchor
+  drop_branch_after  anchor, branch, window, label_window
+                                            remove the branch after anchor; with label_window,
+                                            also nop the first :cond_ label after it
+  replace_in_method  method, find, with     replace the first line equal to find in the method
+  replace_text    find, with                replace every occurrence in the file
+
+Method operations patch the first matching method, or all of them with "all": true.
+A method matches when its .method line contains " <method>", so "checkCapability"
+also matches checkCapabilityRecover, and a full signature matches one overload.
+insert_before and insert_after stop after the first place patched with "first": true.
+Missing targets are reported as warnings, like the shell patch functions did, or as
+plain notes for operations marked "optional": true (e.g. overloads some builds lack).
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import time
+
+ENCODING = "utf-8"
+ERRORS = "surrogateescape"
+
+_INDENT = re.compile(r"\s*")
+_LABEL = re.compile(r":cond_[0-9a-zA-Z_]+$")
+
+
+def log(message):
+    print(f"[INFO] {message}", file=sys.stderr)
+
+
+def warn(message):
+    print(f"[WARN] {message}", file=sys.stderr)
+
+
+def err(message):
+    print(f"[ERROR] {message}", file=sys.stderr)
+
+
+def indent_of(line):
+    return _INDENT.match(line).group(0)
+
+
+def class_key(name):
+    """'Landroid/os/Foo;', 'android/os/Foo.smali' or 'android.os.Foo' -> 'android/os/Foo'."""
+    name = name.strip()
+    if name.startswith("L") and name.endswith(";"):
+        name = name[1:-1]
+    if name.endswith(".smali"):
+        name = name[:-6]
+    if "/" not in name and name.count(".") > 1:
+        name = name.replace(".", "/")
+    return name
+
+
+def _dex_dir_order(name):
+    """smali, smali_classes2, ... (and classes, classes2, ...) in DEX order."""
+    digits = re.sub(r"\D", "", name)
+    return int(digits) if digits else 1
+
+
+class SmaliFile:
+    """A smali file's lines, loaded on first use and written back once if changed."""
+
+    __slots__ = ("path", "_lines", "dirty", "_methods")
+
+    def __init__(self, path):
+        self.path = path
+        self._lines = None
+        self.dirty = False
+        self._methods = None
+
+    @property
+    def lines(self):
+        if self._lines is None:
+            with open(self.path, encoding=ENCODING, errors=ERRORS) as f:
+                self._lines = f.read().splitlines()
+        return self._lines
+
+    @property
+    def name(self):
+        return os.path.basename(self.path)
+
+    def changed(self):
+        self.dirty = True
+        self._methods = None
+
+    def methods(self):
+        """(start, end) line indexes of every method, from .method to .end method."""
+        if self._methods is None:
+            methods = []
+            start = None
+            for i, line in enumerate(self.lines):
+                stripped = line.lstrip()
+                if stripped.startswith(".method"):
+                    start = i
+                elif stripped.startswith(".end method") and start is not None:
+                    methods.append((start, i))
+                    start = None
+            self._methods = methods
+        return self._methods
+
+    def find_methods(self, method):
+        needle = f" {method}"
+        return [(start, end) for start, end in self.methods() if needle in self.lines[start]]
+
+    def save(self):
+        if not self.dirty:
+            return False
+        # Replace the file instead of writing into it: a tree restored from the decompile
+        # cache shares its files with the cache entry through hard links
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding=ENCODING, errors=ERRORS) as f:
+            f.write("\n".join(self._lines) + "\n")
+        os.replace(tmp_path, self.path)
+        self.dirty = False
+        return True
+
+
+class SmaliTree:
+    """Index of the class files under a decompile directory, built by one walk."""
+
+    def __init__(self, root):
+        self.root = root
+        self.classes = {}
+        self.simple_names = {}
+        self.paths = []
+        self._files = {}
+        self._walk()
+
+    def _walk(self):
+        roots = []
+        for entry in os.scandir(self.root):
+            # decompile_jar adds classesN -> smali_classesN symlinks; walk the real directories only
+            if entry.is_dir(follow_symlinks=False) and entry.name.startswith(("smali", "classes")):
+                roots.append(entry.name)
+        for dex_dir in sorted(roots, key=_dex_dir_order):
+            base = os.path.join(self.root, dex_dir)
+            for directory, subdirs, files in os.walk(base):
+                subdirs.sort()
+                for file_name in sorted(files):
+                    if not file_name.endswith(".smali"):
+                        continue
+                    path = os.path.join(directory, file_name)
+                    key = os.path.relpath(path, base)[:-6].replace(os.sep, "/")
+                    self.paths.append(path)
+                    self.classes.setdefault(key, path)
+                    self.simple_names.setdefault(key.rsplit("/", 1)[-1], path)
+
+    def file(self, path):
+        smali_file = self._files.get(path)
+        if smali_file is None:
+            smali_file = self._files[path] = SmaliFile(path)
+        return smali_file
+
+    def find_class(self, name):
+        key = class_key(name)
+        path = self.classes.get(key) if "/" in key else self.simple_names.get(key)
+        return self.file(path) if path else None
+
+    def scan(self, needles):
+        """Map each needle to the files containing it, reading every file at most once."""
+        found = {needle: [] for needle in needles}
+        if not needles:
+            return found
+        encoded = [(needle, needle.encode(ENCODING, ERRORS)) for needle in needles]
+        for path in self.paths:
+            with open(path, "rb") as f:
+                data = f.read()
+            for needle, raw in encoded:
+                if raw in data:
+                    found[needle].append(path)
+        return found
+
+    def save(self):
+        return sum(1 for smali_file in self._files.values() if smali_file.save())
+
+
+# ----------------------------------------------
+# Operations: each takes (file, op) and returns the number of changes made,
+# or None when the file holds no target for the operation
+# ----------------------------------------------
+
+def _method_stub(head, body):
+    return [head, *body, ".end method"]
+
+
+def _replace_methods(smali_file, op, make_body, skip_void=False):
+    targets = smali_file.find_methods(op["method"])
+    if skip_void:
+        targets = [(start, end) for start, end in targets if ")V" not in smali_file.lines[start]]
+    if not targets:
+        return None
+    if not op.get("all"):
+        targets = targets[:1]
+    lines = smali_file.lines
+    changes = 0
+    # Bottom-up, so earlier line indexes stay valid
+    for start, end in reversed(targets):
+        stub = _method_stub(lines[start], make_body(lines[start]))
+        if lines[start:end + 1] == stub:
+            continue
+        lines[start:end + 1] = stub
+        changes += 1
+    if changes:
+        smali_file.changed()
+    return changes
+
+
+def op_return_const(smali_file, op):
+    body = ["    .registers 8", f"    const/4 v0, 0x{op['value']}", "    return v0"]
+    return _replace_methods(smali_file, op, lambda head: body, skip_void=True)
+
+
+def op_return_void(smali_file, op):
+    return _replace_methods(smali_file, op, lambda head: ["    .registers 8", "    return-void"])
+
+
+def op_replace_method(smali_file, op):
+    body = op["body"]
+    if isinstance(body, str):
+        body = body.split("\n")
+    return _replace_methods(smali_file, op, lambda head: body)
+
+
+def op_insert_before(smali_file, op):
+    match, new_line = op["match"], op["line"]
+    lines = smali_file.lines
+    hits = [i for i, line in enumerate(lines) if match in line]
+    if not hits:
+        return None
+    if op.get("first"):
+        hits = hits[:1]
+    changes = 0
+    for i in reversed(hits):
+        if i > 0 and lines[i - 1].strip() == new_line.strip():
+            continue
+        lines.insert(i, indent_of(lines[i]) + new_line.strip())
+        changes += 1
+    if changes:
+        smali_file.changed()
+    return changes
+
+
+def _next_code_line(lines, i):
+    """Index of the first non-blank line after line i, or None."""
+    return next((j for j in range(i + 1, len(lines)) if lines[j].strip()), None)
+
+
+def op_insert_after(smali_file, op):
+    after, new_line = op["after"].strip(), op["line"].strip()
+    lines = smali_file.lines
+    start, end = 0, len(lines)
+    if op.get("method"):
+        targets = smali_file.find_methods(op["method"])
+        if not targets:
+            return None
+        start, end = targets[0]
+    if op.get("anchor"):
+        # The first line equal to after within window lines below each anchor
+        window = int(op.get("window", 3))
+        hits = []
+        for i in range(start, end):
+            if op["anchor"] in lines[i]:
+                j = next((j for j in range(i + 1, min(i + 1 + window, end)) if lines[j].strip() == after), None)
+                if j is not None and j not in hits:
+                    hits.append(j)
+    else:
+        hits = [i for i in range(start, end) if lines[i].strip() == after]
+    if not hits:
+        return None
+    if op.get("first"):
+        hits = hits[:1]
+    changes = 0
+    for i in reversed(hits):
+        # apktool puts a blank line between instructions, so look past it for an earlier patch
+        following = _next_code_line(lines, i)
+        if following is not None and lines[following].strip() == new_line:
+            continue
+        lines.insert(i + 1, indent_of(lines[i]) + new_line)
+        changes += 1
+    if changes:
+        smali_file.changed()
+    return changes
+
+
+def op_replace_move_result(smali_file, op):
+    invoke, replacement = op["invoke"], op["with"]
+    window = int(op.get("window", 5))
+    lines = smali_file.lines
+    hits = [i for i, line in enumerate(lines) if invoke in line]
+    if not hits:
+        return None
+    changes = 0
+    for i in hits:
+        for j in range(i + 1, min(i + 1 + window, len(lines))):
+            target = lines[j].strip()
+            if target == replacement:
+                break
+            if target.startswith(op.get("result", "move-result")):
+                lines[j] = indent_of(lines[j]) + replacement
+                changes += 1
+                break
+    if changes:
+        smali_file.changed()
+    return changes
+
+
+def op_const_before_condition(smali_file, op):
+    anchor, condition = op["anchor"], op["condition"]
+    const_line = f"const/4 {op['register']}, 0x{op['value']}"
+    lookback = int(op.get("lookback", 20))
+    lines = smali_file.lines
+    hits = [i for i, line in enumerate(lines) if anchor in line]
+    if not hits:
+        return None
+    changes = 0
+    for i in reversed(hits):
+        for j in range(i - 1, max(-1, i - 1 - lookback), -1):
+            if lines[j].strip().startswith(condition):
+                if j == 0 or lines[j - 1].strip() != const_line:
+                    lines.insert(j, indent_of(lines[j]) + const_line)
+                    changes += 1
+                break
+    if changes:
+        smali_file.changed()
+    return changes
+
+
+def op_drop_branch_after(smali_file, op):
+    anchor, branch = op["anchor"], op["branch"]
+    window = int(op.get("window", 12))
+    label_window = int(op.get("label_window", 0))
+    lines = smali_file.lines
+    start = next((i for i, line in enumerate(lines) if anchor in line), None)
+    if start is None:
+        return None
+    changes = 0
+    for j in range(start + 1, min(start + 1 + window, len(lines))):
+        if lines[j].strip().startswith(branch):
+            del lines[j]
+            changes += 1
+            break
+    for j in range(start + 1, min(start + 1 + label_window, len(lines))):
+        if _LABEL.match(lines[j].strip()):
+            if j + 1 >= len(lines) or lines[j + 1].strip() != "nop":
+                lines.insert(j + 1, indent_of(lines[j]) + "nop")
+                changes += 1
+            break
+    if changes:
+        smali_file.changed()
+    return changes
+
+
+def op_replace_in_method(smali_file, op):
+    targets = smali_file.find_methods(op["method"])
+    if not targets:
+        return None
+    start, end = targets[0]
+    lines = smali_file.lines
+    for j in range(start + 1, end):
+        if lines[j].strip() == op["find"]:
+            lines[j] = indent_of(lines[j]) + op["with"]
+            smali_file.changed()
+            return 1
+    return 0
+
+
+def op_replace_text(smali_file, op):
+    find, replacement = op["find"], op["with"]
+    lines = smali_file.lines
+    changes = 0
+    for i, line in enumerate(lines):
+        if find in line:
+            lines[i] = line.replace(find, replacement)
+            changes += 1
+    if not changes:
+        return None
+    smali_file.changed()
+    return changes
+
+
+OPERATIONS = {
+    "return_const": op_return_const,
+    "return_void": op_return_void,
+    "replace_method": op_replace_method,
+    "insert_before": op_insert_before,
+    "insert_after": op_insert_after,
+    "replace_move_result": op_replace_move_result,
+    "const_before_condition": op_const_before_condition,
+    "drop_branch_after": op_drop_branch_after,
+    "replace_in_method": op_replace_in_method,
+    "replace_text": op_replace_text,
+}
+JARS = ("framework", "services", "miui-services")
+FEATURES = ("disable-signature-verification", "cn-notification-fix", "disable-secure-flag")
+
+METHOD_OPERATIONS = {"return_const", "return_void", "replace_method", "replace_in_method"}
+REQUIRED_FIELDS = {
+    "return_const": ("method", "value"),
+    "return_void": ("method",),
+    "replace_method": ("method", "body"),
+    "insert_before": ("match", "line"),
+    "insert_after": ("after", "line"),
+    "replace_move_result": ("invoke", "with"),
+    "const_before_condition": ("anchor", "condition", "register", "value"),
+    "drop_branch_after": ("anchor", "branch"),
+    "replace_in_method": ("method", "find", "with"),
+    "replace_text": ("find", "with"),
+}
+
+
+def describe(op):
+    target = (op.get("method") or op.get("match") or op.get("invoke") or op.get("anchor") or op.get("find")
+              or op.get("after"))
+    where = f" in {op['class']}" if op.get("class") else ""
+    return f"{op['op']} '{target}'{where}"
+
+
+def search_needle(op):
+    """Text a file must contain to be a target of an operation without a class."""
+    if op["op"] in METHOD_OPERATIONS:
+        return op["method"]
+    return (op.get("match") or op.get("invoke") or op.get("anchor") or op.get("find") or op.get("method")
+            or op.get("after"))
+
+
+def load_plan(path):
+    with open(path, encoding=ENCODING) as f:
+        text = f.read().strip()
+    if not text:
+        return []
+    if text.startswith("["):
+        return json.loads(text)
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+def validate_plan(plan):
+    for number, op in enumerate(plan, 1):
+        if op.get("op") not in OPERATIONS:
+            raise ValueError(f"operation {number}: unknown op {op.get('op')!r}")
+        missing = [field for field in REQUIRED_FIELDS[op["op"]] if field not in op]
+        if missing:
+            raise ValueError(f"operation {number} ({op['op']}): missing {', '.join(missing)}")
+
+
+def apply_plan(decompile_dir, plan):
+    """Apply every operation of the plan; returns (operations applied, files written)."""
+    validate_plan(plan)
+    started = time.monotonic()
+    tree = SmaliTree(decompile_dir)
+    searches = tree.scan({search_needle(op) for op in plan if not op.get("class")})
+
+    applied = 0
+    for op in plan:
+        if op.get("class"):
+            smali_file = tree.find_class(op["class"])
+            if smali_file is None:
+                if op.get("optional"):
+                    log(f"{describe(op)}: {op['class']}.smali not present, skipped")
+                else:
+                    warn(f"{describe(op)}: {op['class']}.smali not found")
+                continue
+            candidates = [smali_file]
+        else:
+            candidates = [tree.file(path) for path in searches[search_needle(op)]]
+
+        done = 0
+        for smali_file in candidates:
+            changes = OPERATIONS[op["op"]](smali_file, op)
+            if changes is None:
+                continue
+            done += 1
+            if changes:
+                log(f"{describe(op)}: {changes} change(s) in {smali_file.name}")
+            else:
+                log(f"{describe(op)}: already applied in {smali_file.name}")
+            if not op.get("all"):
+                break
+        if done:
+            applied += 1
+        elif op.get("optional"):
+            log(f"{describe(op)}: not present, skipped")
+        else:
+            warn(f"{describe(op)}: target not found")
+
+    written = tree.save()
+    log(f"Patch plan: {applied}/{len(plan)} operation(s) applied, {written} file(s) written, "
+        f"{len(tree.paths)} class file(s) indexed in {time.monotonic() - started:.1f}s")
+    return applied, written
+
+
+def load_spec(path):
+    with open(path, encoding=ENCODING) as f:
+        spec = json.load(f)
+    validate_spec(spec)
+    return spec
+
+
+def validate_spec(spec):
+    """Check every operation of the spec, not only the ones a run selects."""
+    jars = spec.get("jars") if isinstance(spec, dict) else None
+    if not isinstance(jars, dict):
+        raise ValueError('spec has no "jars" object')
+    for jar, features in jars.items():
+        if jar not in JARS:
+            raise ValueError(f"unknown JAR {jar!r} (expected one of {', '.join(JARS)})")
+        for feature, plan in features.items():
+            if feature not in FEATURES:
+                raise ValueError(f"{jar}: unknown feature {feature!r} (expected one of {', '.join(FEATURES)})")
+            try:
+                validate_plan(plan)
+            except ValueError as e:
+                raise ValueError(f"{jar}/{feature}: {e}") from e
+
+
+def compile_spec(spec, jar, features):
+    """The plan for one JAR: the operations of the selected features, in spec order."""
+    plan = []
+    for feature, operations in spec["jars"].get(jar, {}).items():
+        if feature in features:
+            plan.extend(operations)
+    return plan
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog=os.path.basename(argv[0]),
+                                     description="Apply a patch plan or a patch spec to a decompiled JAR.")
+    parser.add_argument("decompile_dir")
+    parser.add_argument("plan", nargs="?", help="patch plan (.json list or .jsonl)")
+    parser.add_argument("--spec", help="patch spec of an Android version")
+    parser.add_argument("--jar", choices=JARS, help="JAR of the spec to patch")
+    parser.add_argument("--features", default="", help="comma-separated features of the spec to apply")
+    args = parser.parse_args(argv[1:])
+    if bool(args.plan) == bool(args.spec) or (args.spec and not args.jar):
+        parser.print_usage(sys.stderr)
+        err("Give either a plan, or --spec with --jar")
+        return 2
+    if not os.path.isdir(args.decompile_dir):
+        err(f"Decompile directory not found: {args.decompile_dir}")
+        return 1
+    try:
+        if args.spec:
+            features = [feature for feature in args.features.split(",") if feature]
+            plan = compile_spec(load_spec(args.spec), args.jar, features)
+            log(f"Patch spec {os.path.basename(args.spec)}: {len(plan)} operation(s) for {args.jar}.jar "
+                f"({', '.join(features) or 'no features'})")
+            if not plan:
+                return 0
+        else:
+            plan = load_plan(args.plan)
+        apply_plan(args.decompile_dir, plan)
+    except (OSError, ValueError) as e:
+        err(f"Patch plan failed: {e}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
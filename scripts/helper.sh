@@ -1,9 +1,10 @@
 #!/usr/bin/env bash
 # helper.sh - common functions for DSV A15 framework patcher
 # Usage: source ./helper.sh
-# Exposes: init_env, ensure_tools, decompile_jar, recompile_jar, backup_original_jar,
-#          add_static_return_patch, patch_return_void_method,
-#          modify_invoke_custom_methods, create_magisk_module, find_smali_method_file
+# Exposes: init_env, ensure_tools, decompile_jar, recompile_jar, backup_original_jar, run_jar_pipeline,
+#          begin_patch_plan, plan_op, apply_patch_plan, apply_patch_spec, add_static_return_patch,
+#          patch_return_void_method, patch_return_void_methods_all,
+#          modify_invoke_custom_methods, create_magisk_module
 #
 # Designed for use in CI / GitHub workflow. Functions accept explicit decompile_dir
 # where appropriate so scripts can be called against multiple jars.
@@ -1,25 +1,44 @@
 from pyrogram import idle
 
+import config
 from Framework import bot, loop
+from Framework.helpers.dispatch_queue import start_dispatch_workers, stop_dispatch_workers
+from Framework.helpers.http_pool import open_http_clients, close_http_clients
 from Framework.helpers.maintenance import notify_users_maintenance
 from Framework.helpers.provider import *
-from Framework.helpers.provider import initialize_data
+from Framework.helpers.provider import initialize_data, start_background_refresh, stop_background_refresh
+from Framework.helpers.run_tracker import start_run_tracker, stop_run_tracker
+from Framework.helpers.session_store import start_session_store, stop_session_store
 from Framework.plugins.dev.updater import restart_notification
 
 
 async def main():
+    open_http_clients()
+    start_session_store()
     await bot.start()
     me = await bot.get_me()
     await restart_notification()
     LOGGER.info("Initializing device data provider...")
-    await initialize_data()
+    await initialize_data(snapshot_path=config.PROVIDER_SNAPSHOT_PATH)
+    start_background_refresh(
+        interval=config.PROVIDER_REFRESH_INTERVAL,
+        jitter=config.PROVIDER_REFRESH_JITTER,
+        retry_delay=config.PROVIDER_RETRY_DELAY,
+    )
+    start_dispatch_workers()
+    start_run_tracker()
     LOGGER.info(f"{me.first_name} (@{me.username}) [ID: {me.id}]")
 
     await idle()
     
     await notify_users_maintenance()
+    await stop_background_refresh()
+    await stop_dispatch_workers()
+    await stop_run_tracker()
 
     await bot.stop()
+    await stop_session_store()
+    await close_http_clients()
     LOGGER.info("Bot stopped")
 
 if __name__ == "__main__":
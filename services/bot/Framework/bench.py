@@ -0,0 +1,333 @@
+"""
+Micro-benchmarks for the bot helpers. Needs the bot's environment (config), but not a Telegram login.
+
+    cd services/bot && python -m Framework.bench http
+    cd services/bot && python -m Framework.bench dispatch
+    cd services/bot && python -m Framework.bench upload
+    cd services/bot && python -m Framework.bench relay
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import ssl
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import httpx
+
+from Framework.helpers import db, dispatch_queue, dispatch_targets, pd_upload
+from Framework.helpers.dispatch_targets import DispatchTarget
+from Framework.helpers.http_pool import CLIENT_SETTINGS, _event_hooks, get_http_stats, close_http_clients
+
+
+async def _serve_ok(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    """Minimal keep-alive HTTP/1.1 server: answer every request with a tiny body."""
+    try:
+        while True:
+            await reader.readuntil(b"\r\n\r\n")
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/plain\r\nContent-Length: 2\r\n\r\nok")
+            await writer.drain()
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+def _self_signed_cert(directory: str):
+    """Create a throwaway certificate for 127.0.0.1 with the openssl CLI, or None without it."""
+    cert, key = os.path.join(directory, "cert.pem"), os.path.join(directory, "key.pem")
+    try:
+        subprocess.run(
+            ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-keyout", key, "-out", cert,
+             "-days", "1", "-subj", "/CN=127.0.0.1", "-addext", "subjectAltName=IP:127.0.0.1"],
+            check=True, capture_output=True
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return cert, key
+
+
+async def _bench_http(requests: int = 200):
+    with tempfile.TemporaryDirectory() as directory:
+        cert = _self_signed_cert(directory)
+        server_ssl = client_ssl = None
+        if cert:
+            server_ssl = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+            server_ssl.load_cert_chain(*cert)
+            client_ssl = ssl.create_default_context(cafile=cert[0])
+
+        server = await asyncio.start_server(_serve_ok, "127.0.0.1", 0, ssl=server_ssl)
+        port = server.sockets[0].getsockname()[1]
+        url = f"{'https' if cert else 'http'}://127.0.0.1:{port}/"
+        print(f"{requests} sequential GETs to {url}")
+
+        settings = CLIENT_SETTINGS["default"]
+
+        # Before: a new client, and so a new connection, per call
+        started = time.perf_counter()
+        for _ in range(requests):
+            async with httpx.AsyncClient(verify=client_ssl or True, event_hooks=_event_hooks("per-call"),
+                                         **settings) as client:
+                (await client.get(url)).raise_for_status()
+        per_call = time.perf_counter() - started
+
+        # After: one shared client
+        started = time.perf_counter()
+        async with httpx.AsyncClient(verify=client_ssl or True, event_hooks=_event_hooks("pooled"),
+                                     **settings) as client:
+            for _ in range(requests):
+                (await client.get(url)).raise_for_status()
+        pooled = time.perf_counter() - started
+
+        server.close()
+        await server.wait_closed()
+
+    stats = get_http_stats()
+    print(f"{'client':>9} {'ms/req':>7} {'connections':>12} {'tls':>5} {'reused':>7} {'connect ms':>11}")
+    for name, elapsed in (("per-call", per_call), ("pooled", pooled)):
+        s = stats[name]
+        print(f"{name:>9} {elapsed / requests * 1000:>7.2f} {int(s['connections']):>12} {int(s['tls_handshakes']):>5} "
+              f"{s['reuse_ratio']:>7.0%} {s['connect_seconds'] * 1000:>11.1f}")
+
+
+def bench_http():
+    asyncio.run(_bench_http())
+
+
+class _FakeGitHub:
+    """Local stand-in for the workflow dispatch API: `quota` requests per token every `window` seconds."""
+
+    def __init__(self, quota: int, window: float, latency: float = 0.02):
+        self.quota, self.window, self.latency = quota, window, latency
+        self.used = {}
+        self.accepted = 0
+        self.limited = 0
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                head = (await reader.readuntil(b"\r\n\r\n")).decode()
+                headers = dict(line.split(": ", 1) for line in head.split("\r\n")[1:] if ": " in line)
+                headers = {name.lower(): value for name, value in headers.items()}
+                await reader.readexactly(int(headers.get("content-length", 0)))
+                await asyncio.sleep(self.latency)
+
+                token = headers.get("authorization", "")
+                now = time.time()
+                reset, used = self.used.get(token, (0.0, 0))
+                if now >= reset:
+                    reset, used = now + self.window, 0
+                if used < self.quota:
+                    used += 1
+                    self.accepted += 1
+                    status, body = "204 No Content", b""
+                else:
+                    self.limited += 1
+                    status, body = "403 Forbidden", json.dumps({"message": "API rate limit exceeded"}).encode()
+                self.used[token] = (reset, used)
+                writer.write(
+                    f"HTTP/1.1 {status}\r\nContent-Length: {len(body)}\r\nX-RateLimit-Limit: {self.quota}\r\n"
+                    f"X-RateLimit-Remaining: {self.quota - used}\r\nX-RateLimit-Reset: {reset:.3f}\r\n\r\n".encode()
+                    + body
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+async def _bench_dispatch(jobs: int = 45, quota: int = 15, window: float = 3.0):
+    fake = _FakeGitHub(quota, window)
+    server = await asyncio.start_server(fake.handle, "127.0.0.1", 0)
+    url = f"http://127.0.0.1:{server.sockets[0].getsockname()[1]}"
+    print(f"{jobs} dispatches, fake API allows {quota} requests per token every {window:.0f}s")
+    print(f"{'targets':>8} {'seconds':>8} {'jobs/s':>7} {'rate limited':>13}")
+
+    dispatch_queue.DISPATCH_WORKERS = 6
+    dispatch_queue.DISPATCH_MAX_ATTEMPTS = 100
+    dispatch_targets.DISPATCH_PER_REPO_LIMIT = 2
+    # Let the rate-limit headers, not the configured ceiling, set the pace
+    dispatch_targets.DISPATCH_TARGET_RATE = 100.0
+    with tempfile.TemporaryDirectory() as directory:
+        for count in (1, 3):
+            db.close_db()
+            db.DISPATCH_DB_PATH = os.path.join(directory, f"dispatch-{count}.sqlite3")
+            dispatch_targets._targets[:] = [
+                DispatchTarget("bench", f"repo{i}", f"token-{i}", api_url=url) for i in range(count)
+            ]
+            fake.used.clear()
+            fake.limited = 0
+            for i in range(jobs):
+                dispatch_queue.enqueue_dispatch(f"bench:{i}", "android15.yml", {
+                    "ref": "master", "inputs": {"api_level": "35", "device_name": f"device{i}"}
+                })
+
+            started = time.perf_counter()
+            dispatch_queue.start_dispatch_workers()
+            while dispatch_queue.get_queue_stats().get("dispatched", 0) < jobs:
+                await asyncio.sleep(0.05)
+            elapsed = time.perf_counter() - started
+            await dispatch_queue.stop_dispatch_workers()
+            print(f"{count:>8} {elapsed:>8.2f} {jobs / elapsed:>7.1f} {fake.limited:>13}")
+
+    await close_http_clients()
+    server.close()
+    await server.wait_closed()
+
+
+def bench_dispatch():
+    asyncio.run(_bench_dispatch())
+
+
+class _FakePixelDrain:
+    """Local stand-in for PixelDrain's PUT and file list APIs. `failures` scripts the first uploads:
+    "drop" cuts the connection halfway through the body, "lost" takes the whole body, stores the
+    file and closes without answering. `rate` caps the receive speed in bytes per second."""
+
+    def __init__(self, failures=(), rate: float = None):
+        self.failures = list(failures)
+        self.rate = rate
+        self.files = []
+        self.puts = 0
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                head = (await reader.readuntil(b"\r\n\r\n")).decode()
+                method, path = head.split(" ", 2)[:2]
+                headers = {line.split(": ", 1)[0].lower(): line.split(": ", 1)[1]
+                           for line in head.split("\r\n")[1:] if ": " in line}
+                if method == "GET":
+                    body = json.dumps({"files": self.files}).encode()
+                else:
+                    self.puts += 1
+                    failure = self.failures.pop(0) if self.failures else None
+                    size = int(headers.get("content-length", 0))
+                    digest, received = hashlib.sha256(), 0
+                    while received < size:
+                        if failure == "drop" and received >= size // 2:
+                            return
+                        chunk = await reader.read(min(65536, size - received))
+                        if not chunk:
+                            return
+                        digest.update(chunk)
+                        received += len(chunk)
+                        if self.rate:
+                            await asyncio.sleep(len(chunk) / self.rate)
+                    file_id = f"file{len(self.files)}"
+                    self.files.append({"id": file_id, "size": size, "hash_sha256": digest.hexdigest(),
+                                       "date_upload": f"{time.time():.6f}"})
+                    if failure == "lost":
+                        return
+                    body = json.dumps({"id": file_id}).encode()
+                writer.write(f"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                             f"Content-Length: {len(body)}\r\n\r\n".encode() + body)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+async def _bench_upload(size: int = 64 * 1024 * 1024):
+    pd_upload.UPLOAD_PROGRESS_INTERVAL = 0.2
+    print(f"{size // (1024 * 1024)} MiB upload to a local fake PixelDrain")
+    print(f"{'scenario':>16} {'seconds':>8} {'PUTs':>5} {'progress':>9} {'peak MiB':>9} {'result':>8}")
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "framework.jar")
+        with open(path, "wb") as file:
+            for _ in range(size // (1024 * 1024)):
+                file.write(os.urandom(1024 * 1024))
+
+        for scenario, failures in (("clean", ()), ("dropped", ("drop",)), ("response lost", ("lost",))):
+            fake = _FakePixelDrain(failures)
+            server = await asyncio.start_server(fake.handle, "127.0.0.1", 0)
+            url = f"http://127.0.0.1:{server.sockets[0].getsockname()[1]}/api"
+            reports = []
+
+            async def progress(sent: int, total: int, rate: float):
+                reports.append(sent)
+
+            tracemalloc.start()
+            started = time.perf_counter()
+            data, logs = await pd_upload.upload_file(path, "key", progress=progress, api_url=url)
+            elapsed = time.perf_counter() - started
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print(f"{scenario:>16} {elapsed:>8.2f} {fake.puts:>5} {len(reports):>9} {peak / (1024 * 1024):>9.1f} "
+                  f"{data.get('id', 'error'):>8}")
+            await close_http_clients()
+            server.close()
+            await server.wait_closed()
+
+
+def bench_upload():
+    asyncio.run(_bench_upload())
+
+
+async def _fake_telegram_download(size: int, rate: float):
+    """Stand-in for Client.stream_media: 1 MiB chunks at `rate` bytes per second."""
+    for _ in range(size // (1024 * 1024)):
+        await asyncio.sleep(1024 * 1024 / rate)
+        yield os.urandom(1024 * 1024)
+
+
+async def _bench_relay(size: int = 64 * 1024 * 1024, download_rate: float = 40e6, upload_rate: float = 40e6):
+    print(f"{size // (1024 * 1024)} MiB from a fake Telegram ({download_rate / 1e6:.0f} MB/s) "
+          f"to a fake PixelDrain ({upload_rate / 1e6:.0f} MB/s)")
+    print(f"{'mode':>20} {'seconds':>8} {'peak MiB':>9} {'disk MiB':>9}")
+    fake = _FakePixelDrain(rate=upload_rate)
+    server = await asyncio.start_server(fake.handle, "127.0.0.1", 0)
+    url = f"http://127.0.0.1:{server.sockets[0].getsockname()[1]}/api"
+
+    with tempfile.TemporaryDirectory() as directory:
+        # Before: download to a file, then upload it
+        path = os.path.join(directory, "framework.jar")
+        tracemalloc.start()
+        started = time.perf_counter()
+        with open(path, "wb") as file:
+            async for chunk in _fake_telegram_download(size, download_rate):
+                file.write(chunk)
+        await pd_upload.upload_file(path, "key", api_url=url)
+        elapsed = time.perf_counter() - started
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f"{'download, upload':>20} {elapsed:>8.2f} {peak / (1024 * 1024):>9.1f} {size / (1024 * 1024):>9.0f}")
+
+    # After: relay the download into the upload
+    tracemalloc.start()
+    started = time.perf_counter()
+    await pd_upload.upload_stream(lambda: _fake_telegram_download(size, download_rate), size, "framework.jar", "key",
+                                  api_url=url)
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f"{'relay':>20} {elapsed:>8.2f} {peak / (1024 * 1024):>9.1f} {0:>9}")
+
+    await close_http_clients()
+    server.close()
+    await server.wait_closed()
+
+
+def bench_relay():
+    asyncio.run(_bench_relay())
+
+
+BENCHMARKS = {
+    "http": bench_http,
+    "dispatch": bench_dispatch,
+    "upload": bench_upload,
+    "relay": bench_relay,
+}
+
+if __name__ == "__main__":
+    names = sys.argv[1:2] or list(BENCHMARKS)
+    for name in names:
+        print(f"== {name} ==")
+        BENCHMARKS[name]()
@@ -0,0 +1,128 @@
+"""
+Build-result cache.
+A build is identified by its API level, device, ROM version, features and the content of its
+input JARs. Finished builds map to their release, so an identical request gets the existing
+module at once; requests arriving while the same build runs wait for it instead of starting
+another. Kept in SQLite next to the dispatch queue.
+"""
+
+import hashlib
+import json
+import sqlite3
+import time
+from typing import Optional, Dict, List
+
+from Framework.helpers.db import get_db
+from Framework.helpers.logger import LOGGER
+from Framework.helpers.workflows import features_to_string
+from config import *
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS builds (
+    key TEXT PRIMARY KEY,
+    release_url TEXT NOT NULL,
+    module_url TEXT,
+    run_url TEXT,
+    hits INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS build_waiters (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    build_key TEXT NOT NULL,
+    chat_id INTEGER NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS build_waiters_key ON build_waiters (build_key);
+"""
+
+cache_stats = {"hits": 0, "misses": 0, "coalesced": 0}
+
+
+def _get_db() -> sqlite3.Connection:
+    return get_db(_SCHEMA)
+
+
+def build_cache_key(api_level: str, codename: str, version_name: str, features: dict,
+                    jar_hashes: Dict[str, str]) -> str:
+    """Key of a build: everything that goes into the patched module, and nothing else."""
+    identity = {
+        "api_level": str(api_level),
+        "codename": codename.lower(),
+        "version_name": version_name,
+        "features": sorted(features_to_string(features).split(",")),
+        "jars": dict(sorted(jar_hashes.items())),
+    }
+    return hashlib.sha256(json.dumps(identity, sort_keys=True).encode()).hexdigest()
+
+
+def get_cached_build(key: str) -> Optional[sqlite3.Row]:
+    """The finished build for `key`, unless it is older than BUILD_CACHE_TTL."""
+    db = _get_db()
+    build = db.execute("SELECT * FROM builds WHERE key = ? AND created_at >= ?",
+                       (key, time.time() - BUILD_CACHE_TTL)).fetchone()
+    if build is None:
+        cache_stats["misses"] += 1
+        return None
+    cache_stats["hits"] += 1
+    with db:
+        db.execute("UPDATE builds SET hits = hits + 1 WHERE key = ?", (key,))
+    return build
+
+
+def store_build(key: str, release_url: str, module_url: Optional[str], run_url: Optional[str]):
+    db = _get_db()
+    with db:
+        db.execute(
+            "INSERT OR REPLACE INTO builds (key, release_url, module_url, run_url, created_at) VALUES (?, ?, ?, ?, ?)",
+            (key, release_url, module_url, run_url, time.time())
+        )
+    LOGGER.info(f"Cached build {key[:12]}: {release_url}")
+
+
+def add_build_waiter(key: str, chat_id: int):
+    """Have `chat_id` told about the build for `key` that is already running."""
+    cache_stats["coalesced"] += 1
+    db = _get_db()
+    with db:
+        db.execute("INSERT INTO build_waiters (build_key, chat_id, created_at) VALUES (?, ?, ?)",
+                   (key, chat_id, time.time()))
+
+
+def _pop_waiters(key: str) -> List[int]:
+    db = _get_db()
+    with db:
+        chats = [row[0] for row in db.execute("SELECT chat_id FROM build_waiters WHERE build_key = ?", (key,))]
+        db.execute("DELETE FROM build_waiters WHERE build_key = ?", (key,))
+    return chats
+
+
+def format_build_links(release_url: str, module_url: Optional[str]) -> str:
+    links = f"[Download module]({module_url}) · " if module_url else ""
+    return links + f"[Release page]({release_url})"
+
+
+async def notify_build_waiters(key: Optional[str], release_url: str = None, module_url: str = None,
+                               error: str = None):
+    """Tell everyone waiting on `key` how the shared build ended."""
+    if not key:
+        return
+    chats = _pop_waiters(key)
+    if not chats:
+        return
+    if release_url:
+        text = f"✅ **The build you asked for is ready.**\n\n{format_build_links(release_url, module_url)}"
+    else:
+        text = (f"❌ **The identical build you were waiting for did not finish** ({error}).\n\n"
+                "Send /start_patch to try again; it did not count against your daily limit.")
+    from Framework import bot
+    for chat_id in chats:
+        try:
+            await bot.send_message(chat_id, text, disable_web_page_preview=True)
+        except Exception as e:
+            LOGGER.error(f"Failed to notify chat {chat_id} about build {key[:12]}: {e}")
+
+
+def format_cache_stats() -> str:
+    count = _get_db().execute("SELECT COUNT(*) FROM builds").fetchone()[0]
+    return (f"{count} cached build(s), {cache_stats['hits']} hits, {cache_stats['misses']} misses, "
+            f"{cache_stats['coalesced']} coalesced")
@@ -0,0 +1,40 @@
+"""
+Shared SQLite connection.
+The dispatch queue, build cache, JAR index and session store all keep their tables in
+DISPATCH_DB_PATH. They share one connection, opened on first use; each module passes its
+own schema, which is applied once per connection.
+"""
+
+import os
+import sqlite3
+from typing import Optional, Callable, Set
+
+from config import *
+
+_db: Optional[sqlite3.Connection] = None
+_applied: Set[str] = set()
+
+
+def get_db(schema: str, migrate: Callable[[sqlite3.Connection], None] = None) -> sqlite3.Connection:
+    """The shared connection, with `schema` (and then `migrate`, if given) applied to it."""
+    global _db
+    if _db is None:
+        os.makedirs(os.path.dirname(DISPATCH_DB_PATH) or ".", exist_ok=True)
+        _db = sqlite3.connect(DISPATCH_DB_PATH)
+        _db.row_factory = sqlite3.Row
+        _db.execute("PRAGMA journal_mode=WAL")
+    if schema not in _applied:
+        _db.executescript(schema)
+        if migrate is not None:
+            migrate(_db)
+        _applied.add(schema)
+    return _db
+
+
+def close_db():
+    """Close the shared connection; the next get_db opens DISPATCH_DB_PATH again."""
+    global _db
+    if _db is not None:
+        _db.close()
+        _db = None
+    _applied.clear()
@@ -0,0 +1,380 @@
+"""
+Durable queue for GitHub workflow dispatches.
+Handlers enqueue and return; a small pool of workers sends each dispatch to the least-loaded
+healthy target (see dispatch_targets) within its concurrency limit and rate-limit budget.
+Jobs are kept in SQLite, so a restart loses nothing and never dispatches the same job twice.
+"""
+
+import asyncio
+import hashlib
+import json
+import sqlite3
+import time
+from typing import Optional, Dict, List, Tuple
+
+import httpx
+
+from Framework.helpers.build_cache import notify_build_waiters
+from Framework.helpers.db import get_db
+from Framework.helpers.dispatch_targets import (DispatchTarget, get_dispatch_targets, get_dispatch_target,
+                                                pick_dispatch_target, has_other_target)
+from Framework.helpers.logger import LOGGER
+from Framework.helpers.workflows import send_workflow_dispatch, find_dispatched_run
+from config import *
+
+JOB_QUEUED = "queued"
+JOB_SENDING = "sending"
+JOB_DISPATCHED = "dispatched"
+JOB_FAILED = "failed"
+# Workflow run states kept for dispatched jobs: GitHub's run status, or unknown when no run was found
+RUN_COMPLETED = "completed"
+RUN_UNKNOWN = "unknown"
+
+# Responses worth another attempt; other errors fail the job right away
+RETRY_STATUS = {429, 500, 502, 503, 504}
+# Responses that mean this target (token or repo) is unusable; the job moves to another target
+TARGET_ERROR_STATUS = {401, 403, 404}
+# Longest wait between attempts of one job, and between idle queue checks
+MAX_BACKOFF = 300.0
+IDLE_POLL = 60.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS dispatch_jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    key TEXT NOT NULL UNIQUE,
+    repo TEXT NOT NULL,
+    workflow_id TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    chat_id INTEGER,
+    notify_text TEXT,
+    state TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    uncertain INTEGER NOT NULL DEFAULT 0,
+    not_before REAL NOT NULL DEFAULT 0,
+    last_error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS dispatch_jobs_state ON dispatch_jobs (state, not_before);
+"""
+# Columns added after the first release of the table, added to older databases on open
+_ADDED_COLUMNS = {
+    "target": "TEXT",
+    "status_message_id": "INTEGER",
+    "run_id": "INTEGER",
+    "run_status": "TEXT",
+    "run_conclusion": "TEXT",
+    "run_url": "TEXT",
+    "build_key": "TEXT",
+}
+
+_workers: List[asyncio.Task] = []
+_wakeup = asyncio.Event()
+# Set while stopping: asyncio.wait_for can swallow a cancel that races with the wakeup event
+_stopping = False
+
+
+def _add_columns(db: sqlite3.Connection):
+    columns = {row[1] for row in db.execute("PRAGMA table_info(dispatch_jobs)")}
+    for name, kind in _ADDED_COLUMNS.items():
+        if name not in columns:
+            db.execute(f"ALTER TABLE dispatch_jobs ADD COLUMN {name} {kind}")
+
+
+def _get_db() -> sqlite3.Connection:
+    return get_db(_SCHEMA, _add_columns)
+
+
+def _update_job(job_id: int, **fields):
+    fields["updated_at"] = time.time()
+    columns = ", ".join(f"{name} = ?" for name in fields)
+    db = _get_db()
+    with db:
+        db.execute(f"UPDATE dispatch_jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+
+
+def enqueue_dispatch(request_key: str, workflow_id: str, data: dict, chat_id: int = None,
+                     notify_text: str = None, build_key: str = None) -> Tuple[int, bool, int]:
+    """Queue a workflow dispatch and return (job id, newly queued, position in queue).
+
+    request_key identifies the user request (e.g. chat and message ID); queueing
+    the same request again returns the existing job instead of a second one.
+    The repository, and its workflow file for the job's API level, are picked when
+    the job is sent. build_key (see build_cache) lets identical requests find this job.
+    """
+    key = hashlib.sha256(f"{request_key}|{workflow_id}".encode()).hexdigest()[:16]
+    data = {**data, "inputs": {**data["inputs"], "dispatch_id": key}}
+    now = time.time()
+
+    db = _get_db()
+    with db:
+        cursor = db.execute(
+            "INSERT OR IGNORE INTO dispatch_jobs "
+            "(key, repo, workflow_id, payload, chat_id, notify_text, state, build_key, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (key, "", workflow_id, json.dumps(data), chat_id, notify_text, JOB_QUEUED, build_key, now, now)
+        )
+    created = cursor.rowcount == 1
+    job_id = db.execute("SELECT id FROM dispatch_jobs WHERE key = ?", (key,)).fetchone()[0]
+    position = db.execute(
+        "SELECT COUNT(*) FROM dispatch_jobs WHERE state IN (?, ?) AND id <= ?", (JOB_QUEUED, JOB_SENDING, job_id)
+    ).fetchone()[0]
+
+    if created:
+        LOGGER.info(f"Queued dispatch job {job_id} ({key}) for {workflow_id}, position {position}")
+        _wakeup.set()
+    else:
+        LOGGER.info(f"Dispatch job {job_id} ({key}) already queued, not adding it again")
+    return job_id, created, position
+
+
+def get_queue_stats() -> Dict[str, int]:
+    """Number of jobs per state."""
+    rows = _get_db().execute("SELECT state, COUNT(*) FROM dispatch_jobs GROUP BY state").fetchall()
+    return {state: count for state, count in rows}
+
+
+def get_tracked_jobs() -> List[sqlite3.Row]:
+    """Dispatched jobs whose workflow run has not finished (or not been found) yet."""
+    return _get_db().execute(
+        "SELECT * FROM dispatch_jobs WHERE state = ? AND (run_status IS NULL OR run_status NOT IN (?, ?)) "
+        "ORDER BY id", (JOB_DISPATCHED, RUN_COMPLETED, RUN_UNKNOWN)
+    ).fetchall()
+
+
+def find_active_build(build_key: str) -> Optional[sqlite3.Row]:
+    """The job building `build_key` right now: queued, being sent, or with its run not finished."""
+    return _get_db().execute(
+        "SELECT * FROM dispatch_jobs WHERE build_key = ? AND (state IN (?, ?) OR "
+        "(state = ? AND (run_status IS NULL OR run_status NOT IN (?, ?)))) ORDER BY id LIMIT 1",
+        (build_key, JOB_QUEUED, JOB_SENDING, JOB_DISPATCHED, RUN_COMPLETED, RUN_UNKNOWN)
+    ).fetchone()
+
+
+def update_job_run(job_id: int, **fields):
+    """Record what the run tracker learned about a job's workflow run."""
+    _update_job(job_id, **fields)
+
+
+def _pinned_target(job: sqlite3.Row) -> Optional[str]:
+    """A job whose last send may have reached GitHub is checked on, and sent to, the same target."""
+    return job["target"] if job["uncertain"] else None
+
+
+def _claim_job() -> Optional[Tuple[sqlite3.Row, Optional[DispatchTarget]]]:
+    """Take the oldest due job that a target can send now, marking it as being sent."""
+    now = time.time()
+    db = _get_db()
+    rows = db.execute(
+        "SELECT * FROM dispatch_jobs WHERE state = ? AND not_before <= ? ORDER BY id", (JOB_QUEUED, now)
+    ).fetchall()
+    if rows and not get_dispatch_targets():
+        _update_job(rows[0]["id"], state=JOB_SENDING)
+        return rows[0], None
+
+    for job in rows:
+        target = pick_dispatch_target(_pinned_target(job))
+        if target is not None:
+            target.acquire()
+            _update_job(job["id"], state=JOB_SENDING, target=target.key, repo=target.full_name)
+            return job, target
+    return None
+
+
+def _next_due_in() -> float:
+    """Seconds until a queued job is due and a target can send it, capped at IDLE_POLL."""
+    now = time.time()
+    rows = _get_db().execute(
+        "SELECT not_before, target, uncertain FROM dispatch_jobs WHERE state = ?", (JOB_QUEUED,)
+    ).fetchall()
+    waits = {}
+    due = IDLE_POLL
+    for job in rows:
+        pinned = _pinned_target(job)
+        if pinned not in waits:
+            target = get_dispatch_target(pinned) if pinned else None
+            targets = [target] if target else get_dispatch_targets()
+            waits[pinned] = min((t.ready_in() for t in targets), default=IDLE_POLL)
+        due = min(due, max(job["not_before"] - now, waits[pinned]))
+    return due
+
+
+def _is_rate_limited(response: httpx.Response) -> bool:
+    return response.status_code == 403 and (
+            response.headers.get("X-RateLimit-Remaining") == "0" or "Retry-After" in response.headers)
+
+
+async def _notify(chat_id: Optional[int], text: Optional[str]):
+    """Send a message about a job and return it, or None."""
+    if not chat_id or not text:
+        return None
+    try:
+        from Framework import bot
+        return await bot.send_message(chat_id, text)
+    except Exception as e:
+        LOGGER.error(f"Failed to notify chat {chat_id} about a dispatch: {e}")
+        return None
+
+
+async def _finish(job: sqlite3.Row, state: str, error: str = None):
+    _update_job(job["id"], state=state, last_error=error, uncertain=0)
+    if state == JOB_DISPATCHED:
+        LOGGER.info(f"Dispatch job {job['id']} ({job['key']}) dispatched")
+        message = await _notify(job["chat_id"], job["notify_text"])
+        if message is not None:
+            # The run tracker edits this message as the workflow run progresses
+            _update_job(job["id"], status_message_id=message.id)
+    else:
+        LOGGER.error(f"Dispatch job {job['id']} ({job['key']}) failed: {error}")
+        await _notify(job["chat_id"], f"❌ **Failed to trigger the GitHub workflow:**\n\n`{error}`")
+        await notify_build_waiters(job["build_key"], error="the workflow could not be started")
+
+
+async def _retry(job: sqlite3.Row, error: str, delay: float = None, uncertain: bool = False):
+    """Queue the job again, by default after an exponential back-off. A job free to move
+    to another target is retried right away: the failure was most likely the target's."""
+    attempts = job["attempts"] + 1
+    if attempts >= DISPATCH_MAX_ATTEMPTS:
+        await _finish(job, JOB_FAILED, f"{error} (after {attempts} attempts)")
+        return
+    uncertain = bool(uncertain or job["uncertain"])
+    if delay is None:
+        delay = 0.0 if len(get_dispatch_targets()) > 1 and not uncertain else min(2 ** attempts, MAX_BACKOFF)
+    LOGGER.warning(f"Dispatch job {job['id']} attempt {attempts} failed: {error}. Retrying in {delay:.0f}s")
+    _update_job(job["id"], state=JOB_QUEUED, attempts=attempts, last_error=error,
+                uncertain=int(uncertain), not_before=time.time() + delay)
+
+
+async def _process(job: sqlite3.Row, target: Optional[DispatchTarget]):
+    if target is None:
+        await _finish(job, JOB_FAILED, "No GitHub dispatch target is configured")
+        return
+
+    data = json.loads(job["payload"])
+    dispatch_id = data["inputs"].get("dispatch_id")
+    workflow_id = target.workflow_for(data["inputs"].get("api_level"))
+    if target.ref:
+        data["ref"] = target.ref
+
+    # An earlier attempt may have reached GitHub without us seeing the answer; never send twice
+    if job["uncertain"] and dispatch_id:
+        if job["target"] and job["target"] != target.key:
+            LOGGER.warning(f"Dispatch job {job['id']} was last sent to {job['target']}, which is no longer "
+                           f"configured; checking {target.full_name} instead")
+        try:
+            run = await find_dispatched_run(target.full_name, workflow_id, dispatch_id, job["created_at"] - 60,
+                                            token=target.token, api_url=target.api_url)
+        except Exception as e:
+            await _retry(job, f"Could not check for an earlier dispatch: {e}")
+            return
+        if run:
+            target.mark_success()
+            await _finish(job, JOB_DISPATCHED)
+            return
+
+    try:
+        response = await send_workflow_dispatch(target.full_name, workflow_id, data, token=target.token,
+                                                api_url=target.api_url)
+    except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout) as e:
+        target.mark_failure(f"{type(e).__name__}: {e}")
+        await _retry(job, f"{type(e).__name__}: {e}")
+        return
+    except httpx.RequestError as e:
+        # The request may have been delivered before the connection broke
+        target.mark_failure(f"{type(e).__name__}: {e}")
+        await _retry(job, f"{type(e).__name__}: {e}", uncertain=True)
+        return
+
+    target.observe(response)
+    error = f"GitHub API error {response.status_code} from {target.full_name}: {response.text[:200]}"
+    if response.is_success:
+        target.mark_success()
+        await _finish(job, JOB_DISPATCHED)
+    elif response.status_code == 422 and "dispatch_id" in response.text:
+        # Workflow file without the dispatch_id input: send without it
+        LOGGER.warning(f"Workflow {workflow_id} on {target.full_name} has no dispatch_id input")
+        data["inputs"].pop("dispatch_id", None)
+        _update_job(job["id"], state=JOB_QUEUED, payload=json.dumps(data), not_before=0)
+    elif response.status_code in RETRY_STATUS or _is_rate_limited(response):
+        if response.status_code >= 500:
+            target.mark_failure(error)
+        await _retry(job, error)
+    elif response.status_code in TARGET_ERROR_STATUS and has_other_target(target):
+        # Bad token, or no such workflow in this repo: rest the target and let another one take the job
+        target.mark_failure(error, cooldown=DISPATCH_TARGET_COOLDOWN)
+        await _retry(job, error, delay=0.0)
+    else:
+        await _finish(job, JOB_FAILED, error)
+
+
+async def _release_claim(job: sqlite3.Row, error: str):
+    """Requeue a job _process left in JOB_SENDING, so neither the user nor its build key waits for a restart."""
+    row = _get_db().execute("SELECT state FROM dispatch_jobs WHERE id = ?", (job["id"],)).fetchone()
+    if row is None or row["state"] != JOB_SENDING:
+        return
+    # The error may have come after the request reached GitHub: check before sending again
+    await _retry(job, error, uncertain=True)
+
+
+async def _worker(number: int):
+    while not _stopping:
+        try:
+            _wakeup.clear()
+            claimed = _claim_job()
+            if claimed is None:
+                try:
+                    await asyncio.wait_for(_wakeup.wait(), timeout=max(_next_due_in(), 0.05))
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            job, target = claimed
+            try:
+                await _process(job, target)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                LOGGER.error(f"Dispatch job {job['id']} ({job['key']}) hit an unexpected error: {e}", exc_info=True)
+                await _release_claim(job, f"{type(e).__name__}: {e}")
+            finally:
+                if target is not None:
+                    target.release()
+                _wakeup.set()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            LOGGER.error(f"Dispatch worker {number} error: {e}", exc_info=True)
+            await asyncio.sleep(5)
+
+
+def start_dispatch_workers():
+    """Recover interrupted jobs and start the workers. Called once from Framework.__main__."""
+    global _stopping
+    if _workers:
+        return
+    _stopping = False
+    db = _get_db()
+    with db:
+        # Jobs that were being sent when the process stopped may or may not have reached GitHub
+        recovered = db.execute(
+            "UPDATE dispatch_jobs SET state = ?, uncertain = 1, updated_at = ? WHERE state = ?",
+            (JOB_QUEUED, time.time(), JOB_SENDING)
+        ).rowcount
+    if recovered:
+        LOGGER.info(f"Recovered {recovered} interrupted dispatch job(s)")
+    if not get_dispatch_targets():
+        LOGGER.error("No GitHub dispatch target configured (GITHUB_TOKEN/OWNER/REPO or GITHUB_DISPATCH_TARGETS)")
+
+    for number in range(max(DISPATCH_WORKERS, 1)):
+        _workers.append(asyncio.create_task(_worker(number)))
+    LOGGER.info(f"Started {len(_workers)} dispatch workers ({get_queue_stats().get(JOB_QUEUED, 0)} job(s) queued)")
+
+
+async def stop_dispatch_workers():
+    """Stop the workers; a job cut off mid-send is checked against GitHub on the next start."""
+    global _stopping
+    _stopping = True
+    workers = list(_workers)
+    _workers.clear()
+    for task in workers:
+        task.cancel()
+    await asyncio.gather(*workers, return_exceptions=True)
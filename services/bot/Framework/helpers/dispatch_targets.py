@@ -0,0 +1,229 @@
+"""
+Dispatch targets: the (token, owner, repo) combinations workflow dispatches can be sent to.
+Each target has a token bucket refilled at the rate its GitHub rate-limit headers allow, so
+the dispatch queue can spread jobs over several accounts and repositories and send each
+one to the least-loaded target that is healthy and has budget left.
+"""
+
+import hashlib
+import json
+import time
+from typing import Optional, Dict, List
+
+import httpx
+
+from Framework.helpers.logger import LOGGER
+from Framework.helpers.workflows import select_workflow_id
+from config import *
+
+# Health back-off after transient failures (connection errors, 5xx), capped at this many seconds
+MAX_FAILURE_BACKOFF = 300.0
+# Length of GitHub's primary rate-limit window, used until a response tells us the real reset time
+RATE_LIMIT_WINDOW = 3600.0
+
+
+class DispatchTarget:
+    """One token and repository, with its token bucket and health."""
+
+    __slots__ = ("owner", "repo", "token", "ref", "workflows", "api_url", "key",
+                 "tokens", "rate", "updated_at", "limit", "remaining", "reset_at", "paused_until",
+                 "in_flight", "failures", "unhealthy_until", "last_error", "sent")
+
+    def __init__(self, owner: str, repo: str, token: str, ref: str = None, workflows: Dict[str, str] = None,
+                 api_url: str = None):
+        self.owner = owner
+        self.repo = repo
+        self.token = token
+        self.ref = ref
+        self.workflows = {str(level): name for level, name in (workflows or {}).items()}
+        self.api_url = (api_url or GITHUB_API_URL).rstrip("/")
+        # Stable ID stored with jobs; the token only contributes a fingerprint
+        fingerprint = hashlib.sha256((token or "").encode()).hexdigest()[:8]
+        self.key = f"{owner}/{repo}@{fingerprint}"
+
+        self.tokens = DISPATCH_TARGET_BURST
+        self.rate = DISPATCH_TARGET_RATE
+        self.updated_at = time.monotonic()
+        self.limit: Optional[int] = None
+        self.remaining: Optional[int] = None
+        self.reset_at = 0.0
+        self.paused_until = 0.0
+
+        self.in_flight = 0
+        self.failures = 0
+        self.unhealthy_until = 0.0
+        self.last_error: Optional[str] = None
+        self.sent = 0
+
+    @property
+    def full_name(self) -> str:
+        return f"{self.owner}/{self.repo}"
+
+    def workflow_for(self, api_level: str) -> str:
+        return select_workflow_id(api_level, self.workflows)
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.tokens + (now - self.updated_at) * self.rate, DISPATCH_TARGET_BURST)
+        self.updated_at = now
+
+    def ready_in(self) -> float:
+        """Seconds until this target can take another job (0 if it can now)."""
+        now = time.time()
+        if (self.paused_until and now >= self.paused_until) or (self.reset_at and now >= self.reset_at):
+            # The pause is over or the rate-limit window reset: start over at the configured rate
+            self.paused_until = 0.0
+            self.reset_at = 0.0
+            self.rate = DISPATCH_TARGET_RATE
+            self.tokens = max(self.tokens, 1.0)
+            self.updated_at = time.monotonic()
+        self._refill()
+        wait = max(self.unhealthy_until - now, self.paused_until - now, 0.0)
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.rate if self.rate > 0 else RATE_LIMIT_WINDOW)
+        return wait
+
+    def acquire(self):
+        self.tokens -= 1
+        self.in_flight += 1
+
+    def release(self):
+        self.in_flight -= 1
+
+    def observe(self, response: httpx.Response):
+        """Feed the bucket from GitHub's rate-limit headers."""
+        headers = response.headers
+        now = time.time()
+        try:
+            if headers.get("X-RateLimit-Limit"):
+                self.limit = int(headers["X-RateLimit-Limit"])
+            if headers.get("X-RateLimit-Remaining"):
+                self.remaining = int(headers["X-RateLimit-Remaining"])
+            if headers.get("X-RateLimit-Reset"):
+                self.reset_at = float(headers["X-RateLimit-Reset"])
+        except ValueError:
+            pass
+
+        self._refill()
+        pause_until = 0.0
+        if headers.get("Retry-After"):
+            try:
+                pause_until = now + float(headers["Retry-After"])
+            except ValueError:
+                pause_until = now + 60
+        elif self.remaining == 0:
+            pause_until = self.reset_at or now + RATE_LIMIT_WINDOW
+
+        if pause_until > now:
+            if pause_until > self.paused_until:
+                LOGGER.warning(f"Dispatch target {self.full_name} rate limited for {pause_until - now:.0f}s")
+            self.paused_until = max(self.paused_until, pause_until)
+            self.tokens = min(self.tokens, 0.0)
+        elif self.remaining is not None and self.reset_at > now:
+            # Spread what is left of this window evenly over the time until it resets
+            self.rate = min(DISPATCH_TARGET_RATE, self.remaining / max(self.reset_at - now, 1.0))
+            self.tokens = min(self.tokens, float(self.remaining))
+
+    def mark_success(self):
+        self.sent += 1
+        self.failures = 0
+        self.unhealthy_until = 0.0
+
+    def mark_failure(self, error: str, cooldown: float = None):
+        """Take the target out of rotation: for `cooldown` seconds, or an exponential back-off."""
+        self.failures += 1
+        self.last_error = error
+        if cooldown is None:
+            cooldown = min(2 ** self.failures, MAX_FAILURE_BACKOFF)
+        self.unhealthy_until = max(self.unhealthy_until, time.time() + cooldown)
+        LOGGER.warning(f"Dispatch target {self.full_name} unavailable for {cooldown:.0f}s: {error}")
+
+    @property
+    def healthy(self) -> bool:
+        return time.time() >= self.unhealthy_until
+
+
+_targets: List[DispatchTarget] = []
+
+
+def load_dispatch_targets() -> List[DispatchTarget]:
+    """Build the targets from GITHUB_TOKEN/OWNER/REPO plus GITHUB_DISPATCH_TARGETS."""
+    targets = []
+    if GITHUB_TOKEN and GITHUB_OWNER and GITHUB_REPO:
+        targets.append(DispatchTarget(GITHUB_OWNER, GITHUB_REPO, GITHUB_TOKEN))
+
+    if GITHUB_DISPATCH_TARGETS:
+        try:
+            entries = json.loads(GITHUB_DISPATCH_TARGETS)
+        except ValueError as e:
+            LOGGER.error(f"GITHUB_DISPATCH_TARGETS is not valid JSON: {e}")
+            entries = []
+        for entry in entries:
+            try:
+                targets.append(DispatchTarget(
+                    entry["owner"], entry["repo"], entry.get("token") or GITHUB_TOKEN,
+                    ref=entry.get("ref"), workflows=entry.get("workflows"), api_url=entry.get("api_url")
+                ))
+            except (KeyError, TypeError) as e:
+                LOGGER.error(f"Skipping dispatch target {entry!r}: missing {e}")
+
+    # The same token and repo listed twice would only double-count its budget
+    unique = {}
+    for target in targets:
+        unique.setdefault(target.key, target)
+    return list(unique.values())
+
+
+def get_dispatch_targets() -> List[DispatchTarget]:
+    if not _targets:
+        _targets.extend(load_dispatch_targets())
+        if _targets:
+            LOGGER.info(f"Dispatch targets: {', '.join(t.full_name for t in _targets)}")
+    return _targets
+
+
+def get_dispatch_target(key: str) -> Optional[DispatchTarget]:
+    for target in get_dispatch_targets():
+        if target.key == key:
+            return target
+    return None
+
+
+def pick_dispatch_target(pinned: str = None) -> Optional[DispatchTarget]:
+    """The least-loaded healthy target with a free slot and budget left, or None.
+
+    A job pinned to a target (because an earlier send may have reached it) only goes there.
+    """
+    candidates = get_dispatch_targets()
+    if pinned:
+        target = get_dispatch_target(pinned)
+        candidates = [target] if target else candidates
+
+    best = None
+    for target in candidates:
+        if target.in_flight >= DISPATCH_PER_REPO_LIMIT or target.ready_in() > 0:
+            continue
+        # Fewest jobs in flight first, then the fullest bucket
+        if best is None or (target.in_flight, -target.tokens) < (best.in_flight, -best.tokens):
+            best = target
+    return best
+
+
+def has_other_target(target: DispatchTarget) -> bool:
+    return any(t is not target and t.healthy for t in get_dispatch_targets())
+
+
+def format_target_stats() -> List[str]:
+    """One human-readable line per target."""
+    lines = []
+    for target in get_dispatch_targets():
+        if not target.healthy:
+            state = f"unhealthy ({target.last_error})"
+        elif time.time() < target.paused_until:
+            state = f"rate limited for {target.paused_until - time.time():.0f}s"
+        else:
+            state = "ok"
+        quota = f"{target.remaining}/{target.limit}" if target.limit is not None else "unknown"
+        lines.append(f"{target.full_name}: {state}, {target.in_flight} in flight, {target.sent} sent, "
+                     f"API quota {quota}, {target.rate:.2f}/s")
+    return lines
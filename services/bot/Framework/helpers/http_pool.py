@@ -0,0 +1,130 @@
+"""
+Shared outbound HTTP clients.
+One long-lived, pooled httpx client per upstream, opened at startup and closed on shutdown,
+so repeated calls reuse connections instead of paying a TCP and TLS handshake each time.
+"""
+
+import time
+from typing import Dict, Any
+
+import httpx
+
+from Framework.helpers.logger import LOGGER
+
+try:
+    import h2  # noqa: F401
+
+    HTTP2 = True
+except ImportError:  # HTTP/2 needs httpx[http2]; fall back to keep-alive HTTP/1.1
+    HTTP2 = False
+
+# Per-upstream client settings. Each upstream has its own pool, which is what
+# bounds connections per host: a burst of uploads cannot starve GitHub calls.
+# Per-request timeouts passed by callers override the defaults here.
+CLIENT_SETTINGS: Dict[str, Dict[str, Any]] = {
+    "github": {
+        "timeout": httpx.Timeout(60.0, connect=20.0, pool=10.0),
+        "limits": httpx.Limits(max_connections=5, max_keepalive_connections=2, keepalive_expiry=60.0),
+    },
+    "pixeldrain": {
+        "timeout": httpx.Timeout(120.0, connect=30.0, pool=10.0),
+        "limits": httpx.Limits(max_connections=10, max_keepalive_connections=5, keepalive_expiry=30.0),
+        "follow_redirects": True,
+    },
+    "default": {
+        "timeout": httpx.Timeout(30.0),
+        "limits": httpx.Limits(max_connections=10, max_keepalive_connections=5, keepalive_expiry=30.0),
+    },
+}
+
+_clients: Dict[str, httpx.AsyncClient] = {}
+
+# Per-client counters: requests sent, new connections opened, TLS handshakes
+# and the time spent connecting. Requests minus connections were served on
+# reused connections.
+http_stats: Dict[str, Dict[str, float]] = {}
+
+
+def _event_hooks(name: str) -> Dict[str, list]:
+    stats = http_stats.setdefault(name, {"requests": 0, "connections": 0, "tls_handshakes": 0, "connect_seconds": 0.0})
+
+    async def on_request(request: httpx.Request):
+        stats["requests"] += 1
+        started = {}
+
+        # httpcore reports connection setup through the trace extension
+        async def trace(event: str, info: dict):
+            if event == "connection.connect_tcp.started":
+                started["at"] = time.perf_counter()
+            elif event in ("connection.connect_tcp.complete", "connection.start_tls.complete") and "at" in started:
+                now = time.perf_counter()
+                stats["connect_seconds"] += now - started["at"]
+                started["at"] = now
+                if event == "connection.connect_tcp.complete":
+                    stats["connections"] += 1
+                else:
+                    stats["tls_handshakes"] += 1
+
+        request.extensions["trace"] = trace
+
+    return {"request": [on_request]}
+
+
+def get_http_client(name: str = "default") -> httpx.AsyncClient:
+    """Get the shared client for an upstream, creating it if needed."""
+    client = _clients.get(name)
+    if client is None or client.is_closed:
+        settings = CLIENT_SETTINGS.get(name, CLIENT_SETTINGS["default"])
+        client = httpx.AsyncClient(
+            http2=HTTP2,
+            headers={"User-Agent": "FrameworkPatcherBot/1.0"},
+            event_hooks=_event_hooks(name),
+            **settings
+        )
+        _clients[name] = client
+    return client
+
+
+def open_http_clients():
+    """Create every shared client. Called once from Framework.__main__ at startup."""
+    for name in CLIENT_SETTINGS:
+        get_http_client(name)
+    LOGGER.info(f"Opened HTTP clients: {', '.join(_clients)} (HTTP/2 {'on' if HTTP2 else 'off'})")
+
+
+async def close_http_clients():
+    """Close every shared client and log the connection reuse they achieved."""
+    clients = list(_clients.values())
+    _clients.clear()
+    for client in clients:
+        try:
+            await client.aclose()
+        except Exception as e:
+            LOGGER.error(f"Error closing HTTP client: {e}")
+    for line in format_http_stats():
+        LOGGER.info(line)
+
+
+def get_http_stats() -> Dict[str, Dict[str, float]]:
+    """Connection reuse per client, with the reuse ratio and estimated handshake time saved."""
+    result = {}
+    for name, stats in http_stats.items():
+        requests, connections = stats["requests"], stats["connections"]
+        reused = max(requests - connections, 0)
+        avg_connect = stats["connect_seconds"] / connections if connections else 0.0
+        result[name] = {
+            **stats,
+            "reused": reused,
+            "reuse_ratio": reused / requests if requests else 0.0,
+            "saved_seconds": reused * avg_connect,
+        }
+    return result
+
+
+def format_http_stats() -> list:
+    """One human-readable line per client."""
+    return [
+        f"HTTP {name}: {int(s['requests'])} requests, {int(s['connections'])} connections, "
+        f"{s['reuse_ratio']:.0%} reused, ~{s['saved_seconds'] * 1000:.0f}ms of handshakes saved"
+        for name, s in get_http_stats().items()
+    ]
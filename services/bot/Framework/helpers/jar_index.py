@@ -0,0 +1,107 @@
+"""
+Content-addressed index of uploaded JARs.
+Maps each JAR's SHA-256 to the PixelDrain file holding it, and Telegram file_unique_ids to the
+SHA-256 of their content. A JAR sent before (even by someone else) is then neither downloaded
+from Telegram nor uploaded to PixelDrain again. Kept in SQLite next to the dispatch queue.
+"""
+
+import sqlite3
+import time
+from typing import Optional, Dict, Tuple
+
+from Framework.helpers.db import get_db
+from Framework.helpers.logger import LOGGER
+from Framework.helpers.pd_utils import is_file_live
+from config import *
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jar_uploads (
+    sha256 TEXT PRIMARY KEY,
+    pixeldrain_id TEXT NOT NULL,
+    size INTEGER,
+    file_name TEXT,
+    uses INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS telegram_files (
+    file_unique_id TEXT PRIMARY KEY,
+    sha256 TEXT NOT NULL
+);
+"""
+
+# PixelDrain IDs confirmed live recently, so a popular JAR is not re-checked for every request
+_live_until: Dict[str, float] = {}
+
+index_stats = {"reused_by_file_id": 0, "reused_by_hash": 0, "stale": 0, "uploads": 0}
+
+
+def _get_db() -> sqlite3.Connection:
+    return get_db(_SCHEMA)
+
+
+def record_upload(sha256: str, pixeldrain_id: str, size: int = None, file_name: str = None):
+    """Remember that `pixeldrain_id` holds the JAR with this content."""
+    now = time.time()
+    db = _get_db()
+    with db:
+        db.execute(
+            "INSERT OR REPLACE INTO jar_uploads (sha256, pixeldrain_id, size, file_name, created_at, last_used) "
+            "VALUES (?, ?, ?, ?, ?, ?)", (sha256, pixeldrain_id, size, file_name, now, now)
+        )
+    index_stats["uploads"] += 1
+    _live_until[pixeldrain_id] = now + JAR_LIVE_CHECK_TTL
+
+
+def remember_telegram_file(file_unique_id: str, sha256: str):
+    """Remember the content of a Telegram file, so the next copy of it needs no download."""
+    db = _get_db()
+    with db:
+        db.execute("INSERT OR REPLACE INTO telegram_files (file_unique_id, sha256) VALUES (?, ?)",
+                   (file_unique_id, sha256))
+
+
+async def find_reusable_upload(file_unique_id: str = None, sha256: str = None) -> Optional[Tuple[str, str]]:
+    """(SHA-256, PixelDrain ID) of a live upload of this Telegram file or content, or None.
+
+    Entries whose PixelDrain file is gone (404, or different content) are dropped, and the caller
+    uploads again. When PixelDrain cannot be asked, the entry is kept but not used this time.
+    """
+    db = _get_db()
+    if sha256 is None and file_unique_id:
+        row = db.execute("SELECT sha256 FROM telegram_files WHERE file_unique_id = ?", (file_unique_id,)).fetchone()
+        sha256 = row[0] if row else None
+    if sha256 is None:
+        return None
+
+    upload = db.execute("SELECT * FROM jar_uploads WHERE sha256 = ?", (sha256,)).fetchone()
+    if upload is None:
+        return None
+
+    pixeldrain_id = upload["pixeldrain_id"]
+    now = time.time()
+    if _live_until.get(pixeldrain_id, 0) < now:
+        live = await is_file_live(pixeldrain_id, sha256)
+        if live is None:
+            LOGGER.warning(f"Could not check PixelDrain file {pixeldrain_id} for JAR {sha256[:12]}, uploading again")
+            return None
+        if not live:
+            LOGGER.info(f"PixelDrain file {pixeldrain_id} for JAR {sha256[:12]} is gone, uploading again")
+            index_stats["stale"] += 1
+            _live_until.pop(pixeldrain_id, None)
+            with db:
+                db.execute("DELETE FROM jar_uploads WHERE sha256 = ?", (sha256,))
+            return None
+        _live_until[pixeldrain_id] = now + JAR_LIVE_CHECK_TTL
+
+    with db:
+        db.execute("UPDATE jar_uploads SET uses = uses + 1, last_used = ? WHERE sha256 = ?", (now, sha256))
+    index_stats["reused_by_hash" if file_unique_id is None else "reused_by_file_id"] += 1
+    return sha256, pixeldrain_id
+
+
+def format_index_stats() -> str:
+    count = _get_db().execute("SELECT COUNT(*) FROM jar_uploads").fetchone()[0]
+    reused = index_stats["reused_by_file_id"] + index_stats["reused_by_hash"]
+    return (f"{count} known JAR(s), {reused} reused, {index_stats['uploads']} uploaded, "
+            f"{index_stats['stale']} stale")
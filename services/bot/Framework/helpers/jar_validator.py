@@ -0,0 +1,321 @@
+"""
+JAR validation before upload.
+Reads the ZIP central directory (the end of the file) to find the classes*.dex entries, then
+checks each DEX as its bytes go by: header magic, size, endianness, the DEX version against
+the selected Android version, and that the classes the patches need are defined in it (not
+just referenced). Nothing is extracted; deflated DEX entries are inflated piece by piece.
+The bytes come from a streamed upload through JarCheck.feed.
+"""
+
+import re
+import struct
+import sys
+import zlib
+from array import array
+from typing import Optional, Dict, List, Set, Tuple
+
+from Framework.helpers.logger import LOGGER
+
+# Classes the patches touch, so a JAR without them cannot be the right one
+EXPECTED_CLASSES: Dict[str, Tuple[str, ...]] = {
+    "framework.jar": ("Landroid/content/pm/PackageParser;", "Landroid/util/apk/ApkSignatureVerifier;"),
+    "services.jar": ("Lcom/android/server/pm/PackageManagerService;",),
+    "miui-services.jar": ("Lcom/android/server/pm/PackageManagerServiceImpl;",),
+}
+
+# Lowest API level that can load each DEX version (ART: 040 from Android 10, 041 from Android 15)
+DEX_VERSION_MIN_API = {35: 1, 37: 24, 38: 26, 39: 28, 40: 29, 41: 35}
+# From DEX 041 on, a file may be a container of several DEX sections, each with its own header
+DEX_CONTAINER_VERSION = 41
+
+_EOCD = struct.Struct("<4s4H2LH")
+_ZIP64_LOCATOR = struct.Struct("<4sLQL")
+_ZIP64_EOCD = struct.Struct("<4sQ2H2L4Q")
+_CD_ENTRY = struct.Struct("<4s6H3L5H2L")
+_LOCAL_HEADER_SIZE = 30
+_DEX_HEADER_SIZE = 0x70
+_DEX_NAME = re.compile(r"classes\d*\.dex")
+_INFLATE_PIECE = 1024 * 1024
+
+
+class JarValidationError(Exception):
+    """The file is not a JAR the patcher can use; the message says why, for the user."""
+
+
+class JarEntry:
+    __slots__ = ("name", "method", "compressed_size", "size", "header_offset")
+
+    def __init__(self, name: str, method: int, compressed_size: int, size: int, header_offset: int):
+        self.name = name
+        self.method = method
+        self.compressed_size = compressed_size
+        self.size = size
+        self.header_offset = header_offset
+
+
+def locate_central_directory(tail: bytes, size: int) -> Tuple[int, int, int]:
+    """(offset, size, entry count) of the central directory, from the last bytes of a `size`-byte file."""
+    base = size - len(tail)
+    position = tail.rfind(b"PK\x05\x06", max(0, len(tail) - 65536 - _EOCD.size))
+    if position < 0 or position + _EOCD.size > len(tail):
+        raise JarValidationError("this is not a JAR (ZIP) file, or it is truncated")
+    _, _, _, _, count, cd_size, cd_offset, _ = _EOCD.unpack_from(tail, position)
+    if count == 0xFFFF or cd_offset == 0xFFFFFFFF or cd_size == 0xFFFFFFFF:
+        locator = position - _ZIP64_LOCATOR.size
+        if locator < 0 or tail[locator:locator + 4] != b"PK\x06\x07":
+            raise JarValidationError("the ZIP64 end of central directory is missing")
+        record = _ZIP64_LOCATOR.unpack_from(tail, locator)[2] - base
+        if record < 0 or tail[record:record + 4] != b"PK\x06\x06":
+            raise JarValidationError("the ZIP64 end of central directory is damaged")
+        count, cd_size, cd_offset = _ZIP64_EOCD.unpack_from(tail, record)[7:10]
+    if cd_offset + cd_size > size:
+        raise JarValidationError("the ZIP central directory points past the end of the file")
+    return cd_offset, cd_size, count
+
+
+def parse_central_directory(data: bytes, count: int) -> List[JarEntry]:
+    """The entries of a central directory, given its bytes."""
+    entries = []
+    position = 0
+    for _ in range(count):
+        if data[position:position + 4] != b"PK\x01\x02":
+            raise JarValidationError("the ZIP central directory is damaged")
+        fields = _CD_ENTRY.unpack_from(data, position)
+        method, compressed_size, size = fields[4], fields[8], fields[9]
+        name_length, extra_length, comment_length, header_offset = fields[10], fields[11], fields[12], fields[16]
+        name_start = position + _CD_ENTRY.size
+        name = bytes(data[name_start:name_start + name_length]).decode("utf-8", "replace")
+        if 0xFFFFFFFF in (compressed_size, size, header_offset):
+            size, compressed_size, header_offset = _zip64_sizes(
+                data[name_start + name_length:name_start + name_length + extra_length],
+                size, compressed_size, header_offset
+            )
+        entries.append(JarEntry(name, method, compressed_size, size, header_offset))
+        position = name_start + name_length + extra_length + comment_length
+    return entries
+
+
+def _zip64_sizes(extra: bytes, size: int, compressed_size: int, header_offset: int) -> Tuple[int, int, int]:
+    position = 0
+    while position + 4 <= len(extra):
+        tag, length = struct.unpack_from("<2H", extra, position)
+        if tag == 0x0001:
+            values = iter(struct.unpack_from(f"<{length // 8}Q", extra, position + 4))
+            if size == 0xFFFFFFFF:
+                size = next(values)
+            if compressed_size == 0xFFFFFFFF:
+                compressed_size = next(values)
+            if header_offset == 0xFFFFFFFF:
+                header_offset = next(values)
+            break
+        position += 4 + length
+    return size, compressed_size, header_offset
+
+
+def _to_uints(data: bytes) -> array:
+    values = array("I", bytes(data))
+    if sys.byteorder != "little":
+        values.byteswap()
+    return values
+
+
+class _DexCheck:
+    """Checks one DEX file fed to it in order: its header, and which expected classes it defines."""
+
+    def __init__(self, name: str, size: int, descriptors: Tuple[bytes, ...]):
+        self.name = name
+        self.size = size
+        self.descriptors = descriptors
+        self.position = 0
+        self.header = bytearray()
+        self.version: Optional[int] = None
+        # Index sections captured as they pass: string_ids, type_ids and class_defs
+        self.sections: Dict[str, Tuple[int, int, bytearray]] = {}
+        self.overlap = max((len(d) for d in descriptors), default=1) - 1
+        self.tail = b""
+        self.hits: Dict[bytes, List[int]] = {d: [] for d in descriptors}
+        self.problem: Optional[str] = None
+
+    def feed(self, data: bytes):
+        if self.problem:
+            return
+        start = self.position
+        self.position += len(data)
+
+        if len(self.header) < _DEX_HEADER_SIZE:
+            self.header += data[:_DEX_HEADER_SIZE - len(self.header)]
+            if len(self.header) == _DEX_HEADER_SIZE:
+                self._read_header()
+                if self.problem:
+                    return
+
+        for section_start, section_end, captured in self.sections.values():
+            low, high = max(start, section_start), min(self.position, section_end)
+            if low < high:
+                captured += data[low - start:high - start]
+
+        window = self.tail + data
+        window_start = start - len(self.tail)
+        for descriptor in self.descriptors:
+            found = window.find(descriptor)
+            while found >= 0:
+                if window_start + found not in self.hits[descriptor]:
+                    self.hits[descriptor].append(window_start + found)
+                found = window.find(descriptor, found + 1)
+        self.tail = window[-self.overlap:] if self.overlap else b""
+
+    def _read_header(self):
+        header = bytes(self.header)
+        if header[:4] != b"dex\n" or header[7] != 0 or not header[4:7].isdigit():
+            self.problem = f"{self.name} is not a DEX file"
+            return
+        self.version = int(header[4:7])
+        declared_size, _, endian_tag = struct.unpack_from("<3L", header, 0x20)
+        if endian_tag != 0x12345678:
+            self.problem = f"{self.name} has an unsupported byte order"
+        elif declared_size > self.size or (declared_size != self.size and self.version < DEX_CONTAINER_VERSION):
+            self.problem = f"{self.name} is damaged (its header says {declared_size} bytes, it has {self.size})"
+        if self.problem:
+            return
+        string_count, string_offset, type_count, type_offset = struct.unpack_from("<4L", header, 0x38)
+        class_count, class_offset = struct.unpack_from("<2L", header, 0x60)
+        self.sections = {
+            "string_ids": (string_offset, string_offset + 4 * string_count, bytearray()),
+            "type_ids": (type_offset, type_offset + 4 * type_count, bytearray()),
+            "class_defs": (class_offset, class_offset + 32 * class_count, bytearray()),
+        }
+
+    def defined(self) -> Set[bytes]:
+        """The expected class descriptors this DEX defines."""
+        if self.problem or not self.sections:
+            return set()
+        string_ids = _to_uints(self.sections["string_ids"][2])
+        type_ids = _to_uints(self.sections["type_ids"][2])
+        class_types = set(_to_uints(self.sections["class_defs"][2])[::8])
+        found = set()
+        for descriptor, offsets in self.hits.items():
+            for offset in offsets:
+                # A string_data_item starts with its length as ULEB128: one byte for these names
+                try:
+                    type_index = type_ids.index(string_ids.index(offset - 1))
+                except ValueError:
+                    continue
+                if type_index in class_types:
+                    found.add(descriptor)
+                    break
+        return found
+
+
+class _EntryReader:
+    """Follows one DEX entry through the JAR's bytes: its local header, then its (deflated) data."""
+
+    def __init__(self, entry: JarEntry, dex: _DexCheck):
+        self.entry = entry
+        self.dex = dex
+        self.local_header = bytearray()
+        self.data_start: Optional[int] = None
+        self.inflater = zlib.decompressobj(-zlib.MAX_WBITS) if entry.method == 8 else None
+
+    @property
+    def end(self) -> int:
+        if self.data_start is None:
+            return self.entry.header_offset + _LOCAL_HEADER_SIZE
+        return self.data_start + self.entry.compressed_size
+
+    def feed(self, start: int, data) -> Optional[str]:
+        end = start + len(data)
+        if self.data_start is None:
+            header_start = self.entry.header_offset
+            low, high = max(start, header_start), min(end, header_start + _LOCAL_HEADER_SIZE)
+            if low < high:
+                self.local_header += data[low - start:high - start]
+            if len(self.local_header) < _LOCAL_HEADER_SIZE:
+                return None
+            if self.local_header[:4] != b"PK\x03\x04":
+                return f"the ZIP entry for {self.entry.name} is damaged"
+            name_length, extra_length = struct.unpack_from("<2H", self.local_header, 26)
+            self.data_start = header_start + _LOCAL_HEADER_SIZE + name_length + extra_length
+
+        low, high = max(start, self.data_start), min(end, self.end)
+        if low >= high:
+            return None
+        piece = data[low - start:high - start]
+        if self.inflater is None:
+            self.dex.feed(bytes(piece))
+            return None
+        # Inflate in bounded steps so a small deflated piece cannot expand without limit in memory
+        pending = self.inflater.decompress(piece, _INFLATE_PIECE)
+        while pending:
+            self.dex.feed(pending)
+            pending = self.inflater.decompress(self.inflater.unconsumed_tail, _INFLATE_PIECE)
+        return None
+
+
+class JarCheck:
+    """Validates a JAR whose bytes are fed in order, given its central directory entries."""
+
+    def __init__(self, entries: List[JarEntry], file_name: str, api_level: Optional[int] = None):
+        self.file_name = file_name
+        self.api_level = api_level
+        self.position = 0
+        self.descriptors = tuple(d.encode() for d in EXPECTED_CLASSES.get(file_name, ()))
+        dex_entries = sorted((e for e in entries if _DEX_NAME.fullmatch(e.name)), key=lambda e: e.header_offset)
+        if not any(e.name == "classes.dex" for e in dex_entries):
+            raise JarValidationError(
+                f"{file_name} has no classes.dex. It is probably from an odexed ROM; "
+                f"send the deodexed {file_name} instead"
+            )
+        for entry in dex_entries:
+            if entry.method not in (0, 8):
+                raise JarValidationError(f"{entry.name} uses an unsupported ZIP compression method")
+        self.dex_checks = [_DexCheck(e.name, e.size, self.descriptors) for e in dex_entries]
+        self.readers = [_EntryReader(e, dex) for e, dex in zip(dex_entries, self.dex_checks)]
+
+    def feed(self, data):
+        """Pass the next bytes of the JAR. Raises JarValidationError as soon as a DEX header is wrong."""
+        start = self.position
+        self.position += len(data)
+        for reader in self.readers:
+            if reader.entry.header_offset >= self.position:
+                break
+            if reader.end <= start and reader.data_start is not None:
+                continue
+            problem = reader.feed(start, data) or reader.dex.problem
+            if problem:
+                raise JarValidationError(problem)
+
+    def finish(self) -> List[str]:
+        """Check what the whole JAR showed. Returns a summary per DEX file."""
+        for check in self.dex_checks:
+            if check.problem:
+                raise JarValidationError(check.problem)
+            if check.version is None or check.position != check.size:
+                raise JarValidationError(f"{check.name} in {self.file_name} is incomplete")
+            min_api = DEX_VERSION_MIN_API.get(check.version)
+            if min_api is None and check.version > max(DEX_VERSION_MIN_API):
+                # Newer than this table, not wrong: let the build decide
+                LOGGER.warning(f"{check.name} in {self.file_name} has DEX version {check.version:03d}, "
+                               f"newer than the validator knows; accepting it")
+                continue
+            if min_api is None:
+                raise JarValidationError(f"{check.name} has an unknown DEX version {check.version:03d}")
+            if self.api_level and min_api > self.api_level:
+                raise JarValidationError(
+                    f"{self.file_name} is from a newer Android (DEX {check.version:03d} needs API {min_api}+) "
+                    f"than the selected API {self.api_level}"
+                )
+
+        defined = set()
+        for check in self.dex_checks:
+            defined |= check.defined()
+        missing = [d.decode()[1:-1].replace("/", ".") for d in self.descriptors if d not in defined]
+        if missing and any(check.version >= DEX_CONTAINER_VERSION for check in self.dex_checks):
+            # Only the first section of a DEX container is read, the classes may be in another one
+            LOGGER.warning(f"{', '.join(missing)} not found in the first DEX section(s) of {self.file_name}; "
+                           f"accepting it")
+        elif missing:
+            raise JarValidationError(
+                f"{self.file_name} does not contain {', '.join(missing)}. Is it the right file?"
+            )
+        return [f"{check.name}: DEX {check.version:03d}, {check.size} bytes" for check in self.dex_checks]
+
@@ -0,0 +1,202 @@
+"""
+Streaming PixelDrain uploads.
+Data is sent as the raw body of a PUT from any async chunk source (a file on disk, or a
+Telegram download relayed as it arrives), through a small bounded buffer so the source and
+the upload run at the same time. Memory use does not depend on the file size, timeouts apply
+per chunk instead of to the whole upload, and the SHA-256 is computed on the way through.
+Progress goes to an optional callback at most every UPLOAD_PROGRESS_INTERVAL seconds.
+PixelDrain cannot continue a partial upload, so a failed attempt is sent again from the start;
+but when the whole body went out before the error, the account's file list is checked first,
+and an upload that did land is used instead of sending the data a second time.
+"""
+
+import asyncio
+import hashlib
+import os
+import time
+from typing import Optional, Callable, Awaitable, AsyncIterator, List, Tuple
+from urllib.parse import quote
+
+import httpx
+
+from Framework.helpers.http_pool import get_http_client
+from Framework.helpers.logger import LOGGER
+from config import *
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+# Chunks read ahead of the upload; bounds memory when the source is faster than PixelDrain
+UPLOAD_BUFFER_CHUNKS = 8
+UPLOAD_MAX_ATTEMPTS = 5
+RETRY_STATUS = {429, 500, 502, 503, 504}
+# Write and read timeouts apply to each chunk and to the final response, not to the whole upload
+UPLOAD_TIMEOUT = httpx.Timeout(connect=30.0, read=120.0, write=60.0, pool=10.0)
+
+# Called with (bytes sent, total bytes, bytes per second)
+ProgressCallback = Callable[[int, int, float], Awaitable[None]]
+# Returns a fresh iterator over the data, once per attempt
+ChunkSource = Callable[[], AsyncIterator[bytes]]
+
+
+class UploadAborted(Exception):
+    """Raised by a chunk source to stop the upload for good, e.g. when the data turns out to be wrong."""
+
+
+class _Attempt:
+    """Bytes sent by one upload attempt, their hash, and the rate-limited progress reports about it."""
+
+    def __init__(self, total: int, progress: Optional[ProgressCallback]):
+        self.total = total
+        self.sent = 0
+        self.digest = hashlib.sha256()
+        self.started = time.monotonic()
+        self.progress = progress
+        self.reported_at = self.started
+        self.report_task: Optional[asyncio.Task] = None
+
+    @property
+    def rate(self) -> float:
+        return self.sent / max(time.monotonic() - self.started, 1e-6)
+
+    def advance(self, chunk: bytes):
+        self.sent += len(chunk)
+        self.digest.update(chunk)
+        now = time.monotonic()
+        # Edits run beside the upload; one still in flight means this report is skipped
+        if (self.progress and now - self.reported_at >= UPLOAD_PROGRESS_INTERVAL
+                and (self.report_task is None or self.report_task.done())):
+            self.reported_at = now
+            self.report_task = asyncio.create_task(self._report(self.sent, self.rate))
+
+    async def _report(self, sent: int, rate: float):
+        try:
+            await self.progress(sent, self.total, rate)
+        except Exception as e:
+            LOGGER.warning(f"Upload progress update failed: {e}")
+
+
+async def read_file_chunks(file_path: str) -> AsyncIterator[bytes]:
+    """Yield a file in UPLOAD_CHUNK_SIZE pieces, reading off the event loop."""
+    with open(file_path, "rb") as file:
+        while True:
+            chunk = await asyncio.to_thread(file.read, UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+
+async def _send_chunks(source: AsyncIterator[bytes], attempt: _Attempt) -> AsyncIterator[bytes]:
+    """Read `source` ahead into a bounded buffer and yield it to the HTTP client."""
+    buffer: asyncio.Queue = asyncio.Queue(maxsize=UPLOAD_BUFFER_CHUNKS)
+
+    async def fill():
+        try:
+            async for chunk in source:
+                await buffer.put(chunk)
+            await buffer.put(None)
+        except Exception as e:
+            await buffer.put(e)
+
+    filler = asyncio.create_task(fill())
+    try:
+        while True:
+            item = await buffer.get()
+            if item is None:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+            # Resumed once the client has written the chunk out
+            attempt.advance(item)
+    finally:
+        filler.cancel()
+
+
+async def _find_landed_upload(client: httpx.AsyncClient, api_url: str, api_key: str, size: int,
+                              sha256: str) -> Optional[str]:
+    """ID of a file in the account with this size and hash, i.e. an upload whose response was lost."""
+    try:
+        response = await client.get(f"{api_url}/user/files", auth=("", api_key), timeout=30)
+        response.raise_for_status()
+        files = response.json().get("files") or []
+    except (httpx.HTTPError, ValueError) as e:
+        LOGGER.warning(f"Could not list PixelDrain files to look for a landed upload: {e}")
+        return None
+    for entry in sorted(files, key=lambda f: f.get("date_upload", ""), reverse=True):
+        if entry.get("size") == size and (entry.get("hash_sha256") or "").lower() == sha256.lower():
+            return entry.get("id")
+    return None
+
+
+def _format_rate(sent: int, elapsed: float) -> str:
+    return f"{sent / max(elapsed, 1e-6) / (1024 * 1024):.2f} MiB/s"
+
+
+async def upload_file(file_path: str, api_key: str, file_name: str = None, progress: ProgressCallback = None,
+                      api_url: str = None) -> Tuple[dict, List[str]]:
+    """Upload a file on disk to PixelDrain. See upload_stream."""
+    return await upload_stream(lambda: read_file_chunks(file_path), os.path.getsize(file_path),
+                               file_name or os.path.basename(file_path), api_key, progress, api_url)
+
+
+async def upload_stream(open_source: ChunkSource, size: int, file_name: str, api_key: str,
+                        progress: ProgressCallback = None, api_url: str = None) -> Tuple[dict, List[str]]:
+    """Upload `size` bytes from `open_source()` to PixelDrain.
+
+    Returns ({"id": ..., "sha256": ...} or {"error": ...}, log lines).
+    """
+    api_url = (api_url or PIXELDRAIN_API_URL).rstrip("/")
+    url = f"{api_url}/file/{quote(file_name)}"
+    client = get_http_client("pixeldrain")
+    logs = [f"Uploading {file_name} ({size} bytes) to PixelDrain..."]
+
+    for number in range(1, UPLOAD_MAX_ATTEMPTS + 1):
+        attempt = _Attempt(size, progress)
+        try:
+            response = await client.put(
+                url,
+                content=_send_chunks(open_source(), attempt),
+                auth=("", api_key),
+                headers={"Content-Length": str(size), "Accept": "application/json"},
+                timeout=UPLOAD_TIMEOUT,
+            )
+            response.raise_for_status()
+            data = response.json()
+            data["sha256"] = attempt.digest.hexdigest()
+            elapsed = time.monotonic() - attempt.started
+            LOGGER.info(f"Uploaded {file_name} on attempt {number}: {size} bytes in {elapsed:.1f}s "
+                        f"({_format_rate(size, elapsed)})")
+            logs.append(f"Uploaded Successfully to PixelDrain ({_format_rate(size, elapsed)})")
+            return data, logs
+        except UploadAborted as e:
+            LOGGER.warning(f"Upload of {file_name} aborted after {attempt.sent}/{size} bytes: {e}")
+            logs.append(f"Upload aborted: {e}")
+            return {"error": str(e)}, logs
+        except Exception as e:
+            # HTTP errors, and errors from the source (e.g. a failed Telegram download)
+            elapsed = time.monotonic() - attempt.started
+            status = e.response.status_code if isinstance(e, httpx.HTTPStatusError) else None
+            error = f"HTTP {status}: {e.response.text[:200]}" if status else f"{type(e).__name__}: {e}"
+            message = (f"Upload attempt {number}/{UPLOAD_MAX_ATTEMPTS} failed after {attempt.sent}/{size} bytes "
+                       f"in {elapsed:.1f}s ({_format_rate(attempt.sent, elapsed)}): {error}")
+            LOGGER.error(message)
+            logs.append(message)
+            if status is not None and status not in RETRY_STATUS:
+                return {"error": error}, logs
+        finally:
+            if attempt.report_task and not attempt.report_task.done():
+                attempt.report_task.cancel()
+
+        if attempt.sent == size and api_key:
+            sha256 = attempt.digest.hexdigest()
+            landed = await _find_landed_upload(client, api_url, api_key, size, sha256)
+            if landed:
+                LOGGER.info(f"Upload of {file_name} reached PixelDrain as {landed} despite the error")
+                logs.append(f"The upload went through despite the error, using {landed}")
+                return {"id": landed, "sha256": sha256}, logs
+
+        if number < UPLOAD_MAX_ATTEMPTS:
+            wait_time = min(2 ** (number - 1), 30)
+            logs.append(f"Retrying in {wait_time} seconds...")
+            await asyncio.sleep(wait_time)
+
+    return {"error": f"Upload failed after {UPLOAD_MAX_ATTEMPTS} attempts"}, logs
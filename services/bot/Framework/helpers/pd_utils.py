@@ -1,3 +1,5 @@
+from typing import Optional
+
 from pyrogram.types import Message, InlineKeyboardButton, InlineKeyboardMarkup
 
 from Framework.helpers.logger import LOGGER
@@ -5,7 +7,9 @@ from Framework.helpers.functions import format_size, format_date
 from Framework.helpers.buttons import *
 from Framework.helpers.state import *
 from Framework.helpers.provider import *
+from Framework.helpers.http_pool import get_http_client
 import httpx
+from config import PIXELDRAIN_API_URL
 
 
 def get_id(text: str) -> str | None:
@@ -27,10 +31,10 @@ async def send_data(file_id: str, message: Message):
     text = "`Fetching file information...`"
     reply_markup = None
     try:
-        async with httpx.AsyncClient(timeout=30) as client:
-            response = await client.get(f"https://pixeldrain.com/api/file/{file_id}/info")
-            response.raise_for_status()
-            data = response.json()
+        client = get_http_client("pixeldrain")
+        response = await client.get(f"{PIXELDRAIN_API_URL.rstrip('/')}/file/{file_id}/info", timeout=30)
+        response.raise_for_status()
+        data = response.json()
     except httpx.RequestError as e:
         LOGGER.error(f"Error fetching PixelDrain info for {file_id}: {type(e).__name__}: {e}")
         text = f"Failed to retrieve file information: Network error or invalid ID."
@@ -78,3 +82,34 @@ async def send_data(file_id: str, message: Message):
         reply_markup=reply_markup,
         disable_web_page_preview=True
     )
+
+
+async def get_file_info(file_id: str) -> dict | None:
+    """PixelDrain's info for a file, or None when PixelDrain says it is gone.
+
+    Raises httpx.HTTPError (or ValueError for a bad reply) when PixelDrain cannot be reached or
+    answers with an error, so that is never taken for a missing file.
+    """
+    client = get_http_client("pixeldrain")
+    response = await client.get(f"{PIXELDRAIN_API_URL.rstrip('/')}/file/{file_id}/info", timeout=15)
+    if response.status_code == 404:
+        return None
+    response.raise_for_status()
+    data = response.json()
+    return data if data.get("success", True) else None
+
+
+async def is_file_live(file_id: str, sha256: str = None) -> Optional[bool]:
+    """Whether a PixelDrain file still exists, and still has the expected content when PixelDrain reports a hash.
+
+    None when that cannot be told right now (network error, PixelDrain error).
+    """
+    try:
+        data = await get_file_info(file_id)
+    except (httpx.HTTPError, ValueError) as e:
+        LOGGER.error(f"Error fetching PixelDrain info for {file_id}: {type(e).__name__}: {e}")
+        return None
+    if data is None:
+        return False
+    remote_hash = data.get("hash_sha256")
+    return not (sha256 and remote_hash and remote_hash.lower() != sha256.lower())
@@ -0,0 +1,266 @@
+"""
+Workflow run tracker.
+Matches each dispatched job to its GitHub Actions run through the "[dispatch_id]" in the run
+name and follows the run until it completes. One conditional runs-list request per repository
+covers every job in flight there, so the polling cost does not grow with the number of jobs.
+Status changes are shown by editing the job's "workflow triggered" message, at most once per poll.
+Successful runs are matched to the release they created, which goes into the build cache.
+"""
+
+import asyncio
+import json
+import re
+import time
+from typing import Optional, Dict, List, Tuple
+
+import httpx
+
+from Framework.helpers.build_cache import store_build, notify_build_waiters, format_build_links
+from Framework.helpers.dispatch_queue import get_tracked_jobs, update_job_run, RUN_COMPLETED, RUN_UNKNOWN
+from Framework.helpers.dispatch_targets import get_dispatch_target
+from Framework.helpers.logger import LOGGER
+from Framework.helpers.workflows import list_workflow_runs, get_workflow_run, list_releases
+from config import *
+
+_DISPATCH_ID = re.compile(r"\[([0-9a-f]{16})\]\s*$")
+
+RUN_LABELS = {
+    "requested": "🕒 Run requested on GitHub Actions",
+    "pending": "🕒 Run queued on GitHub Actions",
+    "waiting": "🕒 Run queued on GitHub Actions",
+    "queued": "🕒 Run queued on GitHub Actions",
+    "in_progress": "⚙️ Building...",
+}
+CONCLUSION_LABELS = {"failure": "failed", "timed_out": "timed out", "startup_failure": "failed to start"}
+
+_tracker_task: Optional[asyncio.Task] = None
+# Last ETag and body per request URL, replayed when GitHub answers 304
+_conditional_cache: Dict[str, Tuple[str, dict]] = {}
+_used_keys: set = set()
+# Newest text per (chat ID, message ID) waiting to be sent; several changes make one edit
+_pending_edits: Dict[Tuple[int, int], str] = {}
+
+tracker_stats = {"polls": 0, "requests": 0, "not_modified": 0, "edits": 0}
+
+
+async def _conditional_get(cache_key: str, request) -> Optional[dict]:
+    """Run a GET built by `request(etag)`, returning the cached body on 304."""
+    _used_keys.add(cache_key)
+    cached = _conditional_cache.get(cache_key)
+    response: httpx.Response = await request(cached[0] if cached else None)
+    tracker_stats["requests"] += 1
+    if response.status_code == 304 and cached:
+        tracker_stats["not_modified"] += 1
+        return cached[1]
+    response.raise_for_status()
+    body = response.json()
+    if response.headers.get("ETag"):
+        _conditional_cache[cache_key] = (response.headers["ETag"], body)
+    return body
+
+
+def _conclusion_label(conclusion: Optional[str]) -> str:
+    return CONCLUSION_LABELS.get(conclusion, (conclusion or "failed").replace("_", " "))
+
+
+def _render(job, status: str, conclusion: Optional[str], url: Optional[str], release: dict = None) -> str:
+    if status == RUN_COMPLETED:
+        if release:
+            line = f"✅ Build finished. {format_build_links(release['release_url'], release['module_url'])}"
+        elif conclusion == "success":
+            line = "✅ Build finished, the patched files are on their way."
+        else:
+            line = f"❌ Build {_conclusion_label(conclusion)}."
+    else:
+        line = RUN_LABELS.get(status, f"⏳ Run {status.replace('_', ' ')}")
+    if url:
+        line += f" [View run]({url})"
+    return f"{job['notify_text']}\n\n**Status:** {line}"
+
+
+def _queue_edit(job, text: str):
+    if job["chat_id"] and job["status_message_id"]:
+        _pending_edits[(job["chat_id"], job["status_message_id"])] = text
+
+
+async def _flush_edits():
+    """Send the pending message edits, one per message."""
+    if not _pending_edits:
+        return
+    from Framework import bot
+    edits = list(_pending_edits.items())
+    _pending_edits.clear()
+    for (chat_id, message_id), text in edits:
+        try:
+            await bot.edit_message_text(chat_id, message_id, text, disable_web_page_preview=True)
+            tracker_stats["edits"] += 1
+        except Exception as e:
+            LOGGER.error(f"Failed to update run status message {message_id} in chat {chat_id}: {e}")
+
+
+async def _find_release(source: tuple, run_id: int) -> Optional[dict]:
+    """The release a run created: its body links back to the run ("Workflow: .../actions/runs/<id>")."""
+    api_url, repo, token = source
+    releases = await _conditional_get(
+        f"{api_url}/{repo}/releases",
+        lambda etag: list_releases(repo, etag=etag, token=token, api_url=api_url)
+    )
+    for release in releases:
+        if f"/actions/runs/{run_id}" in (release.get("body") or ""):
+            assets = release.get("assets") or []
+            module = next((a for a in assets if a.get("name", "").endswith(".zip")), None)
+            return {"release_url": release.get("html_url"),
+                    "module_url": module.get("browser_download_url") if module else None}
+    return None
+
+
+async def _apply(job, run: dict, source: tuple):
+    status, conclusion, url = run.get("status"), run.get("conclusion"), run.get("html_url")
+    if (job["run_id"], job["run_status"], job["run_conclusion"]) == (run["id"], status, conclusion):
+        return
+    update_job_run(job["id"], run_id=run["id"], run_status=status, run_conclusion=conclusion, run_url=url)
+    LOGGER.info(f"Dispatch job {job['id']} run {run['id']}: {status}{f' ({conclusion})' if conclusion else ''}")
+
+    release = None
+    if status == RUN_COMPLETED and conclusion == "success":
+        try:
+            release = await _find_release(source, run["id"])
+        except Exception as e:
+            LOGGER.error(f"Failed to look up the release of run {run['id']}: {e}")
+        if release and job["build_key"]:
+            store_build(job["build_key"], release["release_url"], release["module_url"], url)
+        if release:
+            await notify_build_waiters(job["build_key"], release["release_url"], release["module_url"])
+        else:
+            await notify_build_waiters(job["build_key"], error="its release could not be found")
+    elif status == RUN_COMPLETED:
+        await notify_build_waiters(job["build_key"], error=_conclusion_label(conclusion))
+    _queue_edit(job, _render(job, status, conclusion, url, release))
+
+    # A run that died before its own Telegram step would otherwise leave the user waiting
+    if status == RUN_COMPLETED and conclusion != "success" and job["chat_id"]:
+        try:
+            from Framework import bot
+            await bot.send_message(
+                job["chat_id"],
+                f"❌ **The build did not finish** ({_conclusion_label(conclusion)}).\n\n"
+                f"[View the workflow run]({url})",
+                disable_web_page_preview=True
+            )
+        except Exception as e:
+            LOGGER.error(f"Failed to notify chat {job['chat_id']} about run {run['id']}: {e}")
+
+
+async def _give_up(job, reason: str):
+    LOGGER.warning(f"Dispatch job {job['id']}: {reason}, no longer tracking its run")
+    update_job_run(job["id"], run_status=RUN_UNKNOWN)
+    await notify_build_waiters(job["build_key"], error="its progress could not be followed")
+
+
+async def _poll_repo(repo: str, api_url: str, token: str, jobs: List):
+    now = time.time()
+    since = min(job["created_at"] for job in jobs) - 60
+    since -= since % 60  # Keep the query, and so its ETag, stable between polls
+
+    body = await _conditional_get(
+        f"{api_url}/{repo}/runs?{since}",
+        lambda etag: list_workflow_runs(repo, since, etag=etag, token=token, api_url=api_url)
+    )
+    runs_by_id, runs_by_dispatch = {}, {}
+    for run in body.get("workflow_runs", []):
+        runs_by_id[run["id"]] = run
+        match = _DISPATCH_ID.search(run.get("display_title") or run.get("name") or "")
+        if match:
+            runs_by_dispatch.setdefault(match.group(1), run)
+
+    for job in jobs:
+        if job["run_id"]:
+            run = runs_by_id.get(job["run_id"])
+            if run is None:
+                # Pushed off the first page by newer runs: ask for this one directly
+                run = await _conditional_get(
+                    f"{api_url}/{repo}/runs/{job['run_id']}",
+                    lambda etag, run_id=job["run_id"]: get_workflow_run(repo, run_id, etag=etag, token=token,
+                                                                        api_url=api_url)
+                )
+        else:
+            run = runs_by_dispatch.get(json.loads(job["payload"])["inputs"].get("dispatch_id"))
+
+        if run is not None:
+            await _apply(job, run, (api_url, repo, token))
+        elif now - job["updated_at"] > RUN_MATCH_TIMEOUT:
+            # updated_at is the dispatch time until a run is found
+            await _give_up(job, f"no run found {RUN_MATCH_TIMEOUT:.0f}s after the dispatch")
+        if run is not None and run.get("status") != RUN_COMPLETED and now - job["created_at"] > RUN_TRACK_TIMEOUT:
+            await _give_up(job, f"run still {run.get('status')} after {RUN_TRACK_TIMEOUT:.0f}s")
+
+
+async def _poll_once():
+    jobs = get_tracked_jobs()
+    if not jobs:
+        return
+    tracker_stats["polls"] += 1
+    _used_keys.clear()
+
+    # One request per repository, whichever token it was dispatched with
+    groups: Dict[Tuple[str, str], Tuple[str, list]] = {}
+    for job in jobs:
+        if not json.loads(job["payload"])["inputs"].get("dispatch_id"):
+            # Sent to a workflow without the dispatch_id input: its run cannot be told apart
+            await _give_up(job, "workflow has no dispatch_id input")
+            continue
+        target = get_dispatch_target(job["target"]) if job["target"] else None
+        api_url = target.api_url if target else GITHUB_API_URL
+        token = target.token if target else GITHUB_TOKEN
+        groups.setdefault((api_url, job["repo"]), (token, []))[1].append(job)
+
+    for (api_url, repo), (token, repo_jobs) in groups.items():
+        try:
+            await _poll_repo(repo, api_url, token, repo_jobs)
+        except Exception as e:
+            LOGGER.error(f"Failed to poll workflow runs of {repo}: {e}")
+
+    # Forget responses to queries that are no longer made
+    for key in set(_conditional_cache) - _used_keys:
+        del _conditional_cache[key]
+
+
+async def _tracker_loop():
+    while True:
+        try:
+            await _poll_once()
+            await _flush_edits()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            LOGGER.error(f"Run tracker error: {e}", exc_info=True)
+        await asyncio.sleep(RUN_POLL_INTERVAL)
+
+
+def start_run_tracker():
+    """Start the run tracker if it is not already running. Called once from Framework.__main__."""
+    global _tracker_task
+    if _tracker_task and not _tracker_task.done():
+        return _tracker_task
+    LOGGER.info(f"Starting workflow run tracker, polling every {RUN_POLL_INTERVAL:.0f}s")
+    _tracker_task = asyncio.create_task(_tracker_loop())
+    return _tracker_task
+
+
+async def stop_run_tracker():
+    """Cancel the run tracker and wait for it to exit."""
+    global _tracker_task
+    if not _tracker_task:
+        return
+    _tracker_task.cancel()
+    try:
+        await _tracker_task
+    except asyncio.CancelledError:
+        pass
+    _tracker_task = None
+
+
+def format_tracker_stats() -> str:
+    return (f"{len(get_tracked_jobs())} run(s) tracked, {tracker_stats['polls']} polls, "
+            f"{tracker_stats['requests']} requests ({tracker_stats['not_modified']} not modified), "
+            f"{tracker_stats['edits']} message edits")
@@ -0,0 +1,317 @@
+"""
+Conversation state of /start_patch sessions.
+Each user's session is a small fixed-slot record instead of a free-form dict. Its ROM
+version list is the provider's own list for the device, looked up by codename, never a
+copy. Sessions expire SESSION_TTL seconds after their last use. Changes are written to
+SQLite in the background every SESSION_FLUSH_INTERVAL seconds (and on shutdown), so a
+restart after /update picks up every conversation where it was.
+Daily workflow triggers per user are kept in the same database.
+"""
+
+import asyncio
+import json
+import sqlite3
+import time
+from datetime import datetime
+from typing import Optional, Dict, List, Set
+
+from Framework.helpers.db import get_db
+from Framework.helpers.logger import LOGGER
+from Framework.helpers.provider import get_device_versions
+from config import *
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS user_sessions (
+    user_id INTEGER PRIMARY KEY,
+    data TEXT NOT NULL,
+    touched_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS user_triggers (
+    user_id INTEGER NOT NULL,
+    triggered_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS user_triggers_user ON user_triggers (user_id, triggered_at);
+"""
+
+# Session fields written to the database; rom_versions is looked up again from the codename
+_PERSISTED = ("state", "files", "file_hashes", "device_name", "device_codename", "version_name",
+              "android_version", "api_level", "codename_retry_count", "features", "required_jars")
+_KEYS = frozenset(_PERSISTED) | {"rom_versions"}
+
+_flush_task: Optional[asyncio.Task] = None
+
+store_stats = {"loaded": 0, "expired": 0, "flushes": 0, "writes": 0}
+
+
+def _get_db() -> sqlite3.Connection:
+    return get_db(_SCHEMA)
+
+
+def _default_features() -> Dict[str, bool]:
+    return {
+        "enable_signature_bypass": False,
+        "enable_cn_notification_fix": False,
+        "enable_disable_secure_flag": False,
+        "enable_kaorios_toolbox": False
+    }
+
+
+class Session:
+    """One user's /start_patch conversation.
+
+    Read and written like the dict it replaces (session["state"], session.get("api_level")),
+    but only the known fields exist. A field set to None counts as missing for get().
+    """
+
+    __slots__ = _PERSISTED + ("_rom_versions", "touched_at")
+
+    def __init__(self, state: int = 0):
+        self.state = state
+        self.files: Dict[str, str] = {}
+        self.file_hashes: Dict[str, str] = {}
+        self.device_name: Optional[str] = None
+        self.device_codename: Optional[str] = None
+        self.version_name: Optional[str] = None
+        self.android_version: Optional[str] = None
+        self.api_level: Optional[str] = None
+        self.codename_retry_count = 0
+        self.features = _default_features()
+        self.required_jars: Optional[Set[str]] = None
+        self._rom_versions = None
+        self.touched_at = time.time()
+
+    @property
+    def rom_versions(self):
+        """The device's ROM versions in the provider snapshot, newest first.
+
+        The list is fetched once per session and then kept, so the indexes on the version
+        keyboard stay valid when a background refresh swaps the snapshot.
+        """
+        if self._rom_versions is None and self.device_codename:
+            self._rom_versions = get_device_versions(self.device_codename) or None
+        return self._rom_versions
+
+    @rom_versions.setter
+    def rom_versions(self, value):
+        self._rom_versions = value
+
+    def __getitem__(self, key: str):
+        if key not in _KEYS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key: str, value):
+        if key not in _KEYS:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def get(self, key: str, default=None):
+        value = getattr(self, key) if key in _KEYS else None
+        return default if value is None else value
+
+    def setdefault(self, key: str, default=None):
+        value = self.get(key)
+        if value is None:
+            self[key] = value = default
+        return value
+
+    def to_json(self) -> str:
+        data = {key: getattr(self, key) for key in _PERSISTED}
+        if data["required_jars"] is not None:
+            data["required_jars"] = sorted(data["required_jars"])
+        return json.dumps(data, separators=(",", ":"))
+
+    @classmethod
+    def from_json(cls, text: str, touched_at: float) -> "Session":
+        session = cls()
+        for key, value in json.loads(text).items():
+            if key in _PERSISTED:
+                setattr(session, key, value)
+        if session.required_jars is not None:
+            session.required_jars = set(session.required_jars)
+        session.touched_at = touched_at
+        return session
+
+
+class SessionStore:
+    """user ID -> Session, with expiry and write-behind persistence.
+
+    Any read of a session counts as use: it pushes back the expiry and queues the session
+    for the next write, since handlers change the fields (and the dicts in them) in place.
+    """
+
+    def __init__(self):
+        self._sessions: Optional[Dict[int, Session]] = None
+        self._dirty: Set[int] = set()
+        self._deleted: Set[int] = set()
+
+    def _load(self) -> Dict[int, Session]:
+        if self._sessions is None:
+            self._sessions = {}
+            cutoff = time.time() - SESSION_TTL
+            db = _get_db()
+            for row in db.execute("SELECT user_id, data, touched_at FROM user_sessions ORDER BY touched_at"):
+                if row["touched_at"] < cutoff:
+                    self._deleted.add(row["user_id"])
+                    continue
+                try:
+                    self._sessions[row["user_id"]] = Session.from_json(row["data"], row["touched_at"])
+                except (ValueError, TypeError) as e:
+                    LOGGER.warning(f"Dropping unreadable session of user {row['user_id']}: {e}")
+                    self._deleted.add(row["user_id"])
+            store_stats["loaded"] = len(self._sessions)
+            if self._sessions:
+                LOGGER.info(f"Restored {len(self._sessions)} conversation session(s)")
+        return self._sessions
+
+    def _live(self, user_id: int) -> Optional[Session]:
+        sessions = self._load()
+        session = sessions.get(user_id)
+        if session is None:
+            return None
+        now = time.time()
+        if now - session.touched_at > SESSION_TTL:
+            self._drop(user_id)
+            store_stats["expired"] += 1
+            return None
+        session.touched_at = now
+        self._dirty.add(user_id)
+        return session
+
+    def _drop(self, user_id: int) -> Optional[Session]:
+        session = self._load().pop(user_id, None)
+        self._dirty.discard(user_id)
+        self._deleted.add(user_id)
+        return session
+
+    def get(self, user_id: int, default=None):
+        session = self._live(user_id)
+        return default if session is None else session
+
+    def __getitem__(self, user_id: int) -> Session:
+        session = self._live(user_id)
+        if session is None:
+            raise KeyError(user_id)
+        return session
+
+    def __setitem__(self, user_id: int, session: Session):
+        sessions = self._load()
+        # Re-inserted last, so keys() stays ordered by most recent start
+        sessions.pop(user_id, None)
+        session.touched_at = time.time()
+        sessions[user_id] = session
+        self._deleted.discard(user_id)
+        self._dirty.add(user_id)
+
+    def __contains__(self, user_id: int) -> bool:
+        return self._live(user_id) is not None
+
+    def pop(self, user_id: int, *default):
+        session = self._drop(user_id)
+        if session is None:
+            if default:
+                return default[0]
+            raise KeyError(user_id)
+        return session
+
+    def keys(self) -> List[int]:
+        self.expire()
+        return list(self._load())
+
+    def __len__(self) -> int:
+        self.expire()
+        return len(self._load())
+
+    def expire(self) -> int:
+        """Drop sessions unused for SESSION_TTL seconds; returns how many."""
+        cutoff = time.time() - SESSION_TTL
+        expired = [user_id for user_id, session in self._load().items() if session.touched_at < cutoff]
+        for user_id in expired:
+            self._drop(user_id)
+        store_stats["expired"] += len(expired)
+        return len(expired)
+
+    def flush(self):
+        """Write changed sessions and remove ended ones, in one transaction."""
+        if not self._dirty and not self._deleted:
+            return
+        sessions = self._load()
+        rows = [(user_id, sessions[user_id].to_json(), sessions[user_id].touched_at)
+                for user_id in self._dirty if user_id in sessions]
+        deleted = [(user_id,) for user_id in self._deleted]
+        db = _get_db()
+        with db:
+            db.executemany("DELETE FROM user_sessions WHERE user_id = ?", deleted)
+            db.executemany("INSERT OR REPLACE INTO user_sessions (user_id, data, touched_at) VALUES (?, ?, ?)", rows)
+        self._dirty.clear()
+        self._deleted.clear()
+        store_stats["flushes"] += 1
+        store_stats["writes"] += len(rows) + len(deleted)
+
+    @property
+    def pending(self) -> int:
+        return len(self._dirty) + len(self._deleted)
+
+
+user_states = SessionStore()
+
+
+def _start_of_today() -> float:
+    return datetime.combine(datetime.now().date(), datetime.min.time()).timestamp()
+
+
+def count_triggers_today(user_id: int) -> int:
+    """Workflow triggers the user has used today (local time)."""
+    row = _get_db().execute("SELECT COUNT(*) FROM user_triggers WHERE user_id = ? AND triggered_at >= ?",
+                            (user_id, _start_of_today())).fetchone()
+    return row[0]
+
+
+def record_trigger(user_id: int):
+    """Count a workflow trigger against the user's daily limit, and forget the ones before today."""
+    db = _get_db()
+    with db:
+        db.execute("DELETE FROM user_triggers WHERE user_id = ? AND triggered_at < ?", (user_id, _start_of_today()))
+        db.execute("INSERT INTO user_triggers (user_id, triggered_at) VALUES (?, ?)", (user_id, time.time()))
+
+
+async def _flush_loop():
+    while True:
+        await asyncio.sleep(SESSION_FLUSH_INTERVAL)
+        try:
+            user_states.expire()
+            user_states.flush()
+        except Exception as e:
+            LOGGER.error(f"Session store flush failed: {e}", exc_info=True)
+
+
+def start_session_store():
+    """Load saved sessions and start writing changes behind. Called once from Framework.__main__."""
+    global _flush_task
+    if _flush_task and not _flush_task.done():
+        return _flush_task
+    LOGGER.info(f"Starting session store, {len(user_states)} session(s) restored")
+    _flush_task = asyncio.create_task(_flush_loop())
+    return _flush_task
+
+
+async def stop_session_store():
+    """Stop the background writer and write what is still pending."""
+    global _flush_task
+    if _flush_task:
+        _flush_task.cancel()
+        try:
+            await _flush_task
+        except asyncio.CancelledError:
+            pass
+        _flush_task = None
+    try:
+        user_states.flush()
+    except Exception as e:
+        LOGGER.error(f"Final session store flush failed: {e}", exc_info=True)
+
+
+def format_store_stats() -> str:
+    return (f"{len(user_states)} session(s), {user_states.pending} pending write(s), "
+            f"{store_stats['loaded']} restored, {store_stats['expired']} expired, "
+            f"{store_stats['writes']} row write(s) in {store_stats['flushes']} flush(es)")
@@ -1,8 +1,8 @@
 import os
 import time
 
-user_rate_limits = {}
-user_states = {}
+from Framework.helpers.session_store import user_states
+
 connection_retries = {}
 last_connection_check = time.time()
 bot_process_id = os.getpid()
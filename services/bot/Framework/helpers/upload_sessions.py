@@ -0,0 +1,284 @@
+"""
+Per-user upload sessions.
+The JARs a user sends for one build are relayed to PixelDrain concurrently, each in its own
+task, under a bot-wide limit on concurrent uploads (UPLOAD_CONCURRENCY) and total bandwidth
+(UPLOAD_BANDWIDTH). One message per session shows the progress of every JAR. Files finish
+under the session lock, so only the last one to land completes the session, and the build
+is queued exactly once however the handlers interleave.
+Each JAR is validated on the way: its central directory is read from the end of the Telegram
+file before the upload starts, and its DEX files are checked as they pass, with the last
+chunk held back so a wrong JAR never completes an upload.
+"""
+
+import asyncio
+import time
+from typing import Optional, Dict, List, Callable, Awaitable
+
+from Framework.helpers.functions import format_size
+from Framework.helpers.jar_index import find_reusable_upload, record_upload, remember_telegram_file
+from Framework.helpers.jar_validator import (JarCheck, JarEntry, JarValidationError, locate_central_directory,
+                                             parse_central_directory)
+from Framework.helpers.logger import LOGGER
+from Framework.helpers.pd_upload import upload_stream, UploadAborted
+from Framework.helpers.state import user_states
+from config import *
+
+# Size of the pieces Client.stream_media reads, and so of its offsets
+TELEGRAM_CHUNK_SIZE = 1024 * 1024
+
+FILE_WAITING = "waiting"
+FILE_UPLOADING = "uploading"
+FILE_DONE = "done"
+FILE_REUSED = "reused"
+FILE_FAILED = "failed"
+
+# Called with (message of the last file, user ID) once every required JAR is on PixelDrain
+CompleteCallback = Callable[[object, int], Awaitable[None]]
+
+
+class _Bandwidth:
+    """Token bucket over bytes, shared by every upload. A rate of 0 means unlimited."""
+
+    __slots__ = ("rate", "allowance", "updated_at")
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.allowance = rate
+        self.updated_at = time.monotonic()
+
+    async def take(self, size: int):
+        if self.rate <= 0:
+            return
+        now = time.monotonic()
+        # At most one second of burst
+        self.allowance = min(self.allowance + (now - self.updated_at) * self.rate, self.rate)
+        self.updated_at = now
+        # Reserve first, then wait out the debt, so concurrent uploads share the rate fairly
+        self.allowance -= size
+        if self.allowance < 0:
+            await asyncio.sleep(-self.allowance / self.rate)
+
+
+_bandwidth = _Bandwidth(UPLOAD_BANDWIDTH)
+_upload_slots: Optional[asyncio.Semaphore] = None
+_sessions: Dict[int, "UploadSession"] = {}
+
+
+def _get_upload_slots() -> asyncio.Semaphore:
+    global _upload_slots
+    if _upload_slots is None:
+        _upload_slots = asyncio.Semaphore(UPLOAD_CONCURRENCY)
+    return _upload_slots
+
+
+async def _throttled(source):
+    async for chunk in source:
+        await _bandwidth.take(len(chunk))
+        yield chunk
+
+
+async def _read_telegram_chunks(bot, message, first_chunk: int, count: int) -> bytes:
+    data = bytearray()
+    async for chunk in bot.stream_media(message, offset=first_chunk, limit=count):
+        data += chunk
+    return bytes(data)
+
+
+async def _read_central_directory(bot, message) -> List[JarEntry]:
+    """The JAR's ZIP entries, read from the last Telegram chunk(s) of the file only."""
+    size = message.document.file_size
+    last_chunk = max(size - 1, 0) // TELEGRAM_CHUNK_SIZE
+    # The end record (up to 64 KiB with its comment) may start in the chunk before a short last one
+    first_chunk = last_chunk
+    if first_chunk and size - first_chunk * TELEGRAM_CHUNK_SIZE < 65536 + 22:
+        first_chunk -= 1
+    tail = await _read_telegram_chunks(bot, message, first_chunk, last_chunk - first_chunk + 1)
+    base = first_chunk * TELEGRAM_CHUNK_SIZE
+    cd_offset, cd_size, count = locate_central_directory(tail, size)
+    if cd_offset < base:
+        # A large central directory starts further back
+        start_chunk = cd_offset // TELEGRAM_CHUNK_SIZE
+        tail = await _read_telegram_chunks(bot, message, start_chunk, first_chunk - start_chunk) + tail
+        base = start_chunk * TELEGRAM_CHUNK_SIZE
+    return parse_central_directory(tail[cd_offset - base:cd_offset - base + cd_size], count)
+
+
+async def _validated(source, check: JarCheck):
+    """Pass the chunks through `check`, holding the last one back until the whole JAR passed."""
+    held = None
+    try:
+        async for chunk in source:
+            check.feed(chunk)
+            if held is not None:
+                yield held
+            held = chunk
+        check.finish()
+    except JarValidationError as e:
+        raise UploadAborted(str(e)) from e
+    if held is not None:
+        yield held
+
+
+class UploadSession:
+    """The JARs one user is sending for one build, and the message showing their progress."""
+
+    __slots__ = ("user_id", "state", "on_complete", "files", "tasks", "lock", "message", "edited_at",
+                 "completed")
+
+    def __init__(self, user_id: int, state: dict, on_complete: CompleteCallback):
+        self.user_id = user_id
+        # The conversation state this session belongs to; a new /start_patch replaces it
+        self.state = state
+        self.on_complete = on_complete
+        self.files: Dict[str, dict] = {}
+        self.tasks = set()
+        self.lock = asyncio.Lock()
+        self.message = None
+        self.edited_at = 0.0
+        self.completed = False
+
+    @property
+    def current(self) -> bool:
+        return not self.completed and user_states.get(self.user_id) is self.state
+
+    def has(self, file_name: str) -> bool:
+        """Whether this JAR is already uploaded or on its way."""
+        entry = self.files.get(file_name)
+        return entry is not None and entry["status"] != FILE_FAILED
+
+    async def add(self, bot, message, file_name: str):
+        """Start relaying this JAR to PixelDrain in the background."""
+        self.files[file_name] = {"status": FILE_WAITING, "sent": 0, "total": message.document.file_size,
+                                 "rate": 0.0, "error": None}
+        if self.message is None:
+            self.message = await message.reply_text(self._render(), quote=True, disable_web_page_preview=True)
+        else:
+            await self._refresh(force=True)
+        task = asyncio.create_task(self._upload(bot, message, file_name))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    def _render(self) -> str:
+        required = self.state.get("required_jars") or set(self.files)
+        lines = []
+        for name in sorted(required | set(self.files)):
+            entry = self.files.get(name)
+            if entry is None:
+                line = "⏳ not sent yet"
+            elif entry["status"] == FILE_WAITING:
+                line = "🕒 waiting for an upload slot"
+            elif entry["status"] == FILE_UPLOADING:
+                percent = entry["sent"] * 100 // entry["total"] if entry["total"] else 0
+                line = (f"⬆️ {percent}% ({format_size(entry['sent'])} of {format_size(entry['total'])}, "
+                        f"{format_size(int(entry['rate']))}/s)")
+            elif entry["status"] == FILE_DONE:
+                line = f"✅ uploaded ({format_size(entry['total'])})"
+            elif entry["status"] == FILE_REUSED:
+                line = "♻️ uploaded before, reused"
+            else:
+                line = f"❌ failed ({entry['error']}), please send it again"
+            lines.append(f"`{name}`: {line}")
+        done = sum(1 for entry in self.files.values() if entry["status"] in (FILE_DONE, FILE_REUSED))
+        return f"📦 **JAR files: {done}/{len(required)} uploaded**\n\n" + "\n".join(lines)
+
+    async def _refresh(self, force: bool = False):
+        """Edit the progress message; progress updates at most every UPLOAD_PROGRESS_INTERVAL seconds."""
+        now = time.monotonic()
+        if self.message is None or (not force and now - self.edited_at < UPLOAD_PROGRESS_INTERVAL):
+            return
+        self.edited_at = now
+        try:
+            await self.message.edit_text(self._render(), disable_web_page_preview=True)
+        except Exception as e:
+            LOGGER.debug(f"Upload progress message for user {self.user_id} not edited: {e}")
+
+    async def _upload(self, bot, message, file_name: str):
+        entry = self.files[file_name]
+        try:
+            # A JAR seen before (same Telegram file) is already on PixelDrain: skip the download and the upload
+            unique_id = message.document.file_unique_id
+            reused = await find_reusable_upload(file_unique_id=unique_id)
+            if reused:
+                entry["status"] = FILE_REUSED
+                await self._finish(message, file_name, *reused)
+                return
+
+            # A file that is not a usable JAR is turned down before any upload
+            try:
+                jar_entries = await _read_central_directory(bot, message)
+                api_level = int(self.state["api_level"]) if str(self.state.get("api_level")).isdigit() else None
+                JarCheck(jar_entries, file_name, api_level)
+            except JarValidationError as e:
+                LOGGER.info(f"Rejected {file_name} from user {self.user_id}: {e}")
+                entry["status"], entry["error"] = FILE_FAILED, str(e)
+                await self._refresh(force=True)
+                return
+
+            async with _get_upload_slots():
+                if not self.current:
+                    return
+                entry["status"] = FILE_UPLOADING
+                await self._refresh(force=True)
+
+                async def show_progress(sent: int, total: int, rate: float):
+                    entry["sent"], entry["rate"] = sent, rate
+                    await self._refresh()
+
+                # Relay the Telegram download straight into the upload: nothing touches the disk,
+                # and the two legs overlap instead of running one after the other
+                response_data, logs = await upload_stream(
+                    lambda: _validated(_throttled(bot.stream_media(message)),
+                                       JarCheck(jar_entries, file_name, api_level)), entry["total"], file_name,
+                    PIXELDRAIN_API_KEY, progress=show_progress
+                )
+
+            if "error" in response_data:
+                LOGGER.error(f"Upload of {file_name} for user {self.user_id} failed:\n" + "\n".join(logs))
+                entry["status"], entry["error"] = FILE_FAILED, response_data["error"]
+                await self._refresh(force=True)
+                return
+
+            # The hash, computed during the relay, keys the build cache and the JAR index
+            file_hash, pixeldrain_id = response_data["sha256"], response_data["id"]
+            record_upload(file_hash, pixeldrain_id, entry["total"], file_name)
+            remember_telegram_file(unique_id, file_hash)
+            entry["status"] = FILE_DONE
+            await self._finish(message, file_name, file_hash, pixeldrain_id)
+        except Exception as e:
+            LOGGER.error(f"Error uploading {file_name} for user {self.user_id}: {e}", exc_info=True)
+            entry["status"], entry["error"] = FILE_FAILED, str(e) or type(e).__name__
+            await self._refresh(force=True)
+
+    async def _finish(self, message, file_name: str, file_hash: str, pixeldrain_id: str):
+        """Record a landed JAR; the last required one completes the session."""
+        async with self.lock:
+            if not self.current:
+                LOGGER.info(f"Upload session of user {self.user_id} ended before {file_name} landed")
+                return
+            self.state.setdefault("file_hashes", {})[file_name] = file_hash
+            self.state["files"][file_name] = f"https://pixeldrain.com/u/{pixeldrain_id}"
+            await self._refresh(force=True)
+
+            required = self.state.get("required_jars") or set()
+            if not required.issubset(self.state["files"]):
+                return
+            self.completed = True
+            if _sessions.get(self.user_id) is self:
+                del _sessions[self.user_id]
+        await self.on_complete(message, self.user_id)
+
+
+def get_upload_session(user_id: int, on_complete: CompleteCallback) -> UploadSession:
+    """The user's session for the current /start_patch, created on their first JAR."""
+    session = _sessions.get(user_id)
+    if session is None or not session.current:
+        session = UploadSession(user_id, user_states[user_id], on_complete)
+        _sessions[user_id] = session
+    return session
+
+
+def format_session_stats() -> str:
+    active = [s for s in _sessions.values() if s.current]
+    uploading = sum(1 for s in active for entry in s.files.values() if entry["status"] == FILE_UPLOADING)
+    waiting = sum(1 for s in active for entry in s.files.values() if entry["status"] == FILE_WAITING)
+    return f"{len(active)} session(s), {uploading} uploading, {waiting} waiting for a slot"
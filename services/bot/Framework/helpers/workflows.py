@@ -1,15 +1,18 @@
-import asyncio
+import datetime
 
 import httpx
 
+from Framework.helpers.http_pool import get_http_client
 from Framework.helpers.logger import LOGGER
 from config import *
 
 
-def _select_workflow_id(api_level: str) -> str:
+def select_workflow_id(api_level: str, workflows: dict = None) -> str:
     """Select the appropriate workflow file based on API level.
 
     Accepts either Android version (e.g., '16', 16, '15.0') or API level ('36'..'33').
+    `workflows` maps API levels (and optionally "default") to workflow files of one
+    dispatch target, overriding the GITHUB_WORKFLOW_ID_* settings.
     Always returns a non-empty workflow file name.
     """
     # Normalize input
@@ -26,6 +29,13 @@ def _select_workflow_id(api_level: str) -> str:
             mapping = {"13": "33", "14": "34", "15": "35", "16": "36"}
             api_str = mapping.get(api_str, api_str)
 
+    # Per-target overrides first
+    if workflows:
+        if workflows.get(api_str):
+            return workflows[api_str]
+        if api_str not in {"33", "34", "35", "36"} and workflows.get("default"):
+            return workflows["default"]
+
     # Map API levels to workflow files
     if api_str == "36":
         return WORKFLOW_ID_A16 or "android16.yml"
@@ -44,22 +54,8 @@ def _select_workflow_id(api_level: str) -> str:
     return WORKFLOW_ID_A16 or WORKFLOW_ID_A15 or WORKFLOW_ID_A14 or WORKFLOW_ID_A13 or "android15.yml"
 
 
-async def trigger_github_workflow_async(links: dict, device_name: str, device_codename: str, version_name: str,
-                                        api_level: str,
-                                        user_id: int, features: dict = None) -> int:
-    """Trigger GitHub workflow with improved error handling and retry logic."""
-    workflow_id = _select_workflow_id(api_level)
-    if not workflow_id:
-        LOGGER.error(f"Could not determine workflow ID for API level: {api_level}")
-        raise ValueError(f"Could not determine workflow ID for API level: {api_level}")
-    url = f"https://api.github.com/repos/{GITHUB_OWNER}/{GITHUB_REPO}/actions/workflows/{workflow_id}/dispatches"
-
-    headers = {
-        "Authorization": f"token {GITHUB_TOKEN}",
-        "Accept": "application/vnd.github.v3+json",
-        "User-Agent": "FrameworkPatcherBot/1.0"
-    }
-
+def features_to_string(features: dict = None) -> str:
+    """The workflow's comma-separated `features` input for the bot's feature toggles."""
     # Default features if not provided
     if features is None:
         features = {
@@ -82,6 +78,18 @@ async def trigger_github_workflow_async(links: dict, device_name: str, device_co
     features_str = ",".join(feature_list)
     if not features_str:
         features_str = "disable_signature_verification"
+    return features_str
+
+
+def build_workflow_dispatch(links: dict, device_name: str, device_codename: str, version_name: str, api_level: str,
+                            user_id: int, features: dict = None) -> tuple:
+    """Build the (workflow_id, request body) of a GitHub workflow dispatch."""
+    workflow_id = select_workflow_id(api_level)
+    if not workflow_id:
+        LOGGER.error(f"Could not determine workflow ID for API level: {api_level}")
+        raise ValueError(f"Could not determine workflow ID for API level: {api_level}")
+
+    features_str = features_to_string(features)
 
     data = {
         "ref": "master",
@@ -94,12 +102,12 @@ async def trigger_github_workflow_async(links: dict, device_name: str, device_co
             "features": features_str
         }
     }
-    
+
     # Only include JAR URLs if they are provided (not empty or None)
     framework_url = links.get("framework.jar")
     services_url = links.get("services.jar")
     miui_services_url = links.get("miui-services.jar")
-    
+
     if framework_url:
         data["inputs"]["framework_url"] = framework_url
     if services_url:
@@ -107,70 +115,86 @@ async def trigger_github_workflow_async(links: dict, device_name: str, device_co
     if miui_services_url:
         data["inputs"]["miui_services_url"] = miui_services_url
 
-    LOGGER.info(
-        f"Attempting to dispatch GitHub workflow to {url} for device {device_name} version {version_name} for user {user_id}")
+    return workflow_id, data
 
-    max_attempts = 3
-    base_timeout = 60
 
-    for attempt in range(max_attempts):
-        try:
-            timeout = base_timeout + (attempt * 20)
-            LOGGER.info(f"GitHub workflow trigger attempt {attempt + 1}/{max_attempts} with timeout {timeout}s")
-
-            async with httpx.AsyncClient(
-                    timeout=httpx.Timeout(
-                        connect=20.0,
-                        read=timeout,
-                        write=timeout,
-                        pool=10.0
-                    ),
-                    limits=httpx.Limits(max_connections=5, max_keepalive_connections=2)
-            ) as client:
-                resp = await client.post(url, json=data, headers=headers)
-                resp.raise_for_status()
-
-                LOGGER.info(f"GitHub workflow triggered successfully on attempt {attempt + 1}")
-                return resp.status_code
-
-        except httpx.TimeoutException as e:
-            LOGGER.error(f"GitHub API timeout on attempt {attempt + 1}: {e}")
-            if attempt == max_attempts - 1:
-                raise e
-
-        except httpx.HTTPStatusError as e:
-            LOGGER.error(f"GitHub API error {e.response.status_code} on attempt {attempt + 1}: {e.response.text}")
-            if e.response.status_code in [429, 502, 503, 504]:  # Retry on these status codes
-                if attempt < max_attempts - 1:
-                    wait_time = min(2 ** attempt, 30)
-                    LOGGER.info(f"Retrying GitHub API call in {wait_time} seconds...")
-                    await asyncio.sleep(wait_time)
-                    continue
-            raise e
-
-        except httpx.RequestError as e:
-            LOGGER.error(f"GitHub API request error on attempt {attempt + 1}: {e}")
-            if attempt < max_attempts - 1:
-                wait_time = min(2 ** attempt, 30)
-                LOGGER.info(f"Retrying GitHub API call in {wait_time} seconds...")
-                await asyncio.sleep(wait_time)
-                continue
-            raise e
-
-        except Exception as e:
-            LOGGER.error(f"Unexpected error triggering GitHub workflow on attempt {attempt + 1}: {e}", exc_info=True)
-            if attempt < max_attempts - 1:
-                wait_time = min(2 ** attempt, 30)
-                LOGGER.info(f"Retrying GitHub API call in {wait_time} seconds...")
-                await asyncio.sleep(wait_time)
-                continue
-            raise e
-
-        # Wait before retry (except on last attempt)
-        if attempt < max_attempts - 1:
-            wait_time = min(2 ** attempt, 30)
-            LOGGER.info(f"Retrying GitHub API call in {wait_time} seconds...")
-            await asyncio.sleep(wait_time)
-
-    raise Exception("Failed to trigger GitHub workflow after all attempts")
+def _github_headers(token: str = None) -> dict:
+    return {
+        "Authorization": f"token {token or GITHUB_TOKEN}",
+        "Accept": "application/vnd.github.v3+json",
+        "User-Agent": "FrameworkPatcherBot/1.0"
+    }
 
+
+async def send_workflow_dispatch(repo: str, workflow_id: str, data: dict, timeout: float = 60.0, token: str = None,
+                                 api_url: str = None) -> httpx.Response:
+    """Send one workflow dispatch request. Retries and rate limits are the dispatch queue's job."""
+    url = f"{api_url or GITHUB_API_URL}/repos/{repo}/actions/workflows/{workflow_id}/dispatches"
+    LOGGER.info(f"Dispatching GitHub workflow {workflow_id} on {repo} for {data['inputs'].get('device_name')} "
+                f"{data['inputs'].get('version_name')} (user {data['inputs'].get('user_id')})")
+    client = get_http_client("github")
+    return await client.post(
+        url,
+        json=data,
+        headers=_github_headers(token),
+        timeout=httpx.Timeout(connect=20.0, read=timeout, write=timeout, pool=10.0)
+    )
+
+
+async def find_dispatched_run(repo: str, workflow_id: str, dispatch_id: str, since: float, token: str = None,
+                              api_url: str = None):
+    """Find the run started by a dispatch, by the "[dispatch_id]" suffix of its run name.
+
+    Returns the run, or None if no run created after `since` (a UNIX time) carries the ID.
+    """
+    created = datetime.datetime.fromtimestamp(since, datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    client = get_http_client("github")
+    response = await client.get(
+        f"{api_url or GITHUB_API_URL}/repos/{repo}/actions/workflows/{workflow_id}/runs",
+        params={"event": "workflow_dispatch", "created": f">={created}", "per_page": 50},
+        headers=_github_headers(token)
+    )
+    response.raise_for_status()
+    for run in response.json().get("workflow_runs", []):
+        if f"[{dispatch_id}]" in (run.get("display_title") or run.get("name") or ""):
+            return run
+    return None
+
+
+async def list_workflow_runs(repo: str, since: float, etag: str = None, token: str = None,
+                             api_url: str = None) -> httpx.Response:
+    """List the repo's workflow_dispatch runs created after `since` (a UNIX time), newest first.
+
+    With the ETag of an earlier identical call GitHub answers 304 when nothing changed,
+    which does not count against the rate limit.
+    """
+    created = datetime.datetime.fromtimestamp(since, datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    headers = _github_headers(token)
+    if etag:
+        headers["If-None-Match"] = etag
+    client = get_http_client("github")
+    return await client.get(
+        f"{api_url or GITHUB_API_URL}/repos/{repo}/actions/runs",
+        params={"event": "workflow_dispatch", "created": f">={created}", "per_page": 100},
+        headers=headers
+    )
+
+
+async def get_workflow_run(repo: str, run_id: int, etag: str = None, token: str = None,
+                           api_url: str = None) -> httpx.Response:
+    """Get one workflow run, conditionally like list_workflow_runs."""
+    headers = _github_headers(token)
+    if etag:
+        headers["If-None-Match"] = etag
+    client = get_http_client("github")
+    return await client.get(f"{api_url or GITHUB_API_URL}/repos/{repo}/actions/runs/{run_id}", headers=headers)
+
+
+async def list_releases(repo: str, etag: str = None, token: str = None, api_url: str = None) -> httpx.Response:
+    """List the repo's most recent releases, conditionally like list_workflow_runs."""
+    headers = _github_headers(token)
+    if etag:
+        headers["If-None-Match"] = etag
+    client = get_http_client("github")
+    return await client.get(f"{api_url or GITHUB_API_URL}/repos/{repo}/releases", params={"per_page": 30},
+                            headers=headers)
@@ -1,14 +1,11 @@
-import asyncio
-
-import httpx
 from pyrogram import Client, filters
 from pyrogram.types import Message
 
-import config
 from Framework import bot
 from Framework.helpers.decorators import owner
 from Framework.helpers.logger import LOGGER
 from Framework.helpers.state import *
+from Framework.helpers.upload_sessions import get_upload_session
 from Framework.plugins.user.patch import get_required_jars
 
 
@@ -72,304 +69,124 @@ async def handle_media_upload(bot: Client, message: Message):
             )
         return
 
-    if file_name in user_states[user_id]["files"]:
+    session = get_upload_session(user_id, queue_patch_build)
+    if session.has(file_name):
         await message.reply_text(f"You have already sent '{file_name}'. Please send the remaining files.", quote=True)
         return
 
-    processing_message = await message.reply_text(
-        text=f"`Processing {file_name}...`",
-        quote=True,
-        disable_web_page_preview=True
-    )
-
-    logs = []
-    file_path = None
-
-    try:
-        await processing_message.edit_text(
-            text=f"`Downloading {file_name}...`",
-            disable_web_page_preview=True
-        )
-
-        # Enhanced download with retry logic
-        max_download_attempts = 3
-        download_successful = False
-
-        for download_attempt in range(max_download_attempts):
-            try:
-                LOGGER.info(f"Download attempt {download_attempt + 1}/{max_download_attempts} for {file_name}")
-                file_path = await message.download()
-                download_successful = True
-                logs.append(f"Downloaded {file_name} Successfully")
-                break
-            except Exception as e:
-                LOGGER.error(f"Download attempt {download_attempt + 1} failed for {file_name}: {e}")
-                if download_attempt < max_download_attempts - 1:
-                    wait_time = 2 ** download_attempt
-                    logs.append(f"Download failed, retrying in {wait_time} seconds...")
-                    await asyncio.sleep(wait_time)
-                else:
-                    raise e
+    # The upload runs in the background; the session's message shows its progress
+    await session.add(bot, message, file_name)
 
-        if not download_successful:
-            raise Exception("Failed to download file after all attempts")
 
-        dir_name, old_file_name = os.path.split(file_path)
-        file_base, file_extension = os.path.splitext(old_file_name)  # Add this line
-        renamed_file_name = f"{file_base}_{user_id}_{os.urandom(4).hex()}{file_extension}"
-        renamed_file_path = os.path.join(dir_name, renamed_file_name)
-        os.rename(file_path, renamed_file_path)
-        file_path = renamed_file_path
-        logs.append(f"Renamed file to {os.path.basename(file_path)}")
-
-        # Initialize user state if not exists
-        if user_id not in user_states:
-            user_states[user_id] = {
-                "state": STATE_WAITING_FOR_FILES,
-                "files": {},
-                "device_name": None,
-                "version_name": None,
-                "api_level": None,
-                "features": {
-                    "enable_signature_bypass": True,
-                    "enable_cn_notification_fix": False,
-                    "enable_disable_secure_flag": False,
-                    "enable_kaorios_toolbox": False
-                },
-                "required_jars": {"framework.jar", "services.jar", "miui-services.jar"}
-            }
-        
-        # Use dynamic required JARs
-        required_jars = user_states[user_id].get("required_jars", {"framework.jar", "services.jar", "miui-services.jar"})
-        total_required = len(required_jars)
-        
-        received_count = len(user_states[user_id]["files"]) + 1  # +1 since current file will be counted
-        missing_files = [f for f in required_jars if f not in user_states[user_id]["files"] and f != file_name]
-
-        await message.reply_text(
-            f"Received {file_name}. You have {received_count}/{total_required} files. "
-            f"Remaining: {', '.join(sorted(missing_files)) if missing_files else 'None'}.",
-            quote=True
-        )
-
-        await processing_message.edit_text(
-            text=f"`Uploading {file_name} to PixelDrain...`",
-            disable_web_page_preview=True
-        )
+async def queue_patch_build(message: Message, user_id: int):
+    """Every required JAR is on PixelDrain: queue the workflow dispatch; a dispatch worker sends it.
+    Called once per upload session, by whichever upload lands last."""
+    from Framework.helpers.workflows import build_workflow_dispatch
+    from Framework.helpers.dispatch_queue import enqueue_dispatch, find_active_build
+    from Framework.helpers.build_cache import (build_cache_key, get_cached_build, add_build_waiter,
+                                               format_build_links)
+    from Framework.helpers.session_store import count_triggers_today, record_trigger
 
-        response_data, upload_logs = await upload_file_stream(file_path, config.PIXELDRAIN_API_KEY)
-        logs.extend(upload_logs)
-
-        if "error" in response_data:
-            await processing_message.edit_text(
-                text=f"Error uploading {file_name} to PixelDrain: `{response_data['error']}`\n\nLogs:\n" + '\n'.join(
-                    logs),
+    try:
+        # Get all required info from state
+        total_required = len(user_states[user_id]["files"])
+        device_name = user_states[user_id]["device_name"]
+        device_codename = user_states[user_id]["device_codename"]
+        version_name = user_states[user_id]["version_name"]
+        api_level = user_states[user_id]["api_level"]
+        android_version = user_states[user_id]["android_version"]
+        features = user_states[user_id].get("features", {
+            "enable_signature_bypass": True,
+            "enable_cn_notification_fix": False,
+            "enable_disable_secure_flag": False
+        })
+
+        # Someone already built, or is building, exactly this: no new run, no daily trigger used
+        build_key = build_cache_key(api_level, device_codename, version_name, features,
+                                    user_states[user_id].get("file_hashes", {}))
+        cached_build = get_cached_build(build_key)
+        if cached_build:
+            await message.reply_text(
+                f"♻️ **This exact build already exists.**\n\n"
+                f"📱 **Device:** {device_name}\n"
+                f"📦 **Version:** {version_name}\n\n"
+                f"{format_build_links(cached_build['release_url'], cached_build['module_url'])}\n\n"
+                f"This did not count against your daily limit.",
+                quote=True,
                 disable_web_page_preview=True
             )
-            user_states.pop(user_id, None)
             return
-
-        pixeldrain_link = f"https://pixeldrain.com/u/{response_data['id']}"
-        user_states[user_id]["files"][file_name] = pixeldrain_link
-
-        received_count = len(user_states[user_id]["files"])
-        missing_files = [f for f in required_jars if f not in user_states[user_id]["files"]]
-
-        if received_count == total_required:
-            # All files received, now trigger the workflow
-            from Framework.helpers.workflows import trigger_github_workflow_async
-            from datetime import datetime
-            from Framework.helpers.state import user_rate_limits
-
+        if find_active_build(build_key):
+            add_build_waiter(build_key, message.chat.id)
             await message.reply_text(
-                f"✅ All {total_required} required file(s) received and uploaded!\n\n"
-                "⏳ Triggering GitHub workflow...",
+                "⏳ **The same build is already running** for another request.\n\n"
+                "You will get the download link as soon as it finishes. "
+                "This did not count against your daily limit.",
                 quote=True
             )
+            return
 
-            try:
-                # Check daily rate limit
-                today = datetime.now().date()
-                triggers = user_rate_limits.get(user_id, [])
-                triggers = [t for t in triggers if t.date() == today]
-
-                if len(triggers) >= 3:
-                    await message.reply_text(
-                        "❌ You have reached the daily limit of 3 workflow triggers. Try again tomorrow.",
-                        quote=True
-                    )
-                    user_states.pop(user_id, None)
-                    return
-
-                # Get all required info from state
-                device_name = user_states[user_id]["device_name"]
-                device_codename = user_states[user_id]["device_codename"]
-                version_name = user_states[user_id]["version_name"]
-                api_level = user_states[user_id]["api_level"]
-                android_version = user_states[user_id]["android_version"]
-                features = user_states[user_id].get("features", {
-                    "enable_signature_bypass": True,
-                    "enable_cn_notification_fix": False,
-                    "enable_disable_secure_flag": False
-                })
-
-                links = user_states[user_id]["files"]
-                # Trigger workflow
-                status = await trigger_github_workflow_async(links, device_name, device_codename, version_name,
-                                                             api_level, user_id,
-                                                             features)
-                triggers.append(datetime.now())
-                user_rate_limits[user_id] = triggers
-
-                # Build features summary for confirmation
-                selected_features = []
-                if features.get("enable_signature_bypass"):
-                    selected_features.append("✓ Signature Verification Bypass")
-                if features.get("enable_cn_notification_fix"):
-                    selected_features.append("✓ CN Notification Fix")
-                if features.get("enable_disable_secure_flag"):
-                    selected_features.append("✓ Disable Secure Flag")
-                if features.get("enable_kaorios_toolbox"):
-                    selected_features.append("✓ Kaorios Toolbox (Play Integrity Fix)")
-
-                features_summary = "\n".join(selected_features) if selected_features else "Default features"
-
-                await message.reply_text(
-                    f"✅ **Workflow triggered successfully!**\n\n"
-                    f"📱 **Device:** {device_name}\n"
-                    f"📦 **Version:** {version_name}\n"
-                    f"🤖 **Android:** {android_version} (API {api_level})\n\n"
-                    f"**Features Applied:**\n{features_summary}\n\n"
-                    f"⏳ You will receive a notification when the process is complete.\n\n"
-                    f"Daily triggers used: {len(triggers)}/3",
-                    quote=True
-                )
-
-            except Exception as e:
-                LOGGER.error(f"Error triggering workflow for user {user_id}: {e}", exc_info=True)
-                await message.reply_text(
-                    f"❌ **An unexpected error occurred while triggering workflow:**\n\n`{e}`",
-                    quote=True
-                )
+        # Check daily rate limit
+        triggers_used = count_triggers_today(user_id)
 
-            finally:
-                user_states.pop(user_id, None)
-        else:
+        if triggers_used >= 3:
             await message.reply_text(
-                f"Received {file_name}. You have {received_count}/{total_required} files. "
-                f"Please send the remaining: {', '.join(sorted(missing_files))}.",
+                "❌ You have reached the daily limit of 3 workflow triggers. Try again tomorrow.",
                 quote=True
             )
+            user_states.pop(user_id, None)
+            return
 
-    except Exception as error:
-        LOGGER.error(f"Error in handle_media_upload for user {user_id} and file {file_name}: {error}", exc_info=True)
-        await processing_message.edit_text(
-            text=f"An error occurred during processing {file_name}: `{error}`\n\nLogs:\n" + '\n'.join(logs),
-            disable_web_page_preview=True
-        )
-        user_states.pop(user_id, None)
-    finally:
-        if file_path and os.path.exists(file_path):
-            os.remove(file_path)
-
-async def upload_file_stream(file_path: str, pixeldrain_api_key: str) -> tuple:
-    """Upload file to PixelDrain with improved timeout and retry handling."""
-    logs = []
-    response_data = None
-    max_attempts = 5
-    base_timeout = 120  # Increased base timeout
-
-    for attempt in range(max_attempts):
-        try:
-            # Progressive timeout increase
-            timeout = base_timeout + (attempt * 30)
-            LOGGER.info(f"Upload attempt {attempt + 1}/{max_attempts} with timeout {timeout}s")
-
-            # Enhanced HTTP client configuration
-            limits = httpx.Limits(
-                max_keepalive_connections=5,
-                max_connections=10,
-                keepalive_expiry=30.0
+        links = user_states[user_id]["files"]
+        workflow_id, dispatch_data = build_workflow_dispatch(links, device_name, device_codename,
+                                                             version_name, api_level, user_id, features)
+
+        # Build features summary for confirmation
+        selected_features = []
+        if features.get("enable_signature_bypass"):
+            selected_features.append("✓ Signature Verification Bypass")
+        if features.get("enable_cn_notification_fix"):
+            selected_features.append("✓ CN Notification Fix")
+        if features.get("enable_disable_secure_flag"):
+            selected_features.append("✓ Disable Secure Flag")
+        if features.get("enable_kaorios_toolbox"):
+            selected_features.append("✓ Kaorios Toolbox (Play Integrity Fix)")
+
+        features_summary = "\n".join(selected_features) if selected_features else "Default features"
+
+        job_id, created, position = enqueue_dispatch(
+            request_key=f"{message.chat.id}:{message.id}",
+            workflow_id=workflow_id,
+            data=dispatch_data,
+            build_key=build_key,
+            chat_id=message.chat.id,
+            notify_text=(
+                f"✅ **Workflow triggered successfully!**\n\n"
+                f"📱 **Device:** {device_name}\n"
+                f"📦 **Version:** {version_name}\n"
+                f"🤖 **Android:** {android_version} (API {api_level})\n\n"
+                f"**Features Applied:**\n{features_summary}\n\n"
+                f"⏳ You will receive a notification when the process is complete."
             )
+        )
+        if created:
+            record_trigger(user_id)
+            triggers_used += 1
 
-            async with httpx.AsyncClient(
-                    timeout=httpx.Timeout(
-                        connect=30.0,
-                        read=timeout,
-                        write=timeout,
-                        pool=10.0
-                    ),
-                    limits=limits,
-                    follow_redirects=True
-            ) as client:
-                with open(file_path, "rb") as file:
-                    file_size = os.path.getsize(file_path)
-                    files = {"file": (os.path.basename(file_path), file, "application/octet-stream")}
-
-                    logs.append(f"Uploading {os.path.basename(file_path)} ({file_size} bytes) to PixelDrain...")
-                    
-                    response = await client.post(
-                        "https://pixeldrain.com/api/file",
-                        files=files,
-                        auth=("", pixeldrain_api_key),
-                        headers={
-                            "User-Agent": "FrameworkPatcherBot/1.0",
-                            "Accept": "application/json"
-                        }
-                    )
-                    response.raise_for_status()
-
-            logs.append("Uploaded Successfully to PixelDrain")
-            response_data = response.json()
-            LOGGER.info(f"Upload successful on attempt {attempt + 1}")
-            break
-
-        except httpx.TimeoutException as e:
-            error_msg = f"Upload timeout on attempt {attempt + 1}: {e}"
-            LOGGER.error(error_msg)
-            logs.append(error_msg)
-            if attempt == max_attempts - 1:
-                response_data = {"error": f"Upload failed after {max_attempts} attempts due to timeout"}
-            
-        except httpx.RequestError as e:
-            error_msg = f"HTTPX Request error during PixelDrain upload (attempt {attempt + 1}): {type(e).__name__}: {e}"
-            LOGGER.error(error_msg)
-            logs.append(error_msg)
-            if attempt == max_attempts - 1:
-                response_data = {"error": f"Upload failed after {max_attempts} attempts: {str(e)}"}
-
-        except httpx.HTTPStatusError as e:
-            error_msg = f"HTTP error {e.response.status_code} on attempt {attempt + 1}: {e.response.text}"
-            LOGGER.error(error_msg)
-            logs.append(error_msg)
-            if e.response.status_code in [429, 502, 503, 504]:  # Retry on these status codes
-                if attempt < max_attempts - 1:
-                    wait_time = min(2 ** attempt, 30)  # Exponential backoff, max 30s
-                    logs.append(f"Retrying in {wait_time} seconds...")
-                    await asyncio.sleep(wait_time)
-                    continue
-            response_data = {"error": f"HTTP {e.response.status_code}: {e.response.text}"}
-            break
-
-        except Exception as e:
-            error_msg = f"Unexpected error during PixelDrain upload (attempt {attempt + 1}): {type(e).__name__}: {e}"
-            LOGGER.error(error_msg, exc_info=True)
-            logs.append(error_msg)
-            if attempt == max_attempts - 1:
-                response_data = {"error": f"Upload failed after {max_attempts} attempts: {str(e)}"}
+        await message.reply_text(
+            f"✅ All {total_required} required file(s) received and uploaded!\n\n"
+            f"📥 Your build request is queued (position {position}). "
+            f"You will get a message as soon as the GitHub workflow is triggered.\n\n"
+            f"Daily triggers used: {triggers_used}/3",
+            quote=True
+        )
 
-        # Wait before retry (except on last attempt)
-        if attempt < max_attempts - 1:
-            wait_time = min(2 ** attempt, 30)  # Exponential backoff, max 30s
-            logs.append(f"Retrying in {wait_time} seconds...")
-            await asyncio.sleep(wait_time)
+    except Exception as e:
+        LOGGER.error(f"Error queueing workflow for user {user_id}: {e}", exc_info=True)
+        await message.reply_text(
+            f"❌ **An unexpected error occurred while queueing the workflow:**\n\n`{e}`",
+            quote=True
+        )
 
-    # Clean up file
-    if os.path.exists(file_path):
-        try:
-            os.remove(file_path)
-            logs.append("Temporary file cleaned up")
-        except Exception as e:
-            LOGGER.error(f"Failed to remove temporary file {file_path}: {e}")
-    
-    return response_data, logs
\ No newline at end of file
+    finally:
+        user_states.pop(user_id, None)
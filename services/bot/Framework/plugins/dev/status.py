@@ -3,7 +3,15 @@ from pyrogram.types import Message
 
 from Framework import bot
 from Framework.helpers.state import *
+from Framework.helpers.build_cache import format_cache_stats
 from Framework.helpers.decorators import owner
+from Framework.helpers.dispatch_queue import get_queue_stats
+from Framework.helpers.dispatch_targets import format_target_stats
+from Framework.helpers.http_pool import format_http_stats
+from Framework.helpers.jar_index import format_index_stats
+from Framework.helpers.run_tracker import format_tracker_stats
+from Framework.helpers.session_store import format_store_stats
+from Framework.helpers.upload_sessions import format_session_stats
 from Framework.helpers.utils import *
 from Framework.helpers.processes import *
 from Framework.helpers.logger import LOGGER
@@ -36,6 +44,26 @@ async def bot_status(client: Client, message: Message):
 ⏰ <b>Uptime:</b> {time.time() - last_connection_check:.0f} seconds since last check
 """
 
+        queue_stats = get_queue_stats()
+        status_text += (
+            f"\n📥 <b>Dispatch Queue:</b> {queue_stats.get('queued', 0)} queued, "
+            f"{queue_stats.get('sending', 0)} sending, {queue_stats.get('dispatched', 0)} dispatched, "
+            f"{queue_stats.get('failed', 0)} failed\n"
+        )
+        for line in format_target_stats():
+            status_text += f"• {line}\n"
+        status_text += f"🏃 <b>Workflow Runs:</b> {format_tracker_stats()}\n"
+        status_text += f"♻️ <b>Build Cache:</b> {format_cache_stats()}\n"
+        status_text += f"📦 <b>JAR Index:</b> {format_index_stats()}\n"
+        status_text += f"⬆️ <b>Uploads:</b> {format_session_stats()}\n"
+        status_text += f"💬 <b>Sessions:</b> {format_store_stats()}\n"
+
+        http_lines = format_http_stats()
+        if http_lines:
+            status_text += "\n🌐 <b>HTTP Pools:</b>\n"
+            for line in http_lines:
+                status_text += f"• {line}\n"
+
         if processes:
             status_text += "\n📋 <b>Bot Processes:</b>\n"
             for proc in processes:
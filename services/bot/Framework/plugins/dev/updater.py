@@ -10,6 +10,10 @@ from pyrogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton
 
 from Framework import bot
 from Framework.helpers.decorators import owner
+from Framework.helpers.dispatch_queue import stop_dispatch_workers
+from Framework.helpers.run_tracker import stop_run_tracker
+from Framework.helpers.session_store import stop_session_store
+from Framework.helpers.http_pool import close_http_clients
 from Framework.helpers.logger import LOGGER
 
 PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "../../.."))
@@ -32,8 +36,12 @@ async def graceful_restart():
     """Gracefully stop the bot and restart the process"""
     try:
         LOGGER.info("Stopping client...")
+        await stop_dispatch_workers()
+        await stop_run_tracker()
         await bot.stop()
         LOGGER.info("Client stopped.")
+        await stop_session_store()
+        await close_http_clients()
     except Exception as e:
         LOGGER.error(f"Error during graceful stop: {e}")
     finally:
@@ -80,16 +80,16 @@ async def handle_text_input(bot: Client, message: Message):
             user_states[user_id]["state"] = STATE_WAITING_FOR_DEVICE_CODENAME
             return
 
+        # Version list is precomputed by the provider, newest release first
+        rom_versions = get_device_versions(codename)
+
         # Store device info
         user_states[user_id]["device_codename"] = codename
         user_states[user_id]["device_name"] = device_info["name"]
-        user_states[user_id]["software_data"] = software_data
+        user_states[user_id]["rom_versions"] = rom_versions
         user_states[user_id]["state"] = STATE_WAITING_FOR_VERSION_SELECTION
 
-        # Build version list
-        miui_roms = software_data.get("miui_roms", [])
-
-        if not miui_roms:
+        if not rom_versions:
             await message.reply_text(
                 f"❌ No MIUI ROM versions found for **{device_info['name']}**\n\n"
                 "Please try another device.",
@@ -100,21 +100,18 @@ async def handle_text_input(bot: Client, message: Message):
 
         # Create inline keyboard with version options (limit to first 10)
         buttons = []
-        for idx, rom in enumerate(miui_roms[:10]):
-            version = rom.get('version') or rom.get('miui', 'Unknown')
-            android = rom.get('android', '?')
-            button_text = f"{version} (Android {android})"
-            buttons.append([InlineKeyboardButton(button_text, callback_data=f"ver_{idx}")])
+        for idx, rom_version in enumerate(rom_versions[:10]):
+            buttons.append([InlineKeyboardButton(rom_version.label, callback_data=f"ver_{idx}")])
 
         # Add "Show More" button if there are more than 10 versions
-        if len(miui_roms) > 10:
-            buttons.append([InlineKeyboardButton(f"📋 Show All ({len(miui_roms)} versions)", callback_data="ver_showall")])
+        if len(rom_versions) > 10:
+            buttons.append([InlineKeyboardButton(f"📋 Show All ({len(rom_versions)} versions)", callback_data="ver_showall")])
 
         buttons.append([InlineKeyboardButton("❓ Can't find your version?", callback_data="ver_manual")])
         buttons.append([InlineKeyboardButton("🔄 Reselect Codename", callback_data="reselect_codename")])
         await message.reply_text(
             f"✅ Device found: **{device_info['name']}** (`{codename}`)\n\n"
-            f"📦 Found {len(miui_roms)} MIUI ROM version(s)\n\n"
+            f"📦 Found {len(rom_versions)} MIUI ROM version(s)\n\n"
             f"Please select a version:",
             reply_markup=InlineKeyboardMarkup(buttons),
             quote=True
@@ -213,29 +210,25 @@ async def handle_text_input(bot: Client, message: Message):
     elif current_state == STATE_WAITING_FOR_VERSION_SELECTION:
         # Handle text input for version selection (when user types a number)
         user_input = message.text.strip()
-        software_data = user_states[user_id].get("software_data")
+        rom_versions = user_states[user_id].get("rom_versions")
 
-        if not software_data:
+        if not rom_versions:
             await message.reply_text("❌ Session expired. Please use /start_patch to begin again.", quote=True)
             user_states.pop(user_id, None)
             return
 
-        miui_roms = software_data.get("miui_roms", [])
-
         # Try to parse as version number
         try:
             version_idx = int(user_input) - 1  # User enters 1-based, we need 0-based
 
-            if version_idx < 0 or version_idx >= len(miui_roms):
+            if version_idx < 0 or version_idx >= len(rom_versions):
                 await message.reply_text(
-                    f"❌ Invalid version number. Please enter a number between 1 and {len(miui_roms)}.",
+                    f"❌ Invalid version number. Please enter a number between 1 and {len(rom_versions)}.",
                     quote=True
                 )
                 return
 
-            selected_rom = miui_roms[version_idx]
-            version_name = selected_rom.get('version') or selected_rom.get('miui', 'Unknown')
-            android_version = selected_rom.get('android')
+            version_name, android_version, _ = rom_versions[version_idx]
 
             # Validate Android version
             if not android_version:
@@ -284,21 +277,19 @@ async def handle_text_input(bot: Client, message: Message):
             )
 
         except ValueError:
-            # Not a number, try to match by version name
-            user_input_lower = user_input.lower()
-            matched_idx = None
+            # Not a number, try to match by version name: exact hit from the index, else first partial match
+            selected = find_device_version(user_states[user_id]["device_codename"], user_input)
 
-            for idx, rom in enumerate(miui_roms):
-                version = rom.get('version') or rom.get('miui', '')
-                if user_input_lower in version.lower():
-                    matched_idx = idx
-                    break
+            if selected is None:
+                user_input_lower = user_input.lower()
+                for rom_version in rom_versions:
+                    if user_input_lower in rom_version.version.lower():
+                        selected = rom_version
+                        break
 
-            if matched_idx is not None:
+            if selected is not None:
                 # Found a match, process it
-                selected_rom = miui_roms[matched_idx]
-                version_name = selected_rom.get('version') or selected_rom.get('miui', 'Unknown')
-                android_version = selected_rom.get('android')
+                version_name, android_version, _ = selected
 
                 if not android_version:
                     await message.reply_text("⚠️ Android version not found for this ROM!", quote=True)
@@ -341,7 +332,7 @@ async def handle_text_input(bot: Client, message: Message):
             else:
                 await message.reply_text(
                     f"❌ Version not found: `{user_input}`\n\n"
-                    f"Please enter a version number (1-{len(miui_roms)}) or click a button from the list above.",
+                    f"Please enter a version number (1-{len(rom_versions)}) or click a button from the list above.",
                     quote=True
                 )
 
@@ -433,24 +424,17 @@ async def version_selection_handler(bot: Client, query: CallbackQuery):
 
     # Handle "Show All" button
     if data == "showall":
-        software_data = user_states[user_id]["software_data"]
-        miui_roms = software_data.get("miui_roms", [])
+        rom_versions = user_states[user_id].get("rom_versions") or []
         device_name = user_states[user_id]["device_name"]
 
-        # Create text list of all versions
-        version_list = []
-        for idx, rom in enumerate(miui_roms):
-            version = rom.get('version') or rom.get('miui', 'Unknown')
-            android = rom.get('android', '?')
-            version_list.append(f"{idx + 1}. {version} (Android {android})")
-
-        versions_text = "\n".join(version_list[:30])  # Limit to 30 to avoid message length issues
-        if len(miui_roms) > 30:
-            versions_text += f"\n\n... and {len(miui_roms) - 30} more versions"
+        # Labels are precomputed; limit to 30 to avoid message length issues
+        versions_text = "\n".join(f"{idx + 1}. {rom_version.label}" for idx, rom_version in enumerate(rom_versions[:30]))
+        if len(rom_versions) > 30:
+            versions_text += f"\n\n... and {len(rom_versions) - 30} more versions"
 
         await query.message.edit_text(
             f"📋 **All Available Versions for {device_name}:**\n\n{versions_text}\n\n"
-            f"Please type the version number (1-{len(miui_roms)}) or version name to select.",
+            f"Please type the version number (1-{len(rom_versions)}) or version name to select.",
         )
         await query.answer("Showing all versions")
         return
@@ -460,25 +444,21 @@ async def version_selection_handler(bot: Client, query: CallbackQuery):
         version_idx = int(data)
         LOGGER.info(f"Processing version selection: index={version_idx}")
 
-        software_data = user_states[user_id].get("software_data")
-        if not software_data:
-            LOGGER.error(f"No software_data found for user {user_id}")
+        rom_versions = user_states[user_id].get("rom_versions")
+        if not rom_versions:
+            LOGGER.error(f"No ROM versions found for user {user_id}")
             await query.answer("Session data lost. Please use /start_patch to begin again.", show_alert=True)
             return
 
-        miui_roms = software_data.get("miui_roms", [])
-        LOGGER.info(f"Available ROMs count: {len(miui_roms)}")
+        LOGGER.info(f"Available ROMs count: {len(rom_versions)}")
 
-        if version_idx < 0 or version_idx >= len(miui_roms):
-            LOGGER.warning(f"Invalid version index: {version_idx} (available: 0-{len(miui_roms) - 1})")
-            await query.answer(f"Invalid version selection! Index: {version_idx}, Available: {len(miui_roms)}",
+        if version_idx < 0 or version_idx >= len(rom_versions):
+            LOGGER.warning(f"Invalid version index: {version_idx} (available: 0-{len(rom_versions) - 1})")
+            await query.answer(f"Invalid version selection! Index: {version_idx}, Available: {len(rom_versions)}",
                                show_alert=True)
             return
 
-        selected_rom = miui_roms[version_idx]
-        LOGGER.info(f"Selected ROM: {selected_rom}")
-        version_name = selected_rom.get('version') or selected_rom.get('miui', 'Unknown')
-        android_version = selected_rom.get('android')
+        version_name, android_version, _ = rom_versions[version_idx]
         LOGGER.info(f"Version: {version_name}, Android: {android_version}")
 
         # Validate Android version
@@ -2,6 +2,7 @@ from pyrogram import filters, Client
 from pyrogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
 
 from Framework import bot
+from Framework.helpers.session_store import Session
 from Framework.helpers.state import *
 
 # Feature to JAR requirements mapping
@@ -39,23 +40,7 @@ async def start_patch_command(bot: Client, message: Message):
     """Initiates the framework patching conversation."""
     user_id = message.from_user.id
     # Initialize state and prompt for device codename
-    user_states[user_id] = {
-        "state": STATE_WAITING_FOR_DEVICE_CODENAME,
-        "files": {},
-        "device_name": None,
-        "device_codename": None,
-        "version_name": None,
-        "android_version": None,
-        "api_level": None,
-        "codename_retry_count": 0,
-        "software_data": None,
-        "features": {
-            "enable_signature_bypass": False,
-            "enable_cn_notification_fix": False,
-            "enable_disable_secure_flag": False,
-            "enable_kaorios_toolbox": False
-        }
-    }
+    user_states[user_id] = Session(STATE_WAITING_FOR_DEVICE_CODENAME)
     await message.reply_text(
         "🚀 Let's start the framework patching process!\n\n"
         "📱 Please enter your device codename (e.g., rothko, xaga, marble)\n\n"
@@ -76,7 +61,7 @@ async def reselect_codename_handler(bot: Client, query: CallbackQuery):
     user_states[user_id]["state"] = STATE_WAITING_FOR_DEVICE_CODENAME
     user_states[user_id]["device_codename"] = None
     user_states[user_id]["device_name"] = None
-    user_states[user_id]["software_data"] = None
+    user_states[user_id]["rom_versions"] = None
     user_states[user_id]["codename_retry_count"] = 0
     
     await query.message.edit_text(
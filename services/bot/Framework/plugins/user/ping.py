@@ -1,5 +1,4 @@
 from time import time
-from httpx import AsyncClient
 from datetime import datetime
 
 from pyrogram import filters
@@ -8,6 +7,7 @@ from pyrogram.types import Message
 from Framework import bot
 from Framework import BotStartTime
 from Framework.helpers.functions import get_readable_time
+from Framework.helpers.http_pool import get_http_client
 
 @bot.on_message(filters.command(["ping", "alive"]))
 async def ping(_, message: Message):
@@ -16,8 +16,7 @@ async def ping(_, message: Message):
     pong_reply = await message.reply_text("pong!", quote=True)
 
     start = datetime.now()
-    async with AsyncClient() as client:
-        await client.get("http://api.telegram.org")
+    await get_http_client().get("http://api.telegram.org")
     end = datetime.now()
 
     botuptime = get_readable_time(time() - BotStartTime)
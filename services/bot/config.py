@@ -19,3 +19,28 @@ WORKFLOW_ID_A14 = os.getenv("GITHUB_WORKFLOW_ID_A14")
 WORKFLOW_ID_A15 = os.getenv("GITHUB_WORKFLOW_ID_A15")
 WORKFLOW_ID_A16 = os.getenv("GITHUB_WORKFLOW_ID_A16")
 OWNER_ID = os.getenv("OWNER_ID", "")
+PROVIDER_REFRESH_INTERVAL = float(os.getenv("PROVIDER_REFRESH_INTERVAL", "3600"))
+PROVIDER_REFRESH_JITTER = float(os.getenv("PROVIDER_REFRESH_JITTER", "300"))
+PROVIDER_RETRY_DELAY = float(os.getenv("PROVIDER_RETRY_DELAY", "60"))
+PROVIDER_SNAPSHOT_PATH = os.getenv("PROVIDER_SNAPSHOT_PATH", str(ROOT_DIR / "services" / ".cache" / "provider_snapshot.pickle"))
+DISPATCH_DB_PATH = os.getenv("DISPATCH_DB_PATH", str(ROOT_DIR / "services" / ".cache" / "dispatch.sqlite3"))
+DISPATCH_WORKERS = int(os.getenv("DISPATCH_WORKERS", "3"))
+DISPATCH_PER_REPO_LIMIT = int(os.getenv("DISPATCH_PER_REPO_LIMIT", "1"))
+DISPATCH_MAX_ATTEMPTS = int(os.getenv("DISPATCH_MAX_ATTEMPTS", "5"))
+GITHUB_API_URL = os.getenv("GITHUB_API_URL", "https://api.github.com")
+# JSON list of extra dispatch targets: [{"owner": ..., "repo": ..., "token": ..., "workflows": {"35": ...}}]
+GITHUB_DISPATCH_TARGETS = os.getenv("GITHUB_DISPATCH_TARGETS", "")
+DISPATCH_TARGET_RATE = float(os.getenv("DISPATCH_TARGET_RATE", "1.0"))
+DISPATCH_TARGET_BURST = float(os.getenv("DISPATCH_TARGET_BURST", "5"))
+DISPATCH_TARGET_COOLDOWN = float(os.getenv("DISPATCH_TARGET_COOLDOWN", "600"))
+RUN_POLL_INTERVAL = float(os.getenv("RUN_POLL_INTERVAL", "15"))
+RUN_MATCH_TIMEOUT = float(os.getenv("RUN_MATCH_TIMEOUT", "900"))
+RUN_TRACK_TIMEOUT = float(os.getenv("RUN_TRACK_TIMEOUT", "21600"))
+BUILD_CACHE_TTL = float(os.getenv("BUILD_CACHE_TTL", str(30 * 24 * 3600)))
+JAR_LIVE_CHECK_TTL = float(os.getenv("JAR_LIVE_CHECK_TTL", "600"))
+PIXELDRAIN_API_URL = os.getenv("PIXELDRAIN_API_URL", "https://pixeldrain.com/api")
+UPLOAD_PROGRESS_INTERVAL = float(os.getenv("UPLOAD_PROGRESS_INTERVAL", "5"))
+UPLOAD_CONCURRENCY = int(os.getenv("UPLOAD_CONCURRENCY", "4"))
+UPLOAD_BANDWIDTH = float(os.getenv("UPLOAD_BANDWIDTH", "0"))
+SESSION_TTL = float(os.getenv("SESSION_TTL", "21600"))
+SESSION_FLUSH_INTERVAL = float(os.getenv("SESSION_FLUSH_INTERVAL", "5"))
@@ -1,130 +1,173 @@
-import httpx
-import yaml
-import asyncio
-from fastapi import FastAPI, HTTPException
-from fastapi.middleware.cors import CORSMiddleware
+import gzip
+import json
+import logging
+import os
+import sys
 from contextlib import asynccontextmanager
-from typing import List, Dict, Any
-
-DEVICES_URL = "https://raw.githubusercontent.com/XiaomiFirmwareUpdater/xiaomi_devices/master/devices.json"
-FIRMWARE_CODENAMES_URL = "https://raw.githubusercontent.com/xiaomifirmwareupdater/xiaomifirmwareupdater.github.io/master/data/firmware_codenames.yml"
-MIUI_CODENAMES_URL = "https://raw.githubusercontent.com/xiaomifirmwareupdater/xiaomifirmwareupdater.github.io/master/data/miui_codenames.yml"
-VENDOR_CODENAMES_URL = "https://raw.githubusercontent.com/xiaomifirmwareupdater/xiaomifirmwareupdater.github.io/master/data/vendor_codenames.yml"
-FIRMWARE_URL = "https://raw.githubusercontent.com/xiaomifirmwareupdater/xiaomifirmwareupdater.github.io/master/data/devices/latest.yml"
-MIUI_ROMS_URL = "https://raw.githubusercontent.com/xiaomifirmwareupdater/miui-updates-tracker/master/data/latest.yml"
-
-app_cache = {
-    "device_list": [],
-    "codename_to_name": {},
-    "firmware_codenames": [],
-    "miui_codenames": [],
-    "vendor_codenames": [],
-    "firmware_data": {},
-    "miui_data": {}
-}
-
-
-async def load_devices_data(client: httpx.AsyncClient):
-    try:
-        response = await client.get(DEVICES_URL)
-        response.raise_for_status()
-        devices_data = response.json()
-
-        device_list = []
-        codename_map = {}
-
-        for codename, details in devices_data.items():
-            if "display_name_en" in details:
-                name = details["display_name_en"]
-                device_list.append({"name": name, "codename": codename})
-                codename_map[codename] = name
-            elif "display_name" in details:
-                name = details["display_name"]
-                device_list.append({"name": name, "codename": codename})
-                codename_map[codename] = name
-
-        app_cache["device_list"] = device_list
-        app_cache["codename_to_name"] = codename_map
-        print(f"Loaded {len(device_list)} devices.")
-
-    except Exception as e:
-        print(f"ERROR fetching devices: {e}")
-
-
-async def load_yaml_list_data(client: httpx.AsyncClient, url: str, cache_key: str, name: str):
-    try:
-        response = await client.get(url)
-        response.raise_for_status()
-        data = yaml.safe_load(response.text)
-        app_cache[cache_key] = data
-        print(f"Loaded {len(data)} {name}.")
-    except Exception as e:
-        print(f"ERROR fetching {name}: {e}")
-
-
-async def load_firmware_data(client: httpx.AsyncClient):
-    try:
-        response = await client.get(FIRMWARE_URL)
-        response.raise_for_status()
-        data = yaml.safe_load(response.text)
-
-        latest = {}
-        for item in data:
-            try:
-                codename = item['downloads']['github'].split('/')[4].split('_')[-1]
-                version = item['versions']['miui']
-                if latest.get(codename):
-                    latest[codename].append(version)
-                else:
-                    latest[codename] = [version]
-            except (KeyError, IndexError, TypeError):
-                continue
-
-        app_cache["firmware_data"] = latest
-        print(f"Loaded firmware data for {len(latest)} devices.")
-
-    except Exception as e:
-        print(f"ERROR fetching firmware: {e}")
-
-
-async def load_miui_roms_data(client: httpx.AsyncClient):
-    try:
-        response = await client.get(MIUI_ROMS_URL)
-        response.raise_for_status()
-        roms = yaml.safe_load(response.text)
-
-        latest = {}
-        for item in roms:
-            try:
-                codename = item['codename'].split('_')[0]
-                if latest.get(codename):
-                    latest[codename].append(item)
-                else:
-                    latest[codename] = [item]
-            except (KeyError, IndexError, TypeError):
-                continue
+from pathlib import Path
+from typing import List, Dict, Any, Callable, Optional, Tuple
+from urllib.parse import urlencode
+
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+from fastapi.middleware.cors import CORSMiddleware
+
+try:
+    import brotli
+except ImportError:  # br responses are skipped without the Brotli package
+    brotli = None
+
+# services/ holds the provider package shared with the Telegram bot
+SERVICES_DIR = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(SERVICES_DIR))
+
+import xiaomi_provider as provider  # noqa: E402
+
+logging.basicConfig(level=logging.INFO, format="[%(asctime)s - %(levelname)s] - %(name)s - %(message)s")
+
+# Browsers may reuse a response this long before revalidating it with If-None-Match
+CACHE_MAX_AGE = int(os.getenv("WEB_CACHE_MAX_AGE", "300"))
+# Bodies smaller than this are not worth compressing
+MIN_COMPRESS_SIZE = 1024
+# Filtered listings make the key space open-ended; past this many bodies per snapshot, serve uncached
+MAX_CACHED_BODIES = 2048
+# Largest page /devices serves when a limit is given
+MAX_PAGE_SIZE = 1000
+
+DEVICE_FIELDS = ("name", "codename", "has_firmware", "has_miui", "android_versions")
+DEFAULT_DEVICE_FIELDS = ["name", "codename"]
+SOFTWARE_FIELDS = ("name", "codename", "firmware_versions", "miui_roms")
+ROM_FIELDS = provider.MiuiRom._fields
+
+
+class CachedBody:
+    """One endpoint's JSON, serialized and compressed once per data snapshot."""
 
-        app_cache["miui_data"] = latest
-        print(f"Loaded MIUI ROMs data for {len(latest)} devices.")
+    __slots__ = ("identity", "gzip", "br", "headers")
 
-    except Exception as e:
-        print(f"ERROR fetching MIUI ROMs: {e}")
+    def __init__(self, data: Any, headers: Optional[Dict[str, str]] = None):
+        self.headers = headers or {}
+        self.identity = json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        self.gzip = self.br = None
+        if len(self.identity) >= MIN_COMPRESS_SIZE:
+            self.gzip = gzip.compress(self.identity, compresslevel=9)
+            if brotli:
+                self.br = brotli.compress(self.identity, quality=9)
+
+
+# Bodies of the live snapshot by cache key; dropped as soon as the snapshot changes
+_response_cache: Dict[str, Any] = {"version": None, "bodies": {}}
+
+
+def _accepted_encodings(accept_encoding: str) -> Dict[str, float]:
+    encodings = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if name:
+            encodings[name.strip().lower()] = quality
+    return encodings
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # Weak comparison, as If-None-Match requires
+    tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return etag.removeprefix("W/") in tags
+
+
+def cached_json(request: Request, key: str, build: Callable[[], Any], with_headers: bool = False) -> Response:
+    """Serve build()'s JSON from the per-snapshot cache, honouring If-None-Match and Accept-Encoding.
+
+    build() only runs on the first request for key after the data changes.
+    With with_headers, build() returns (data, extra response headers).
+    """
+    version = provider.get_data_version()
+    if _response_cache["version"] != version:
+        _response_cache["version"] = version
+        _response_cache["bodies"] = {}
+    bodies = _response_cache["bodies"]
+
+    body = bodies.get(key)
+    if body is None:
+        body = CachedBody(*build()) if with_headers else CachedBody(build())
+        if len(bodies) < MAX_CACHED_BODIES:
+            bodies[key] = body
+
+    # Weak: the gzip and br variants share it
+    headers = {
+        "ETag": f'W/"{version}"',
+        "Cache-Control": f"public, max-age={CACHE_MAX_AGE}",
+        "Vary": "Accept-Encoding",
+        **body.headers,
+    }
+    if _etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+
+    accepted = _accepted_encodings(request.headers.get("accept-encoding", ""))
+    content = body.identity
+    for encoding in ("br", "gzip"):
+        compressed = getattr(body, encoding)
+        if compressed is not None and accepted.get(encoding, 0.0) > 0:
+            content = compressed
+            headers["Content-Encoding"] = encoding
+            break
+    return Response(content=content, media_type="application/json", headers=headers)
+
+
+def _parse_fields(fields: Optional[str], allowed: Tuple[str, ...], nested: Dict[str, Tuple[str, ...]] = None) -> \
+        Optional[Dict[str, Optional[List[str]]]]:
+    """Parse a fields= projection into {field: sub-fields or None}, rejecting unknown names.
+
+    "miui_roms.version" style names select sub-fields of the nested lists.
+    Returns None when no projection was requested.
+    """
+    if not fields:
+        return None
+    nested = nested or {}
+    selected: Dict[str, Optional[List[str]]] = {}
+    unknown = []
+    for name in (part.strip() for part in fields.split(",")):
+        if not name:
+            continue
+        field, _, sub_field = name.partition(".")
+        if field not in allowed or (sub_field and sub_field not in nested.get(field, ())):
+            unknown.append(name)
+        elif sub_field:
+            if selected.get(field, []) is not None:
+                selected.setdefault(field, []).append(sub_field)
+        else:
+            selected[field] = None
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    if not selected:
+        raise HTTPException(status_code=400, detail="No fields selected.")
+    return selected
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    print("Server starting up... Fetching all data...")
-    async with httpx.AsyncClient() as client:
-        await asyncio.gather(
-            load_devices_data(client),
-            load_yaml_list_data(client, FIRMWARE_CODENAMES_URL, "firmware_codenames", "firmware codenames"),
-            load_yaml_list_data(client, MIUI_CODENAMES_URL, "miui_codenames", "MIUI codenames"),
-            load_yaml_list_data(client, VENDOR_CODENAMES_URL, "vendor_codenames", "vendor codenames"),
-            load_firmware_data(client),
-            load_miui_roms_data(client)
-        )
+    print("Server starting up... Loading device data...")
+    # Same defaults as the bot, so both processes share one snapshot file
+    await provider.initialize_data(
+        snapshot_path=os.getenv("PROVIDER_SNAPSHOT_PATH", str(SERVICES_DIR / ".cache" / "provider_snapshot.pickle"))
+    )
+    provider.start_background_refresh(
+        interval=float(os.getenv("PROVIDER_REFRESH_INTERVAL", "3600")),
+        jitter=float(os.getenv("PROVIDER_REFRESH_JITTER", "300")),
+        retry_delay=float(os.getenv("PROVIDER_RETRY_DELAY", "60")),
+    )
     print("Server is ready and all data is cached.")
     yield
+    await provider.stop_background_refresh()
     print("Server shutting down...")
 
 
@@ -150,46 +193,87 @@ async def root():
     return {
         "message": "Welcome to the Xiaomi Software API.",
         "endpoints": [
-            "/devices",
-            "/devices/{codename}/software",
+            "/devices?offset=&limit=&name=&codename=&has_firmware=&has_miui=&android=&fields=",
+            "/devices/search?q=",
+            "/devices/{codename}/software?fields=",
             "/codenames"
         ]
     }
 
 
-@app.get("/devices")
-async def get_all_devices() -> List[Dict[str, str]]:
-    return app_cache["device_list"]
-
-
-@app.get("/devices/{codename}/software")
-async def get_device_software(codename: str) -> Dict[str, Any]:
-    device_name = app_cache["codename_to_name"].get(codename)
-    if not device_name:
+@app.get("/devices", response_model=List[Dict[str, Any]])
+async def get_all_devices(
+        request: Request,
+        offset: int = Query(0, ge=0),
+        limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+        name: Optional[str] = Query(None, description="Device name prefix"),
+        codename: Optional[str] = Query(None, description="Codename prefix"),
+        has_firmware: Optional[bool] = None,
+        has_miui: Optional[bool] = None,
+        android: Optional[str] = Query(None, description="Android version with at least one ROM, e.g. 14"),
+        fields: Optional[str] = Query(None, description=f"Comma-separated subset of: {', '.join(DEVICE_FIELDS)}"),
+) -> Response:
+    """List devices, optionally filtered and paginated.
+
+    The body stays a plain array; X-Total-Count holds the number of matches
+    and a Link rel="next" header points at the following page.
+    """
+    selected = list(_parse_fields(fields, DEVICE_FIELDS) or DEFAULT_DEVICE_FIELDS)
+    key = repr(("devices", name, codename, has_firmware, has_miui, android, offset, limit, selected))
+
+    def build():
+        total, page = provider.query_devices(name, codename, has_firmware, has_miui, android, offset, limit)
+        headers = {"X-Total-Count": str(total)}
+        if limit is not None and offset + limit < total:
+            # Relative, and built from the cache key's own parameters only: the entry is shared by
+            # every caller, whatever Host, scheme or extra query parameters the first one sent
+            params = {"offset": offset + limit, "limit": limit, "name": name, "codename": codename,
+                      "has_firmware": has_firmware, "has_miui": has_miui, "android": android,
+                      "fields": ",".join(selected)}
+            query = urlencode({param: str(value).lower() if isinstance(value, bool) else value
+                               for param, value in params.items() if value is not None})
+            headers["Link"] = f'<{request.url.path}?{query}>; rel="next"'
+        return [{field: device[field] for field in selected} for device in page], headers
+
+    return cached_json(request, key, build, with_headers=True)
+
+
+@app.get("/devices/search")
+async def search_devices(q: str = Query(..., min_length=1), limit: int = Query(10, ge=1, le=50)) -> List[Dict[str, str]]:
+    return provider.search_devices(q, limit)
+
+
+@app.get("/devices/{codename}/software", response_model=Dict[str, Any])
+async def get_device_software(
+        request: Request,
+        codename: str,
+        fields: Optional[str] = Query(None, description="Comma-separated subset of: "
+                                                        f"{', '.join(SOFTWARE_FIELDS)}, miui_roms.<field>"),
+) -> Response:
+    selected = _parse_fields(fields, SOFTWARE_FIELDS, {"miui_roms": ROM_FIELDS})
+    software = provider.get_device_software(codename)
+    if not software:
         raise HTTPException(status_code=404, detail="Device codename not found.")
 
-    firmware_versions = app_cache["firmware_data"].get(codename, [])
-    miui_roms = app_cache["miui_data"].get(codename, [])
+    def build():
+        # ROMs are stored as compact tuples; the API keeps returning objects
+        data = {**software, "miui_roms": [rom._asdict() for rom in software["miui_roms"]]}
+        if selected is None:
+            return data
+        projected = {field: data[field] for field in selected}
+        if selected.get("miui_roms"):
+            projected["miui_roms"] = [{sub: rom[sub] for sub in selected["miui_roms"]} for rom in data["miui_roms"]]
+        return projected
 
-    return {
-        "name": device_name,
-        "codename": codename,
-        "firmware_versions": firmware_versions,
-        "miui_roms": miui_roms
-    }
+    return cached_json(request, repr(("software", codename, selected)), build)
 
 
-@app.get("/codenames")
-async def get_all_codenames() -> Dict[str, List[str]]:
-    return {
-        "firmware_codenames": app_cache["firmware_codenames"],
-        "miui_codenames": app_cache["miui_codenames"],
-        "vendor_codenames": app_cache["vendor_codenames"],
-    }
+@app.get("/codenames", response_model=Dict[str, List[str]])
+async def get_all_codenames(request: Request) -> Response:
+    return cached_json(request, "codenames", provider.get_codenames)
 
 
 if __name__ == "__main__":
-    import os
     import uvicorn
     from dotenv import load_dotenv
 
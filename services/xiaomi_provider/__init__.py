@@ -0,0 +1,55 @@
+"""
+Shared Xiaomi device and software data provider.
+
+Used by both the Telegram bot (Framework.helpers.provider) and the web API
+(services/web/server.py) so they serve the same data from one snapshot.
+"""
+
+from xiaomi_provider.versions import MiuiRom, RomVersion
+from xiaomi_provider.core import (
+    SNAPSHOT_SCHEMA_VERSION,
+    initialize_data,
+    refresh_data,
+    load_snapshot,
+    save_snapshot,
+    start_background_refresh,
+    stop_background_refresh,
+    get_data_version,
+    get_all_devices,
+    query_devices,
+    get_codenames,
+    get_device_by_codename,
+    search_devices,
+    get_device_software,
+    get_device_versions,
+    find_device_version,
+    get_android_version_from_miui,
+    android_version_to_api_level,
+    is_codename_valid,
+    get_similar_codenames,
+)
+
+__all__ = [
+    "SNAPSHOT_SCHEMA_VERSION",
+    "MiuiRom",
+    "RomVersion",
+    "initialize_data",
+    "refresh_data",
+    "load_snapshot",
+    "save_snapshot",
+    "start_background_refresh",
+    "stop_background_refresh",
+    "get_data_version",
+    "get_all_devices",
+    "query_devices",
+    "get_codenames",
+    "get_device_by_codename",
+    "search_devices",
+    "get_device_software",
+    "get_device_versions",
+    "find_device_version",
+    "get_android_version_from_miui",
+    "android_version_to_api_level",
+    "is_codename_valid",
+    "get_similar_codenames",
+]
@@ -0,0 +1,174 @@
+"""
+Micro-benchmarks for the provider.
+
+    cd services && python -m xiaomi_provider.bench search
+    cd services && python -m xiaomi_provider.bench ingest [latest.yml]
+"""
+
+import multiprocessing
+import random
+import resource
+import string
+import sys
+import time
+
+import yaml
+
+from xiaomi_provider.search import SearchIndex
+from xiaomi_provider.sources import parse_miui_roms
+
+SERIES = ["Redmi Note", "Redmi", "Xiaomi", "POCO", "Mi", "Redmi K"]
+SUFFIXES = ["", " Pro", " Pro+", " Ultra", " Lite", " 5G", " T"]
+
+
+def _fake_devices(count: int, rng: random.Random):
+    devices = []
+    seen = set()
+    while len(devices) < count:
+        codename = "".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(4, 9)))
+        if codename in seen:
+            continue
+        seen.add(codename)
+        name = f"{rng.choice(SERIES)} {rng.randint(1, 15)}{rng.choice(SUFFIXES)}"
+        devices.append({"name": name, "codename": codename})
+    return devices
+
+
+def _linear_search(devices, query: str, limit: int = 10):
+    """The original search_devices implementation, for comparison."""
+    query = query.lower()
+    results = []
+    for device in devices:
+        if query in device["name"].lower() or query in device["codename"].lower():
+            results.append(device)
+            if len(results) >= limit:
+                break
+    return results
+
+
+def _per_query_us(func, queries, rounds: int = 3) -> float:
+    best = float("inf")
+    for _ in range(rounds):
+        started = time.perf_counter()
+        for query in queries:
+            func(query)
+        best = min(best, time.perf_counter() - started)
+    return best / len(queries) * 1e6
+
+
+def bench_search():
+    rng = random.Random(9488)
+    print(f"{'devices':>8} {'build ms':>9} {'linear us':>10} {'index us':>9} {'fuzzy us':>9}")
+    for count in (1_000, 5_000, 20_000, 80_000):
+        devices = _fake_devices(count, rng)
+        started = time.perf_counter()
+        index = SearchIndex(devices)
+        build_ms = (time.perf_counter() - started) * 1000
+
+        sample = rng.sample(devices, 200)
+        # Misses, codename prefixes and partial names: the cases a linear scan pays for in full
+        queries = [d["codename"][:3] for d in sample] + [d["codename"] + "x" for d in sample[:100]]
+        typos = [d["codename"][:-1] + "q" for d in sample]
+
+        linear = _per_query_us(lambda q: _linear_search(devices, q), queries)
+        indexed = _per_query_us(index.search, queries)
+        fuzzy = _per_query_us(index.similar_codenames, typos)
+        print(f"{count:>8} {build_ms:>9.1f} {linear:>10.1f} {indexed:>9.1f} {fuzzy:>9.1f}")
+
+
+def _fake_miui_latest(count: int, rng: random.Random) -> bytes:
+    """A latest.yml shaped like the miui-updates-tracker one, changelogs included."""
+    devices = _fake_devices(count // 4, rng)
+    items = []
+    for i in range(count):
+        codename = f"{rng.choice(devices)['codename']}_{rng.choice(['global', 'eea', 'in', 'ru'])}"
+        version = f"OS{rng.randint(1, 2)}.0.{rng.randint(1, 40)}.0.V{rng.choice(string.ascii_uppercase * 3)}MIXM"
+        items.append({
+            "android": rng.choice([13.0, 14.0, 15.0]),
+            "branch": rng.choice(["Stable", "Beta"]),
+            "changelog": " ".join(rng.choice(["fixed", "optimized", "camera", "battery"]) for _ in range(60)),
+            "codename": codename,
+            "date": f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+            "link": f"https://bigota.d.miui.com/{version}/miui_{codename}_{version}.zip",
+            "md5": "%032x" % rng.getrandbits(128),
+            "method": "Recovery",
+            "name": "Xiaomi",
+            "size": "5.6 GB",
+            "version": version,
+        })
+    return yaml.safe_dump(items).encode()
+
+
+def _parse_miui_roms_buffered(content: bytes, loader=yaml.SafeLoader):
+    """The original MIUI ROM parser: whole body in memory, yaml.safe_load, full item dicts kept."""
+    latest = {}
+    for item in yaml.load(content, Loader=loader):
+        latest.setdefault(item['codename'].split('_')[0], []).append(item)
+    return latest
+
+
+def _peak_rss_mib() -> float:
+    """This process's RSS high-water mark. VmHWM, unlike ru_maxrss, is not inherited across exec."""
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _ingest_run(path: str, mode: str, results):
+    """Child process: parse the file once and report (seconds, start RSS, peak RSS, devices)."""
+    start_rss = _peak_rss_mib()
+    started = time.perf_counter()
+    with open(path, "rb") as stream:
+        if mode == "streaming":
+            data = parse_miui_roms(stream)
+        elif mode == "safe_load":
+            data = _parse_miui_roms_buffered(stream.read())
+        else:
+            data = _parse_miui_roms_buffered(stream.read(), yaml.CSafeLoader)
+    elapsed = time.perf_counter() - started
+    peak_rss = _peak_rss_mib()
+    results.put((elapsed, start_rss, peak_rss, len(data)))
+
+
+def bench_ingest():
+    path = sys.argv[2] if len(sys.argv) > 2 else None
+    if not path:
+        import tempfile
+        content = _fake_miui_latest(20_000, random.Random(9488))
+        with tempfile.NamedTemporaryFile(suffix=".yml", delete=False) as file:
+            file.write(content)
+            path = file.name
+    with open(path, "rb") as file:
+        size_mib = len(file.read()) / 2 ** 20
+
+    # A fresh process per run so the RSS high-water marks don't mix
+    context = multiprocessing.get_context("spawn")
+    print(f"{size_mib:.1f} MiB of YAML")
+    print(f"{'parser':>11} {'parse s':>8} {'start RSS MiB':>14} {'peak RSS MiB':>13} {'devices':>8}")
+    modes = ["safe_load", "streaming"]
+    if getattr(yaml, "__with_libyaml__", False):
+        modes.insert(1, "csafe_load")
+    for mode in modes:
+        results = context.Queue()
+        process = context.Process(target=_ingest_run, args=(path, mode, results))
+        process.start()
+        elapsed, start_rss, peak_rss, devices = results.get()
+        process.join()
+        print(f"{mode:>11} {elapsed:>8.2f} {start_rss:>14.1f} {peak_rss:>13.1f} {devices:>8}")
+
+
+BENCHMARKS = {
+    "search": bench_search,
+    "ingest": bench_ingest,
+}
+
+if __name__ == "__main__":
+    names = sys.argv[1:2] or list(BENCHMARKS)
+    for name in names:
+        print(f"== {name} ==")
+        BENCHMARKS[name]()
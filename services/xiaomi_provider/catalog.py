@@ -0,0 +1,107 @@
+"""
+Device catalog for listing and filtering devices.
+Built once per data snapshot so paginated, filtered listings never scan the whole device list.
+"""
+
+from bisect import bisect_left
+from typing import List, Dict, Any, Optional, Tuple
+
+from xiaomi_provider.versions import RomVersion
+
+
+def normalize_android(version: Any) -> str:
+    """Key form of an Android version: '14', 14.0 and '14.0' are all '14'."""
+    text = str(version).strip().lower()
+    try:
+        number = float(text)
+    except ValueError:
+        return text
+    return str(int(number)) if number.is_integer() else str(number)
+
+
+def _prefix_ids(keys: List[Tuple[str, int]], prefix: str) -> set:
+    start = bisect_left(keys, (prefix,))
+    ids = set()
+    for i in range(start, len(keys)):
+        if not keys[i][0].startswith(prefix):
+            break
+        ids.add(keys[i][1])
+    return ids
+
+
+class DeviceCatalog:
+    """Per-device availability facets plus the indexes that filter on them."""
+
+    __slots__ = ("entries", "_names", "_codenames", "_firmware_ids", "_miui_ids", "_android_ids")
+
+    def __init__(self, device_list: List[Dict[str, str]], firmware_data: Dict[str, List[str]],
+                 rom_versions: Dict[str, List[RomVersion]]):
+        self.entries = []
+        self._firmware_ids = set()
+        self._miui_ids = set()
+        self._android_ids: Dict[str, set] = {}
+
+        for i, device in enumerate(device_list):
+            base_codename = device["codename"].split('_')[0]
+            versions = rom_versions.get(base_codename, [])
+            android_versions = []
+            for rom_version in versions:
+                if rom_version.android is not None:
+                    key = normalize_android(rom_version.android)
+                    if key not in android_versions:
+                        android_versions.append(key)
+                    self._android_ids.setdefault(key, set()).add(i)
+
+            has_firmware = bool(firmware_data.get(base_codename))
+            if has_firmware:
+                self._firmware_ids.add(i)
+            if versions:
+                self._miui_ids.add(i)
+
+            self.entries.append({
+                "name": device["name"],
+                "codename": device["codename"],
+                "has_firmware": has_firmware,
+                "has_miui": bool(versions),
+                "android_versions": android_versions,
+            })
+
+        self._names = sorted((device["name"].lower(), i) for i, device in enumerate(device_list))
+        self._codenames = sorted((device["codename"].lower(), i) for i, device in enumerate(device_list))
+
+    def __len__(self):
+        return len(self.entries)
+
+    def query(self, name_prefix: Optional[str] = None, codename_prefix: Optional[str] = None,
+              has_firmware: Optional[bool] = None, has_miui: Optional[bool] = None,
+              android: Optional[str] = None, offset: int = 0,
+              limit: Optional[int] = None) -> Tuple[int, List[Dict[str, Any]]]:
+        """Filter the catalog and return (total matches, requested page), in device list order.
+
+        Every filter is optional; the ones given must all match.
+        """
+        selected: Optional[set] = None
+
+        def narrow(ids: set):
+            nonlocal selected
+            selected = ids if selected is None else selected & ids
+
+        if name_prefix:
+            narrow(_prefix_ids(self._names, name_prefix.strip().lower()))
+        if codename_prefix:
+            narrow(_prefix_ids(self._codenames, codename_prefix.strip().lower()))
+        if android:
+            narrow(self._android_ids.get(normalize_android(android), set()))
+        if has_firmware is True:
+            narrow(self._firmware_ids)
+        if has_miui is True:
+            narrow(self._miui_ids)
+
+        ids = range(len(self.entries)) if selected is None else sorted(selected)
+        if has_firmware is False:
+            ids = [i for i in ids if i not in self._firmware_ids]
+        if has_miui is False:
+            ids = [i for i in ids if i not in self._miui_ids]
+
+        end = None if limit is None else offset + limit
+        return len(ids), [self.entries[i] for i in ids[offset:end]]
@@ -0,0 +1,408 @@
+"""
+Xiaomi Device and Software Data Provider
+Provides device information, firmware versions, and MIUI ROM data.
+Shared by the Telegram bot and the web API.
+"""
+
+import asyncio
+import logging
+import os
+import pickle
+import random
+import time
+from typing import List, Dict, Any, Optional, Tuple
+
+import httpx
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process leader election, every process refreshes itself
+    fcntl = None
+
+from xiaomi_provider.catalog import DeviceCatalog
+from xiaomi_provider.search import SearchIndex
+from xiaomi_provider.sources import source_state, load_all_sources
+from xiaomi_provider.versions import RomVersion, normalize_version, build_version_index
+
+LOGGER = logging.getLogger(__name__)
+
+# Current data snapshot. Refreshes build a complete new dict off to the side
+# and replace this reference in one assignment, so readers always see either
+# the old or the new snapshot and never a half-built one.
+_cache = {
+    "device_list": [],
+    "codename_to_name": {},
+    "firmware_codenames": [],
+    "miui_codenames": [],
+    "vendor_codenames": [],
+    "firmware_data": {},
+    "miui_data": {},
+    "search_index": SearchIndex([]),
+    "catalog": DeviceCatalog([], {}, {}),
+    "version_index": {},
+    "rom_versions": {},
+    "version": 0,
+    "updated_at": 0.0,
+    "initialized": False
+}
+
+_refresh_lock = asyncio.Lock()
+_refresh_task: Optional[asyncio.Task] = None
+_revalidate_task: Optional[asyncio.Task] = None
+
+# On-disk copy of the snapshot for warm starts. Bump the schema version
+# whenever the layout of the snapshot or of the source state changes.
+SNAPSHOT_SCHEMA_VERSION = 5
+_snapshot_path: Optional[str] = None
+_snapshot_mtime = 0.0
+
+# Processes sharing a snapshot path elect one leader through a lock file next
+# to it. Only the leader talks to upstream and writes the snapshot; the others
+# reload its file, and fetch for themselves only if its first snapshot is late.
+_leader_lock_file = None
+# How long a follower waits for the leader's first snapshot before fetching upstream itself
+FOLLOWER_SNAPSHOT_WAIT = 120.0
+
+
+async def initialize_data(force: bool = False, snapshot_path: Optional[str] = None):
+    """Initialize all data, from the on-disk snapshot if possible, else from remote sources."""
+    global _snapshot_path, _revalidate_task
+    if snapshot_path:
+        _snapshot_path = snapshot_path
+
+    if _cache["initialized"] and not force:
+        LOGGER.info("Data already initialized, skipping...")
+        return True
+
+    if not force and await load_snapshot():
+        # Serve from disk right away and check upstream in the background
+        _revalidate_task = asyncio.create_task(refresh_data())
+        return True
+
+    LOGGER.info("Initializing device and software data...")
+    if await refresh_data():
+        LOGGER.info("Data initialization complete!")
+        return True
+    return False
+
+
+def _read_snapshot_file(path: str) -> Optional[dict]:
+    with open(path, "rb") as f:
+        payload = pickle.load(f)
+    if not isinstance(payload, dict) or payload.get("schema") != SNAPSHOT_SCHEMA_VERSION:
+        return None
+    return payload
+
+
+def _write_snapshot_file(path: str, payload: dict):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(payload, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+    return os.path.getmtime(path)
+
+
+async def load_snapshot() -> bool:
+    """Load the on-disk snapshot and make it live. Returns False if there is none or it is unusable."""
+    global _cache, _snapshot_mtime
+    if not _snapshot_path or not os.path.exists(_snapshot_path):
+        return False
+
+    try:
+        started = time.perf_counter()
+        mtime = os.path.getmtime(_snapshot_path)
+        payload = await asyncio.to_thread(_read_snapshot_file, _snapshot_path)
+        if not payload:
+            LOGGER.warning(f"Ignoring snapshot {_snapshot_path}: schema version mismatch.")
+            return False
+
+        source_state.clear()
+        source_state.update(payload["sources"])
+        _cache = payload["snapshot"]
+        _snapshot_mtime = mtime
+        LOGGER.info(
+            f"Loaded data snapshot v{_cache['version']} from disk in {(time.perf_counter() - started) * 1000:.0f}ms "
+            f"({len(_cache['device_list'])} devices).")
+        return True
+    except Exception as e:
+        LOGGER.error(f"Failed to load data snapshot from {_snapshot_path}: {e}")
+        return False
+
+
+async def save_snapshot():
+    """Write the current snapshot and source validators to disk."""
+    global _snapshot_mtime
+    if not _snapshot_path or not _cache["initialized"]:
+        return
+
+    payload = {
+        "schema": SNAPSHOT_SCHEMA_VERSION,
+        "snapshot": _cache,
+        "sources": dict(source_state),
+    }
+    try:
+        _snapshot_mtime = await asyncio.to_thread(_write_snapshot_file, _snapshot_path, payload)
+    except Exception as e:
+        LOGGER.error(f"Failed to save data snapshot to {_snapshot_path}: {e}")
+
+
+def _is_refresh_leader() -> bool:
+    """Whether this process fetches upstream data for the shared snapshot.
+
+    The first process to lock the snapshot's lock file keeps the lock for its
+    lifetime. When it exits the lock is released and a follower takes over.
+    """
+    global _leader_lock_file
+    if _leader_lock_file or not _snapshot_path or fcntl is None:
+        return True
+
+    os.makedirs(os.path.dirname(_snapshot_path) or ".", exist_ok=True)
+    lock_file = open(f"{_snapshot_path}.lock", "a+")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return False
+
+    _leader_lock_file = lock_file
+    LOGGER.info(f"This process (PID {os.getpid()}) now refreshes the shared data snapshot.")
+    return True
+
+
+async def _follow_snapshot() -> bool:
+    """Pick up the leader's snapshot file if it changed since we last read it."""
+    if os.path.getmtime(_snapshot_path) <= _snapshot_mtime:
+        return _cache["initialized"]
+    return await load_snapshot()
+
+
+async def _wait_for_snapshot(poll: float = 1.0) -> bool:
+    """Wait for the leader to write its first snapshot file.
+
+    Returns False after FOLLOWER_SNAPSHOT_WAIT seconds, or as soon as this process
+    takes over as leader because the previous one exited.
+    """
+    LOGGER.info(f"Waiting for the refresh leader to write {_snapshot_path}...")
+    deadline = time.monotonic() + FOLLOWER_SNAPSHOT_WAIT
+    while time.monotonic() < deadline:
+        await asyncio.sleep(poll)
+        if os.path.exists(_snapshot_path):
+            return True
+        if _is_refresh_leader():
+            return False
+    return False
+
+
+async def refresh_data() -> bool:
+    """Rebuild the data snapshot from upstream and swap it in.
+
+    Sources that fail to load keep their values from the current snapshot.
+    Returns True only if every source was fetched successfully.
+    """
+    global _cache
+
+    async with _refresh_lock:
+        leader = _is_refresh_leader()
+        if not leader:
+            if os.path.exists(_snapshot_path) or await _wait_for_snapshot():
+                return await _follow_snapshot()
+            leader = _is_refresh_leader()
+            if not leader:
+                # Serve something, but leave the shared snapshot file to the leader
+                LOGGER.warning("No snapshot from the refresh leader yet, fetching upstream data for this process only.")
+
+        current = _cache
+        snapshot = dict(current)
+        try:
+            async with httpx.AsyncClient(timeout=60.0) as client:
+                results = await load_all_sources(client, snapshot)
+        except Exception as e:
+            LOGGER.error(f"Failed to refresh data: {e}", exc_info=True)
+            return False
+
+        ok = all(result is not None for result in results)
+        changed = any(results)
+        if changed or (ok and not current["initialized"]):
+            await asyncio.to_thread(_build_indexes, snapshot, current)
+            snapshot["version"] = current["version"] + 1
+            snapshot["updated_at"] = time.time()
+            snapshot["initialized"] = current["initialized"] or ok
+            _cache = snapshot
+            LOGGER.info(f"Data snapshot v{snapshot['version']} is now live.")
+            if leader:
+                await save_snapshot()
+        return ok
+
+
+def _build_indexes(snapshot: dict, current: dict):
+    """Build the derived lookup indexes of a new snapshot, reusing those whose inputs did not change."""
+    if snapshot["device_list"] is not current["device_list"]:
+        snapshot["search_index"] = SearchIndex(snapshot["device_list"])
+    if snapshot["miui_data"] is not current["miui_data"]:
+        snapshot["version_index"], snapshot["rom_versions"] = build_version_index(snapshot["miui_data"])
+    if any(snapshot[key] is not current[key] for key in ("device_list", "firmware_data", "miui_data")):
+        snapshot["catalog"] = DeviceCatalog(snapshot["device_list"], snapshot["firmware_data"],
+                                            snapshot["rom_versions"])
+
+
+async def _refresh_loop(interval: float, jitter: float, retry_delay: float):
+    failures = 0
+    while True:
+        if failures:
+            # Exponential backoff while upstream is failing, never slower than the normal interval
+            delay = min(retry_delay * 2 ** (failures - 1), interval)
+        else:
+            delay = interval + random.uniform(-jitter, jitter)
+        await asyncio.sleep(max(delay, 1.0))
+
+        try:
+            ok = await refresh_data()
+        except Exception as e:
+            LOGGER.error(f"Background data refresh crashed: {e}", exc_info=True)
+            ok = False
+
+        if ok:
+            failures = 0
+        else:
+            failures += 1
+            LOGGER.warning(f"Background data refresh failed ({failures} in a row), backing off.")
+
+
+def start_background_refresh(interval: float = 3600, jitter: float = 300, retry_delay: float = 60):
+    """Start the periodic background refresher if it is not already running."""
+    global _refresh_task
+    if _refresh_task and not _refresh_task.done():
+        return _refresh_task
+
+    LOGGER.info(f"Starting background data refresh every {interval}s (±{jitter}s).")
+    _refresh_task = asyncio.create_task(_refresh_loop(interval, jitter, retry_delay))
+    return _refresh_task
+
+
+async def stop_background_refresh():
+    """Cancel the background refresher and wait for it to exit."""
+    global _refresh_task
+    if not _refresh_task:
+        return
+
+    _refresh_task.cancel()
+    try:
+        await _refresh_task
+    except asyncio.CancelledError:
+        pass
+    _refresh_task = None
+
+
+def get_data_version() -> str:
+    """Identifier of the live snapshot. Changes whenever the served data does."""
+    return f"{_cache['version']}-{int(_cache['updated_at'])}"
+
+
+def get_all_devices() -> List[Dict[str, str]]:
+    """Get list of all devices."""
+    return _cache["device_list"]
+
+
+def query_devices(name_prefix: Optional[str] = None, codename_prefix: Optional[str] = None,
+                  has_firmware: Optional[bool] = None, has_miui: Optional[bool] = None,
+                  android: Optional[str] = None, offset: int = 0,
+                  limit: Optional[int] = None) -> Tuple[int, List[Dict[str, Any]]]:
+    """Filtered, paginated device listing with availability facets. Returns (total, page)."""
+    return _cache["catalog"].query(name_prefix, codename_prefix, has_firmware, has_miui, android, offset, limit)
+
+
+def get_codenames() -> Dict[str, List[str]]:
+    """Get the firmware, MIUI and vendor codename lists."""
+    snapshot = _cache
+    return {
+        "firmware_codenames": snapshot["firmware_codenames"],
+        "miui_codenames": snapshot["miui_codenames"],
+        "vendor_codenames": snapshot["vendor_codenames"],
+    }
+
+
+def get_device_by_codename(codename: str) -> Optional[Dict[str, str]]:
+    """Get device information by codename."""
+    name = _cache["codename_to_name"].get(codename)
+    if name:
+        return {"name": name, "codename": codename}
+    return None
+
+
+def search_devices(query: str, limit: int = 10) -> List[Dict[str, str]]:
+    """Search devices by name or codename, best matches first."""
+    return _cache["search_index"].search(query, limit)
+
+
+def get_device_software(codename: str) -> Optional[Dict[str, Any]]:
+    """Get software versions for a device."""
+    # Extract base codename (first part before underscore)
+    base_codename = codename.split('_')[0]
+    snapshot = _cache
+
+    device_name = snapshot["codename_to_name"].get(codename) or snapshot["codename_to_name"].get(base_codename)
+    if not device_name:
+        return None
+
+    firmware_versions = snapshot["firmware_data"].get(base_codename, [])
+    miui_roms = snapshot["miui_data"].get(base_codename, [])
+
+    return {
+        "name": device_name,
+        "codename": codename,
+        "firmware_versions": firmware_versions,
+        "miui_roms": miui_roms
+    }
+
+
+def get_device_versions(codename: str) -> List[RomVersion]:
+    """Get a device's ROM versions, newest release first."""
+    return _cache["rom_versions"].get(codename.split('_')[0], [])
+
+
+def find_device_version(codename: str, miui_version: str) -> Optional[RomVersion]:
+    """Look up a device's ROM version by its exact version or MIUI string (case-insensitive)."""
+    base_codename = codename.split('_')[0]
+    return _cache["version_index"].get((base_codename, normalize_version(miui_version)))
+
+
+def get_android_version_from_miui(codename: str, miui_version: str) -> Optional[str]:
+    """Get Android version from MIUI ROM version."""
+    rom_version = find_device_version(codename, miui_version)
+    return rom_version.android if rom_version else None
+
+
+def android_version_to_api_level(android_version: str) -> str:
+    """Convert Android version to API level."""
+    # Handle float strings like "13.0", "14.0", "15.0"
+    try:
+        android_int = int(float(android_version))
+    except (ValueError, TypeError):
+        android_int = android_version
+
+    version_map = {
+        '13': '33',
+        '14': '34',
+        '15': '35',
+        '16': '36',
+        # Support integer inputs as well
+        13: '33',
+        14: '34',
+        15: '35',
+        16: '36'
+    }
+
+    # Try with the integer version first, then fall back to original
+    return version_map.get(android_int, version_map.get(str(android_int), str(android_version)))
+
+
+def is_codename_valid(codename: str) -> bool:
+    """Check if a codename is valid."""
+    base_codename = codename.split('_')[0]
+    return base_codename in _cache["codename_to_name"]
+
+
+def get_similar_codenames(codename: str, limit: int = 5) -> List[str]:
+    """Get similar codenames for suggestions when user enters invalid codename."""
+    return _cache["search_index"].similar_codenames(codename, limit)
@@ -0,0 +1,157 @@
+"""
+Device search index.
+Built once per data snapshot so lookups never scan the whole device list.
+"""
+
+from bisect import bisect_left
+from typing import List, Dict, Tuple, Iterable
+
+# Minimum trigram similarity for a fuzzy (typo tolerant) match
+FUZZY_THRESHOLD = 0.3
+# Fuzzy candidates are drawn from this many of the query's rarest trigrams
+FUZZY_SEED_GRAMS = 4
+# Shorter queries have too few trigrams for similarity to mean anything
+FUZZY_MIN_LENGTH = 4
+
+
+def _trigrams(text: str) -> set:
+    """Trigrams of a padded string, so short words and word edges still produce grams."""
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _prefix_range(keys: List[Tuple[str, int]], prefix: str) -> Iterable[Tuple[str, int]]:
+    """Yield the (key, id) pairs of a sorted list whose key starts with prefix."""
+    start = bisect_left(keys, (prefix,))
+    for i in range(start, len(keys)):
+        if not keys[i][0].startswith(prefix):
+            break
+        yield keys[i]
+
+
+class SearchIndex:
+    """Prefix and trigram index over the device list."""
+
+    __slots__ = ("devices", "_names", "_name_texts", "_codenames", "_codename_texts", "_codename_ids", "_tokens",
+                 "_grams", "_codename_grams")
+
+    def __init__(self, device_list: List[Dict[str, str]]):
+        self.devices = device_list
+        # Pre-lowered "name codename" haystacks for substring checks
+        self._names = [f"{d['name']} {d['codename']}".lower() for d in device_list]
+        self._name_texts = [d["name"].lower() for d in device_list]
+        self._codename_texts = [d["codename"].lower() for d in device_list]
+        self._codenames = sorted((codename, i) for i, codename in enumerate(self._codename_texts))
+        self._codename_ids = {codename: i for codename, i in reversed(self._codenames)}
+        self._tokens = sorted(
+            (token, i) for i, name in enumerate(self._names) for token in set(name.split())
+        )
+
+        self._grams = self._build_postings(self._names)
+        self._codename_grams = self._build_postings(self._codename_texts)
+
+    def __len__(self):
+        return len(self.devices)
+
+    @staticmethod
+    def _build_postings(texts: List[str]) -> Dict[str, List[int]]:
+        postings: Dict[str, List[int]] = {}
+        for i, text in enumerate(texts):
+            for gram in _trigrams(text):
+                postings.setdefault(gram, []).append(i)
+        return postings
+
+    @staticmethod
+    def _fuzzy(query: str, postings: Dict[str, List[int]], fields: List[List[str]], exclude: set) -> List[int]:
+        """Ids ranked by trigram (Jaccard) similarity to the query.
+
+        Each candidate scores its best matching field. Only the postings of the
+        rarest query trigrams are read, so the cost follows the number of
+        plausible matches rather than the list size.
+        """
+        if len(query) < FUZZY_MIN_LENGTH:
+            return []
+
+        grams = _trigrams(query)
+        rarest = sorted((postings.get(gram, ()) for gram in grams), key=len)[:FUZZY_SEED_GRAMS]
+        candidates = set()
+        for ids in rarest:
+            candidates.update(ids)
+
+        scored = []
+        for i in candidates - exclude:
+            score = 0.0
+            for texts in fields:
+                other = _trigrams(texts[i])
+                shared = len(grams & other)
+                score = max(score, shared / (len(grams) + len(other) - shared))
+            if score >= FUZZY_THRESHOLD:
+                scored.append((-score, i))
+        scored.sort()
+        return [i for _, i in scored]
+
+    def search(self, query: str, limit: int = 10) -> List[Dict[str, str]]:
+        """Search devices by name or codename.
+
+        Results are ranked: exact codename, codename prefix, name/codename
+        substring (name prefix first), then fuzzy trigram matches.
+        """
+        q = " ".join(query.lower().split())
+        if not q or limit <= 0:
+            return []
+
+        ids = []
+        seen = set()
+
+        def add(candidates: Iterable[int]) -> bool:
+            for i in candidates:
+                if i not in seen:
+                    seen.add(i)
+                    ids.append(i)
+                    if len(ids) >= limit:
+                        return True
+            return False
+
+        exact = self._codename_ids.get(q)
+        if exact is not None and add([exact]):
+            return self._result(ids)
+        if add(i for _, i in _prefix_range(self._codenames, q)):
+            return self._result(ids)
+
+        if len(q) < 3:
+            # Too short for trigrams: match the start of any word of the name
+            substring = sorted({i for _, i in _prefix_range(self._tokens, q)})
+        else:
+            # Every trigram inside the query must occur in a match; verify the survivors
+            inner = [q[i:i + 3] for i in range(len(q) - 2)]
+            rarest = min((self._grams.get(gram, []) for gram in inner), key=len)
+            substring = [i for i in rarest if q in self._names[i]]
+        substring.sort(key=lambda i: not self._names[i].startswith(q))
+        if add(substring):
+            return self._result(ids)
+
+        add(self._fuzzy(q, self._grams, [self._codename_texts, self._name_texts], seen))
+        return self._result(ids)
+
+    def similar_codenames(self, codename: str, limit: int = 5) -> List[str]:
+        """Codenames close to an unknown one: longest shared prefix first, then typo-tolerant matches."""
+        q = codename.strip().lower()
+        if not q or limit <= 0:
+            return []
+
+        ids = []
+        seen = set()
+        for length in range(len(q), 1, -1):
+            for _, i in _prefix_range(self._codenames, q[:length]):
+                if i not in seen:
+                    seen.add(i)
+                    ids.append(i)
+            if len(ids) >= limit:
+                break
+
+        if len(ids) < limit:
+            ids.extend(self._fuzzy(q, self._codename_grams, [self._codename_texts], seen))
+        return [self.devices[i]["codename"] for i in ids[:limit]]
+
+    def _result(self, ids: List[int]) -> List[Dict[str, str]]:
+        return [self.devices[i] for i in ids]
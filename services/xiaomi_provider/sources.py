@@ -0,0 +1,340 @@
+"""
+Upstream data sources for the Xiaomi device provider.
+Fetches each source with conditional GETs and parses it into index form.
+"""
+
+import asyncio
+import json
+import logging
+import sys
+import threading
+from collections import deque
+from typing import List, Dict, Any, Optional, Callable, Tuple, Iterator, BinaryIO
+
+import httpx
+import yaml
+
+from .versions import MiuiRom
+
+try:
+    from yaml import CSafeLoader as YamlLoader
+except ImportError:  # PyYAML built without libyaml
+    from yaml import SafeLoader as YamlLoader
+
+LOGGER = logging.getLogger(__name__)
+
+# URLs for data sources
+DEVICES_URL = "https://raw.githubusercontent.com/XiaomiFirmwareUpdater/xiaomi_devices/master/devices.json"
+FIRMWARE_CODENAMES_URL = "https://raw.githubusercontent.com/xiaomifirmwareupdater/xiaomifirmwareupdater.github.io/master/data/firmware_codenames.yml"
+MIUI_CODENAMES_URL = "https://raw.githubusercontent.com/xiaomifirmwareupdater/xiaomifirmwareupdater.github.io/master/data/miui_codenames.yml"
+VENDOR_CODENAMES_URL = "https://raw.githubusercontent.com/xiaomifirmwareupdater/xiaomifirmwareupdater.github.io/master/data/vendor_codenames.yml"
+FIRMWARE_URL = "https://raw.githubusercontent.com/xiaomifirmwareupdater/xiaomifirmwareupdater.github.io/master/data/devices/latest.yml"
+MIUI_ROMS_URL = "https://raw.githubusercontent.com/xiaomifirmwareupdater/miui-updates-tracker/master/data/latest.yml"
+
+# Per-source HTTP validators and last parsed result, keyed by URL.
+# Used to send conditional GETs and skip re-parsing unchanged data.
+source_state = {}
+
+
+# Bodies are handed to the parser thread in chunks of this size, at most
+# STREAM_MAX_CHUNKS of them waiting at a time.
+STREAM_CHUNK_SIZE = 64 * 1024
+STREAM_MAX_CHUNKS = 16
+
+
+class BodyStream:
+    """Blocking, read-only file object over an HTTP body that is still downloading.
+
+    The event loop offers chunks as they arrive and a parser thread reads
+    them, so the whole body is never held in memory. Create it on the event
+    loop: the reader wakes a writer waiting for space through that loop.
+    """
+
+    def __init__(self, max_chunks: int = STREAM_MAX_CHUNKS):
+        self._chunks = deque()
+        self._max_chunks = max_chunks
+        self._buffer = bytearray()
+        self._ready = threading.Condition()
+        self._closed = False
+        self._error: Optional[BaseException] = None
+        # Set from the reader thread when it takes a chunk from a full queue
+        self._space = asyncio.Event()
+        self._loop = asyncio.get_running_loop()
+
+    def offer(self, chunk: bytes) -> bool:
+        """Queue a chunk for the reader. Returns False while the queue is full."""
+        with self._ready:
+            if len(self._chunks) >= self._max_chunks:
+                return False
+            self._chunks.append(chunk)
+            self._ready.notify()
+            return True
+
+    async def wait_for_space(self):
+        """Wait until the reader makes room in a full queue, or wake_writer is called."""
+        await self._space.wait()
+        self._space.clear()
+
+    def wake_writer(self):
+        """Wake a writer in wait_for_space, e.g. because the reader stopped reading."""
+        self._space.set()
+
+    def close(self, error: Optional[BaseException] = None):
+        """Mark the end of the body. With an error, the reader raises instead of seeing EOF."""
+        with self._ready:
+            self._closed = True
+            self._error = error
+            self._ready.notify()
+
+    def read(self, size: int = -1) -> bytes:
+        with self._ready:
+            while size < 0 or len(self._buffer) < size:
+                if self._error:
+                    raise OSError(f"Body download failed: {self._error}")
+                if self._chunks:
+                    if len(self._chunks) >= self._max_chunks:
+                        self._loop.call_soon_threadsafe(self._space.set)
+                    self._buffer += self._chunks.popleft()
+                    self._ready.notify()
+                elif self._closed:
+                    break
+                else:
+                    self._ready.wait()
+
+            if size < 0 or size >= len(self._buffer):
+                data = bytes(self._buffer)
+                self._buffer.clear()
+            else:
+                data = bytes(self._buffer[:size])
+                del self._buffer[:size]
+            return data
+
+
+async def fetch_source(client: httpx.AsyncClient, url: str, parser: Callable[[BinaryIO], Any]) -> Tuple[Any, bool]:
+    """Fetch a data source with a conditional GET and parse it off the event loop.
+
+    The body is streamed into the parser while it downloads. Returns
+    (parsed_data, changed). When upstream answers 304 Not Modified the
+    previously parsed result is returned and the parser is not run again.
+    """
+    source = source_state.get(url)
+    headers = {}
+    if source:
+        if source.get("etag"):
+            headers["If-None-Match"] = source["etag"]
+        if source.get("last_modified"):
+            headers["If-Modified-Since"] = source["last_modified"]
+
+    async with client.stream("GET", url, headers=headers) as response:
+        if response.status_code == 304 and source:
+            return source["data"], False
+        response.raise_for_status()
+
+        body = BodyStream()
+        parsing = asyncio.ensure_future(asyncio.to_thread(parser, body))
+        parsing.add_done_callback(lambda _: body.wake_writer())
+        try:
+            async for chunk in response.aiter_bytes(STREAM_CHUNK_SIZE):
+                # Backpressure: wait for the parser rather than buffering the body
+                while not body.offer(chunk) and not parsing.done():
+                    await body.wait_for_space()
+                if parsing.done():
+                    break
+        except BaseException as e:
+            body.close(error=e)
+            await asyncio.gather(parsing, return_exceptions=True)
+            raise
+        body.close()
+        data = await parsing
+
+    source_state[url] = {
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+        "data": data,
+    }
+    return data, True
+
+
+def _construct_value(loader: YamlLoader) -> Any:
+    """Build the next value from the loader's event stream, as yaml.safe_load would."""
+    event = loader.get_event()
+    if isinstance(event, yaml.ScalarEvent):
+        tag = event.tag
+        if tag is None or tag == "!":
+            tag = loader.resolve(yaml.ScalarNode, event.value, event.implicit)
+        node = yaml.ScalarNode(tag, event.value, event.start_mark, event.end_mark, event.style)
+        constructor = loader.yaml_constructors.get(tag) or loader.yaml_constructors[None]
+        return constructor(loader, node)
+    if isinstance(event, yaml.SequenceStartEvent):
+        items = []
+        while not loader.check_event(yaml.SequenceEndEvent):
+            items.append(_construct_value(loader))
+        loader.get_event()
+        return items
+    if isinstance(event, yaml.MappingStartEvent):
+        mapping = {}
+        while not loader.check_event(yaml.MappingEndEvent):
+            key = _construct_value(loader)
+            mapping[key] = _construct_value(loader)
+        loader.get_event()
+        return mapping
+    raise yaml.YAMLError(f"Unsupported YAML event {event!r}")
+
+
+def iter_yaml_sequence(stream: BinaryIO) -> Iterator[Any]:
+    """Yield the items of a top-level YAML sequence one by one.
+
+    Only the item being built is held in memory, unlike yaml.safe_load which
+    builds the whole node graph first. Anchors and aliases are not supported.
+    """
+    loader = YamlLoader(stream)
+    try:
+        loader.get_event()  # StreamStart
+        if loader.check_event(yaml.StreamEndEvent):
+            return
+        loader.get_event()  # DocumentStart
+        if not loader.check_event(yaml.SequenceStartEvent):
+            raise yaml.YAMLError("Expected a top-level YAML sequence")
+        loader.get_event()
+        while not loader.check_event(yaml.SequenceEndEvent):
+            yield _construct_value(loader)
+    finally:
+        loader.dispose()
+
+
+def parse_yaml_list(stream: BinaryIO) -> List[Any]:
+    return list(iter_yaml_sequence(stream))
+
+
+def parse_devices(stream: BinaryIO) -> Tuple[List[Dict[str, str]], Dict[str, str]]:
+    devices_data = json.load(stream)
+
+    device_list = []
+    codename_map = {}
+
+    for codename, details in devices_data.items():
+        if "display_name_en" in details:
+            name = details["display_name_en"]
+            device_list.append({"name": name, "codename": codename})
+            codename_map[codename] = name
+        elif "display_name" in details:
+            name = details["display_name"]
+            device_list.append({"name": name, "codename": codename})
+            codename_map[codename] = name
+
+    return device_list, codename_map
+
+
+def parse_firmware(stream: BinaryIO) -> Dict[str, List[str]]:
+    latest = {}
+    for item in iter_yaml_sequence(stream):
+        try:
+            codename = sys.intern(item['downloads']['github'].split('/')[4].split('_')[-1])
+            version = item['versions']['miui']
+            if latest.get(codename):
+                latest[codename].append(version)
+            else:
+                latest[codename] = [version]
+        except (KeyError, IndexError, TypeError, AttributeError):
+            continue
+    return latest
+
+
+def _text(value: Any) -> Optional[str]:
+    return None if value is None else str(value)
+
+
+def parse_miui_roms(stream: BinaryIO) -> Dict[str, List[MiuiRom]]:
+    latest = {}
+    for item in iter_yaml_sequence(stream):
+        try:
+            codename = item['codename']
+            base_codename = sys.intern(codename.split('_')[0])
+            branch = item.get('branch')
+            rom = MiuiRom(
+                codename=codename,
+                version=_text(item.get('version')),
+                miui=_text(item.get('miui')),
+                android=item.get('android'),
+                branch=sys.intern(branch) if isinstance(branch, str) else branch,
+                date=_text(item.get('date')),
+            )
+            if latest.get(base_codename):
+                latest[base_codename].append(rom)
+            else:
+                latest[base_codename] = [rom]
+        except (KeyError, IndexError, TypeError, AttributeError):
+            continue
+    return latest
+
+
+async def load_devices_data(client: httpx.AsyncClient, snapshot: dict) -> Optional[bool]:
+    """Load device list and codename mappings.
+
+    Returns whether the data changed, or None if it could not be loaded.
+    """
+    try:
+        (device_list, codename_map), changed = await fetch_source(client, DEVICES_URL, parse_devices)
+        snapshot["device_list"] = device_list
+        snapshot["codename_to_name"] = codename_map
+        if changed:
+            LOGGER.info(f"Loaded {len(device_list)} devices.")
+        return changed
+
+    except Exception as e:
+        LOGGER.error(f"Error fetching devices: {e}")
+        return None
+
+
+async def load_yaml_list_data(client: httpx.AsyncClient, url: str, cache_key: str, name: str,
+                              snapshot: dict) -> Optional[bool]:
+    """Load YAML list data into the snapshot."""
+    try:
+        data, changed = await fetch_source(client, url, parse_yaml_list)
+        snapshot[cache_key] = data
+        if changed:
+            LOGGER.info(f"Loaded {len(data)} {name}.")
+        return changed
+    except Exception as e:
+        LOGGER.error(f"Error fetching {name}: {e}")
+        return None
+
+
+async def load_firmware_data(client: httpx.AsyncClient, snapshot: dict) -> Optional[bool]:
+    """Load firmware version data."""
+    try:
+        latest, changed = await fetch_source(client, FIRMWARE_URL, parse_firmware)
+        snapshot["firmware_data"] = latest
+        if changed:
+            LOGGER.info(f"Loaded firmware data for {len(latest)} devices.")
+        return changed
+
+    except Exception as e:
+        LOGGER.error(f"Error fetching firmware: {e}")
+        return None
+
+
+async def load_miui_roms_data(client: httpx.AsyncClient, snapshot: dict) -> Optional[bool]:
+    """Load MIUI ROM data."""
+    try:
+        latest, changed = await fetch_source(client, MIUI_ROMS_URL, parse_miui_roms)
+        snapshot["miui_data"] = latest
+        if changed:
+            LOGGER.info(f"Loaded MIUI ROMs data for {len(latest)} devices.")
+        return changed
+
+    except Exception as e:
+        LOGGER.error(f"Error fetching MIUI ROMs: {e}")
+        return None
+
+
+async def load_all_sources(client: httpx.AsyncClient, snapshot: dict) -> List[Optional[bool]]:
+    """Load every source into the snapshot concurrently. Returns each loader's result."""
+    return await asyncio.gather(
+        load_devices_data(client, snapshot),
+        load_yaml_list_data(client, FIRMWARE_CODENAMES_URL, "firmware_codenames", "firmware codenames", snapshot),
+        load_yaml_list_data(client, MIUI_CODENAMES_URL, "miui_codenames", "MIUI codenames", snapshot),
+        load_yaml_list_data(client, VENDOR_CODENAMES_URL, "vendor_codenames", "vendor codenames", snapshot),
+        load_firmware_data(client, snapshot),
+        load_miui_roms_data(client, snapshot)
+    )
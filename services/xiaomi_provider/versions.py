@@ -0,0 +1,62 @@
+"""
+ROM records and version indexes.
+Indexes are precomputed per snapshot so version selection never scans a device's ROM list.
+"""
+
+from typing import List, Dict, Any, NamedTuple, Optional, Tuple
+
+
+class MiuiRom(NamedTuple):
+    """The fields of an upstream MIUI/HyperOS ROM entry that the bot and the API use."""
+    codename: str
+    version: Optional[str]
+    miui: Optional[str]
+    android: Optional[Any]
+    branch: Optional[str]
+    date: Optional[str]
+
+
+class RomVersion(NamedTuple):
+    """One selectable ROM version of a device, as shown in the bot's version keyboard."""
+    version: str
+    android: Optional[Any]
+    label: str
+
+
+def normalize_version(version: Any) -> str:
+    """Key form of a ROM version string: trimmed and case-insensitive."""
+    return str(version).strip().lower()
+
+
+def build_version_index(
+        miui_data: Dict[str, List[MiuiRom]]
+) -> Tuple[Dict[Tuple[str, str], RomVersion], Dict[str, List[RomVersion]]]:
+    """Build the (codename, normalized version) -> RomVersion map and the per-device version lists.
+
+    Both the 'version' and 'miui' fields of a ROM are keys of the map. Version
+    lists are sorted newest release first and hold each version once.
+    """
+    version_index = {}
+    versions_by_device = {}
+
+    for codename, roms in miui_data.items():
+        # Newest first; ROMs without a date go last, upstream order breaks ties
+        ordered = sorted(roms, key=lambda rom: rom.date or '', reverse=True)
+
+        versions = []
+        for rom in ordered:
+            version = rom.version or rom.miui
+            if not version:
+                continue
+            android = rom.android
+            rom_version = RomVersion(version, android, f"{version} (Android {android or '?'})")
+
+            if (codename, normalize_version(version)) not in version_index:
+                versions.append(rom_version)
+            for field in (rom.version, rom.miui):
+                if field:
+                    version_index.setdefault((codename, normalize_version(field)), rom_version)
+
+        versions_by_device[codename] = versions
+
+    return version_index, versions_by_device